@@ -0,0 +1,571 @@
+import os
+import ast
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .code_checks import PrecheckError
+
+logger = logging.getLogger(__name__)
+
+# Generated pandas code is rewritten before it runs: slow patterns with an exact vectorized
+# equivalent are replaced (sort_values(...).head(n) -> nlargest, row-wise apply -> column
+# arithmetic, filters on group keys -> before the groupby), and code whose estimated cost on the
+# dataset is clearly over the execution limits is rejected with a hint for the repair prompt.
+CODE_OPTIMIZER = os.getenv("CODE_OPTIMIZER", "1") == "1"
+# Largest n of a sort_values(...).head(n) rewritten to nlargest (a partial sort stops paying off)
+NLARGEST_MAX_N = 1000
+# Estimated seconds per row of Python-level row loops, measured on pandas 3 (rows with mixed dtypes)
+_ROW_LOOP_SECONDS = {"iterrows": 40e-6, "itertuples": 5e-6, "apply": 15e-6, "range": 20e-6}
+# Group reductions whose result for a group depends only on the group's rows
+_GROUP_REDUCTIONS = {"sum", "mean", "median", "min", "max", "count", "size", "nunique", "std", "var", "sem",
+                     "first", "last", "prod", "describe", "quantile"}
+# df methods that change df in place
+_MUTATORS = {"insert", "pop", "update"}
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult)
+_DIVISIONS = (ast.Div, ast.FloorDiv, ast.Mod)
+_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _is_name(node: ast.AST, name: str = "df") -> bool:
+    return isinstance(node, ast.Name) and node.id == name
+
+
+def _column_names(node: Optional[ast.AST]) -> Optional[list]:
+    # A string constant or a list of string constants; None for anything else
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.List) and node.elts and all(isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts):
+        return [e.value for e in node.elts]
+    return None
+
+
+def _keyword(call: ast.Call, name: str) -> Optional[ast.AST]:
+    return next((kw.value for kw in call.keywords if kw.arg == name), None)
+
+
+def _constant(node: Optional[ast.AST], default: Any = None) -> Any:
+    # The value of a constant argument, default when it is missing, and Ellipsis when it is computed
+    return default if node is None else node.value if isinstance(node, ast.Constant) else ...
+
+
+def _stable_dtypes(tree: ast.AST, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    dtypes of the df columns the code never writes, which keep the dataset's dtypes throughout.
+    Empty when the code rebinds or aliases df or changes it in place.
+    """
+    assigned = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "df" and isinstance(node.ctx, ast.Store):
+            return {}
+        if isinstance(node, ast.Assign) and _is_name(node.value):
+            return {}
+        if isinstance(node, ast.keyword) and node.arg == "inplace":
+            return {}
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and _is_name(node.func.value) and node.func.attr in _MUTATORS:
+            return {}
+        if isinstance(node, ast.Subscript) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            if _is_name(node.value):
+                names = _column_names(node.slice)
+                if names is None:
+                    return {}
+                assigned.update(names)
+            elif isinstance(node.value, ast.Attribute) and _is_name(node.value.value):
+                # df.loc[...] = ..., df.at[...] = ...
+                return {}
+    return {column: dtype for column, dtype in df.dtypes.items() if isinstance(column, str) and column not in assigned}
+
+
+def _is_mask(node: ast.AST) -> bool:
+    # Row filters: df[df['a'] > 1], df[(...) & (...)], df[~...], df[df['a'].isin(...)]
+    return isinstance(node, (ast.Compare, ast.UnaryOp, ast.Call)) or (
+        isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)))
+
+
+def _frame_dtypes(node: ast.AST, dtypes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Column dtypes of a frame expression that has df's rows or a subset of them: df, df[mask],
+    df.loc[mask] and df[[columns]]. None for anything else.
+    """
+    if not dtypes:
+        return None
+    if _is_name(node):
+        return dtypes
+    if isinstance(node, ast.Subscript):
+        if _is_name(node.value):
+            names = _column_names(node.slice)
+            if isinstance(node.slice, ast.List) and names:
+                return {name: dtypes[name] for name in names} if all(name in dtypes for name in names) else None
+            return dtypes if _is_mask(node.slice) else None
+        if isinstance(node.value, ast.Attribute) and node.value.attr == "loc" and _is_name(node.value.value) and _is_mask(node.slice):
+            return dtypes
+    return None
+
+
+def _sortable(dtype: Any) -> bool:
+    # Dtypes nlargest accepts with the same order as sort_values: numpy integers and floats
+    return isinstance(dtype, np.dtype) and dtype.kind in "iuf"
+
+
+def _call(func: ast.expr, attr: str, args: List[ast.expr], keywords: Optional[List[ast.keyword]] = None) -> ast.Call:
+    return ast.Call(func=ast.Attribute(value=func, attr=attr, ctx=ast.Load()), args=args, keywords=keywords or [])
+
+
+def _column(frame: ast.expr, column: str) -> ast.Subscript:
+    return ast.Subscript(value=frame, slice=ast.Constant(column), ctx=ast.Load())
+
+
+class _Vectorizer:
+    """
+    Translates the body of a lambda applied per row (mode 'row': df.apply(lambda row: ..., axis=1))
+    or per value (mode 'value': df['a'].apply(lambda x: ...)) into the same expression over whole
+    columns. Only arithmetic, comparisons and and/or/not of columns and constants are translated,
+    where the vectorized operation gives the same values and dtype as the per-element one. In both
+    modes the lambda sees Python ints and floats: they do not overflow, so integer columns are
+    widened to int64 first, and they raise on division by zero, so only divisors that are never
+    zero (nonzero constants, columns of df without zeros) are translated.
+    """
+
+    def __init__(self, mode: str, param: str, frame: ast.expr, df: pd.DataFrame, dtypes: Dict[str, Any], column: Optional[str] = None):
+        self.mode, self.param, self.frame, self.df, self.dtypes, self.column = mode, param, frame, df, dtypes, column
+        self.uses_param = False
+
+    def _reference(self, node: ast.expr) -> Optional[str]:
+        # Column a reference to the lambda's parameter stands for
+        if self.mode == "value":
+            return self.column if _is_name(node, self.param) else None
+        if isinstance(node, ast.Subscript) and _is_name(node.value, self.param):
+            names = _column_names(node.slice)
+            return names[0] if names and isinstance(node.slice, ast.Constant) else None
+        if isinstance(node, ast.Attribute) and _is_name(node.value, self.param) and not hasattr(pd.Series, node.attr):
+            return node.attr
+        return None
+
+    def _leaf(self, column: str) -> Optional[Tuple[ast.expr, str]]:
+        dtype = self.dtypes.get(column)
+        if dtype is None:
+            return None
+        source = _column(self.frame, column)
+        if isinstance(dtype, np.dtype) and dtype.kind == "i":
+            return (_call(source, "astype", [ast.Constant("int64")]) if dtype != np.int64 else source), "int"
+        if isinstance(dtype, np.dtype) and dtype == np.float64:
+            return source, "float"
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype):
+            return source, "text"
+        return None
+
+    def _nonzero(self, node: ast.expr) -> bool:
+        # A divisor that is never zero: a nonzero number, or a column without zeros in df
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, (int, float)) and not isinstance(node.value, bool) and node.value != 0
+        column = self._reference(node)
+        return column is not None and column in self.df.columns and not (self.df[column] == 0).any()
+
+    def translate(self, node: ast.expr) -> Optional[Tuple[ast.expr, str]]:
+        """(vectorized expression, kind) or None; kind is 'int', 'float', 'bool', 'text' or 'str'."""
+        column = self._reference(node)
+        if column is not None:
+            self.uses_param = True
+            return self._leaf(column)
+        if isinstance(node, ast.Constant) and not isinstance(node.value, bool):
+            if isinstance(node.value, int):
+                return node, "int"
+            if isinstance(node.value, float):
+                return node, "float"
+            if isinstance(node.value, str):
+                return node, "str"
+            return None
+        if isinstance(node, ast.UnaryOp):
+            operand = self.translate(node.operand)
+            if operand is None:
+                return None
+            if isinstance(node.op, ast.USub) and operand[1] in ("int", "float"):
+                return ast.UnaryOp(op=ast.USub(), operand=operand[0]), operand[1]
+            if isinstance(node.op, ast.Not) and operand[1] == "bool":
+                return ast.UnaryOp(op=ast.Invert(), operand=operand[0]), "bool"
+            return None
+        if isinstance(node, ast.BinOp):
+            left, right = self.translate(node.left), self.translate(node.right)
+            if left is None or right is None or left[1] not in ("int", "float") or right[1] not in ("int", "float"):
+                return None
+            if not isinstance(node.op, _ARITHMETIC) and not (isinstance(node.op, _DIVISIONS) and self._nonzero(node.right)):
+                return None
+            kind = "float" if isinstance(node.op, ast.Div) or "float" in (left[1], right[1]) else "int"
+            return ast.BinOp(left=left[0], op=node.op, right=right[0]), kind
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], _COMPARISONS):
+            left, right = self.translate(node.left), self.translate(node.comparators[0])
+            if left is None or right is None:
+                return None
+            kinds = {left[1], right[1]}
+            numeric = kinds <= {"int", "float"}
+            text = kinds == {"text", "str"} and isinstance(node.ops[0], (ast.Eq, ast.NotEq))
+            if not (numeric or text):
+                return None
+            return ast.Compare(left=left[0], ops=node.ops, comparators=[right[0]]), "bool"
+        if isinstance(node, ast.BoolOp):
+            values = [self.translate(value) for value in node.values]
+            if any(value is None or value[1] != "bool" for value in values):
+                return None
+            op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+            result = values[0][0]
+            for value in values[1:]:
+                result = ast.BinOp(left=result, op=op, right=value[0])
+            return result, "bool"
+        return None
+
+
+class _Rewriter(ast.NodeTransformer):
+    """Applies the rewrites to a parsed module and records them as 'name (line n)'."""
+
+    def __init__(self, df: pd.DataFrame, dtypes: Dict[str, Any]):
+        self.df = df
+        self.dtypes = dtypes
+        self.rewrites: List[Tuple[str, str]] = []
+
+    def _record(self, kind: str, node: ast.AST):
+        self.rewrites.append((kind, f"{kind} (line {getattr(node, 'lineno', '?')})"))
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        node = self.generic_visit(node)
+        for rewrite in (self._top_n, self._get_group, self._row_apply, self._value_apply):
+            new = rewrite(node)
+            if new is not None:
+                return ast.copy_location(new, node)
+        return node
+
+    def visit_Subscript(self, node: ast.Subscript) -> ast.AST:
+        node = self.generic_visit(node)
+        if isinstance(node.ctx, ast.Load):
+            for rewrite in (self._top_n_slice, self._group_key_pushdown):
+                new = rewrite(node)
+                if new is not None:
+                    return ast.copy_location(new, node)
+        return node
+
+    def _no_nans(self, columns: List[str]) -> bool:
+        return all(self.dtypes[column].kind in "iu" or not self.df[column].hasnans for column in columns)
+
+    def _nlargest(self, sort: ast.AST, n: Any, head: ast.AST) -> Optional[ast.Call]:
+        # X.sort_values(by, ascending=...) followed by the first n rows -> X.nlargest / X.nsmallest.
+        # Among rows tied at the cut, nlargest keeps the first in row order, where the default
+        # (unstable) sort picks any of them.
+        if not (isinstance(sort, ast.Call) and isinstance(sort.func, ast.Attribute) and sort.func.attr == "sort_values"):
+            return None
+        if not isinstance(n, int) or isinstance(n, bool) or not 0 <= n <= NLARGEST_MAX_N:
+            return None
+        if any(kw.arg not in ("by", "ascending") for kw in sort.keywords) or len(sort.args) > 1:
+            return None
+        receiver = sort.func.value
+        by = sort.args[0] if sort.args else _keyword(sort, "by")
+        if by is not None:
+            frame, columns = _frame_dtypes(receiver, self.dtypes), _column_names(by)
+            args = [ast.Constant(n), by]
+        elif isinstance(receiver, ast.Subscript) and isinstance(receiver.slice, ast.Constant):
+            # A column: df['a'].sort_values(ascending=False).head(n)
+            frame, columns = _frame_dtypes(receiver.value, self.dtypes), _column_names(receiver.slice)
+            args = [ast.Constant(n)]
+        else:
+            return None
+        if frame is None or not columns or not all(column in frame and _sortable(frame[column]) for column in columns):
+            return None
+        order = _keyword(sort, "ascending")
+        # One direction for all the columns: ascending=False or ascending=[False, False]
+        flags = [_constant(e) for e in order.elts] if isinstance(order, ast.List) else [_constant(order, True)] * len(columns)
+        ascending = flags[0]
+        if len(flags) != len(columns) or not isinstance(ascending, bool) or any(flag is not ascending for flag in flags):
+            return None
+        if not self._no_nans(columns):
+            return None
+        self._record("sort_values+head -> nlargest" if not ascending else "sort_values+head -> nsmallest", head)
+        return _call(receiver, "nsmallest" if ascending else "nlargest", args)
+
+    def _top_n(self, node: ast.Call) -> Optional[ast.AST]:
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr == "head" and not node.keywords and len(node.args) <= 1):
+            return None
+        n = _constant(node.args[0]) if node.args else 5
+        return self._nlargest(node.func.value, n, node)
+
+    def _top_n_slice(self, node: ast.Subscript) -> Optional[ast.AST]:
+        # X.sort_values(...).iloc[:n]
+        if not (isinstance(node.value, ast.Attribute) and node.value.attr == "iloc" and isinstance(node.slice, ast.Slice)):
+            return None
+        s = node.slice
+        if s.lower is not None and _constant(s.lower) != 0 or s.step is not None or s.upper is None:
+            return None
+        return self._nlargest(node.value.value, _constant(s.upper), node)
+
+    def _group_key(self, groupby: ast.AST) -> Optional[Tuple[ast.expr, str]]:
+        # (X, key) of X.groupby('key', ...) over a frame with df's columns, grouping into the index
+        if not (isinstance(groupby, ast.Call) and isinstance(groupby.func, ast.Attribute) and groupby.func.attr == "groupby"):
+            return None
+        receiver = groupby.func.value
+        key = groupby.args[0] if groupby.args else _keyword(groupby, "by")
+        if len(groupby.args) > 1 or any(kw.arg not in ("by", "observed", "sort", "dropna") for kw in groupby.keywords):
+            return None
+        frame = _frame_dtypes(receiver, self.dtypes)
+        if not isinstance(receiver, ast.Name) or frame is None or not isinstance(key, ast.Constant) or key.value not in frame:
+            return None
+        dtype = frame[key.value]
+        if not (isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype)
+                or (pd.api.types.is_numeric_dtype(dtype) and dtype.kind in "biuf")):
+            # .loc on a datetime, timedelta or period index also matches partial strings
+            # ('2024' is every group of that year), which equality does not
+            return None
+        return receiver, key.value
+
+    def _filtered(self, receiver: ast.expr, key: str, value: ast.expr, columns: Optional[List[str]] = None) -> ast.Subscript:
+        # X[X['k'] == v], or X.loc[X['k'] == v, columns] to take only the columns used
+        mask = ast.Compare(left=_column(receiver, key), ops=[ast.Eq()], comparators=[value])
+        if columns is None:
+            return ast.Subscript(value=receiver, slice=mask, ctx=ast.Load())
+        selection = ast.List(elts=[ast.Constant(c) for c in columns], ctx=ast.Load())
+        return ast.Subscript(value=ast.Attribute(value=receiver, attr="loc", ctx=ast.Load()),
+                             slice=ast.Tuple(elts=[mask, selection], ctx=ast.Load()), ctx=ast.Load())
+
+    @staticmethod
+    def _key_value(node: ast.expr) -> bool:
+        # A single group: a string or number constant, not NaN. Selecting several groups keeps too
+        # many rows for the filter to pay off.
+        return (isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float))
+                and not isinstance(node.value, bool) and node.value == node.value)
+
+    def _group_key_pushdown(self, node: ast.Subscript) -> Optional[ast.AST]:
+        # X.groupby('k')['a'].sum().loc['v'] -> X.loc[X['k'] == 'v', ['k', 'a']].groupby('k')['a'].sum().loc['v']:
+        # only the rows and columns of group 'v' are taken, and it sees the same
+        # rows in the same order. Filtering pays only with the columns narrowed, so the reduction
+        # must name its columns (a selection, or size).
+        if not (isinstance(node.value, ast.Attribute) and node.value.attr == "loc" and self._key_value(node.slice)):
+            return None
+        reduction = node.value.value
+        if not (isinstance(reduction, ast.Call) and isinstance(reduction.func, ast.Attribute) and reduction.func.attr in _GROUP_REDUCTIONS):
+            return None
+        grouped = reduction.func.value
+        if isinstance(grouped, ast.Subscript):
+            # A column selection: X.groupby('k')['a'] or X.groupby('k')[['a', 'b']]
+            selected, grouped = _column_names(grouped.slice), grouped.value
+        else:
+            selected = [] if reduction.func.attr == "size" else None
+        found = self._group_key(grouped)
+        if found is None or selected is None:
+            return None
+        receiver, key = found
+        columns = list(dict.fromkeys([key, *selected]))
+        grouped.func.value = self._filtered(receiver, key, node.slice, columns)
+        self._record("filter on group key -> before groupby", node)
+        return node
+
+    def _get_group(self, node: ast.Call) -> Optional[ast.AST]:
+        # X.groupby('k').get_group('v') -> X[X['k'] == 'v'], only for a group that exists:
+        # get_group raises KeyError for a missing one where the filter would be empty
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr == "get_group" and len(node.args) == 1 and not node.keywords):
+            return None
+        found = self._group_key(node.func.value)
+        value = node.args[0]
+        if found is None or not self._key_value(value) or not (self.df[found[1]] == value.value).any():
+            return None
+        self._record("groupby+get_group -> filter", node)
+        return self._filtered(*found, value)
+
+    @staticmethod
+    def _lambda(node: ast.Call) -> Optional[Tuple[str, ast.expr]]:
+        if len(node.args) != 1 or not isinstance(node.args[0], ast.Lambda):
+            return None
+        arguments = node.args[0].args
+        if len(arguments.args) != 1 or arguments.vararg or arguments.kwarg or arguments.kwonlyargs or arguments.posonlyargs:
+            return None
+        return arguments.args[0].arg, node.args[0].body
+
+    def _row_apply(self, node: ast.Call) -> Optional[ast.AST]:
+        # df.apply(lambda row: row['a'] * row['b'], axis=1) -> (df['a'] * df['b']).rename(None).
+        # Rows of a frame with text columns hold Python scalars, the same as Series.apply.
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr == "apply" and _is_name(node.func.value)):
+            return None
+        axis = _keyword(node, "axis")
+        if len(node.keywords) != 1 or _constant(axis) not in (1, "columns") or not self.dtypes or len(self.df) == 0:
+            return None
+        if all(pd.api.types.is_numeric_dtype(dtype) for dtype in self.df.dtypes):
+            # Rows of an all-numeric frame are upcast to one dtype
+            return None
+        found = self._lambda(node)
+        if found is None:
+            return None
+        vectorizer = _Vectorizer("row", found[0], node.func.value, self.df, self.dtypes)
+        translated = vectorizer.translate(found[1])
+        if translated is None or not vectorizer.uses_param or translated[1] not in ("int", "float", "bool"):
+            return None
+        self._record("apply(axis=1) -> column arithmetic", node)
+        return _call(translated[0], "rename", [ast.Constant(None)])
+
+    def _value_apply(self, node: ast.Call) -> Optional[ast.AST]:
+        # df['a'].apply(lambda x: x * 2) (or .map) -> df['a'].astype('int64') * 2
+        if not (isinstance(node.func, ast.Attribute) and node.func.attr in ("apply", "map") and not node.keywords):
+            return None
+        receiver = node.func.value
+        if not (isinstance(receiver, ast.Subscript) and isinstance(receiver.slice, ast.Constant) and isinstance(receiver.slice.value, str)):
+            return None
+        column = receiver.slice.value
+        if _frame_dtypes(receiver.value, self.dtypes) is None or column not in self.dtypes or not isinstance(receiver.value, ast.Name):
+            return None
+        found = self._lambda(node)
+        if found is None:
+            return None
+        if isinstance(self.dtypes[column], pd.CategoricalDtype):
+            # Series.map of a categorical maps its categories and can return a categorical
+            return None
+        vectorizer = _Vectorizer("value", found[0], receiver.value, self.df, self.dtypes, column)
+        translated = vectorizer.translate(found[1])
+        if translated is None or not vectorizer.uses_param or translated[1] not in ("int", "float", "bool"):
+            return None
+        self._record(f"{node.func.attr}(lambda) -> column arithmetic", node)
+        return translated[0]
+
+
+def _loop_estimates(tree: ast.AST, rows: int, dtypes: Dict[str, Any]) -> List[Tuple[str, int, float]]:
+    # (pattern, line, estimated seconds) of the Python-level loops over all the rows of df
+    estimates = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and _is_name(node.func.value):
+            if node.func.attr in ("iterrows", "itertuples"):
+                estimates.append((f"df.{node.func.attr}()", node.lineno, rows * _ROW_LOOP_SECONDS[node.func.attr]))
+            elif node.func.attr == "apply" and _constant(_keyword(node, "axis")) in (1, "columns"):
+                estimates.append(("df.apply(..., axis=1)", node.lineno, rows * _ROW_LOOP_SECONDS["apply"]))
+        elif (isinstance(node, ast.For) and isinstance(node.iter, ast.Call) and _is_name(node.iter.func, "range")
+              and len(node.iter.args) == 1 and isinstance(node.iter.args[0], ast.Call)
+              and _is_name(node.iter.args[0].func, "len") and node.iter.args[0].args and _is_name(node.iter.args[0].args[0])):
+            estimates.append(("for ... in range(len(df))", node.lineno, rows * _ROW_LOOP_SECONDS["range"]))
+    return estimates
+
+
+def _merge_rows(df: pd.DataFrame, node: ast.Call, dtypes: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """
+    (estimated rows, bytes per row) of a merge of df with itself or with one of its column
+    subsets: exact from the key counts for inner merges on columns, the product for cross merges.
+    None when a side or the keys are not known.
+    """
+    if not (isinstance(node.func, ast.Attribute) and node.func.attr == "merge"):
+        return None
+    if _is_name(node.func.value, "pd") and len(node.args) >= 2:
+        left, right, options = node.args[0], node.args[1], node.args[2:]
+    elif not _is_name(node.func.value, "pd") and len(node.args) >= 1:
+        left, right, options = node.func.value, node.args[0], node.args[1:]
+    else:
+        return None
+    sides = []
+    for side in (left, right):
+        if _is_name(side):
+            sides.append(list(dtypes))
+        elif isinstance(side, ast.Subscript) and _is_name(side.value) and isinstance(side.slice, ast.List):
+            sides.append(_column_names(side.slice))
+        else:
+            return None
+    if options or any(column is None or column not in dtypes for side in sides for column in side):
+        return None
+    width = sum(int(df[column].memory_usage(index=False, deep=False)) for side in sides for column in side) / max(len(df), 1)
+    how = _constant(_keyword(node, "how"), "inner")
+    if how == "cross":
+        return len(df) ** 2, int(width)
+    on = _keyword(node, "on")
+    left_on, right_on = _keyword(node, "left_on"), _keyword(node, "right_on")
+    if on is not None:
+        left_keys = right_keys = _column_names(on)
+    else:
+        left_keys, right_keys = _column_names(left_on), _column_names(right_on)
+    if not left_keys or left_keys != right_keys or how not in ("inner", "left", "right", "outer") or not all(key in sides[0] and key in sides[1] for key in left_keys):
+        return None
+    counts = df.groupby(left_keys, observed=True, dropna=False).size().to_numpy(dtype=np.float64)
+    return int((counts ** 2).sum()), int(width)
+
+
+def check_cost(tree: ast.AST, df: pd.DataFrame, timeout: float, max_bytes: float, dtypes: Optional[Dict[str, Any]] = None):
+    """
+    Rejects code with an operation clearly over the execution limits on this dataset: a row loop
+    estimated to take longer than `timeout` seconds, or a merge of df with itself estimated to
+    produce more than `max_bytes` (0 disables either check). Raises PrecheckError('cost').
+    """
+    dtypes = _stable_dtypes(tree, df) if dtypes is None else dtypes
+    rows = len(df)
+    if timeout:
+        for pattern, line, seconds in _loop_estimates(tree, rows, dtypes):
+            if seconds > timeout:
+                optimizer_stats.rejected("row_loop")
+                raise PrecheckError("cost", f"{pattern} (line {line}) loops in Python over the {rows:,} rows of df, an "
+                                    f"estimated {seconds:.0f}s over the {timeout:g}s limit. Use vectorized column "
+                                    "operations (arithmetic on whole columns, np.where, groupby) instead.")
+    if max_bytes:
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            estimate = _merge_rows(df, node, dtypes)
+            if estimate is not None and estimate[0] * estimate[1] > max_bytes:
+                optimizer_stats.rejected("merge")
+                raise PrecheckError("cost", f"The merge on line {node.lineno} would produce about {estimate[0]:,} rows "
+                                    f"(~{estimate[0] * estimate[1] / 2**30:,.1f} GB), over the memory limit. Aggregate df "
+                                    "first and merge the aggregates, or use groupby/transform instead of merging df with itself.")
+
+
+def optimize_code(code: str, df: pd.DataFrame, timeout: float = 0, max_bytes: float = 0) -> Tuple[str, List[str]]:
+    """
+    Static pass over generated pandas code before it runs on df: returns the code with slow
+    patterns rewritten to their vectorized equivalents, and the rewrites made ('pattern (line n)').
+    Code that does not parse is returned as is. Raises PrecheckError('cost') for code estimated
+    to exceed the limits (see check_cost).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, []
+    optimizer_stats.count("checked")
+    dtypes = _stable_dtypes(tree, df)
+    rewriter = _Rewriter(df, dtypes)
+    try:
+        tree = ast.fix_missing_locations(rewriter.visit(tree))
+    except Exception as e:
+        # A rewrite that does not apply to this code; run it as written
+        logger.warning(f"Code optimizer failed, running the code as written: {e!r}")
+        rewriter.rewrites, tree = [], ast.parse(code)
+    check_cost(tree, df, timeout, max_bytes, dtypes)
+    if not rewriter.rewrites:
+        return code, []
+    optimized = ast.unparse(tree)
+    optimizer_stats.count("rewritten")
+    for kind, _ in rewriter.rewrites:
+        optimizer_stats.rewrite(kind)
+    rewrites = [description for _, description in rewriter.rewrites]
+    logger.info(f"Optimized generated code ({'; '.join(rewrites)}):\n{optimized}")
+    return optimized, rewrites
+
+
+class OptimizerStats:
+    """
+    Per-process counters of the optimizer: code checked and rewritten, rewrites per pattern,
+    rejections per reason, and rewritten code that failed where the code as written ran.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"checked": 0, "rewritten": 0, "fallbacks": 0}
+        self.rewrites: Dict[str, int] = defaultdict(int)
+        self.rejections: Dict[str, int] = defaultdict(int)
+
+    def count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def rewrite(self, kind: str):
+        with self._lock:
+            self.rewrites[kind] += 1
+
+    def rejected(self, reason: str):
+        with self._lock:
+            self.rejections[reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": CODE_OPTIMIZER, **self.counters, "rewrites": dict(self.rewrites), "rejections": dict(self.rejections)}
+
+
+optimizer_stats = OptimizerStats()
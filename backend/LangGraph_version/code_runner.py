@@ -0,0 +1,334 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from . import session_store
+from .code_checks import generated_code_lines, ExecutionLimitError
+from .code_optimizer import CODE_OPTIMIZER, optimize_code, optimizer_stats
+from .result_cache import result_cache
+from .sql_engine import execute_sql
+
+logger = logging.getLogger(__name__)
+
+# Generated pandas code runs on this many threads (or worker processes) so it never blocks the event loop
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", str(min(8, os.cpu_count() or 1))))
+# 'process' runs generated code in a pool of warm worker processes, each execution under a
+# wall-clock timeout and a memory cap, so a runaway query can neither hold the GIL nor the memory
+# of the API process. 'thread' runs it on threads of the API process, without limits.
+# Workers contain resource use; they are not a security boundary.
+EXEC_MODE = os.getenv("EXEC_MODE", "process")
+EXEC_TIMEOUT_SECONDS = float(os.getenv("EXEC_TIMEOUT_SECONDS", "30"))
+# Memory one execution may allocate, in MB (0 disables the cap). This is the worker's anonymous
+# RSS: pages of the memory-mapped dataset are shared with the other processes and not counted.
+EXEC_MAX_RSS_MB = int(os.getenv("EXEC_MAX_RSS_MB", "2048"))
+# Datasets a worker keeps memory-mapped between executions
+EXEC_WORKER_DATASETS = 4
+# Interval of the timeout and memory checks while an execution runs
+EXEC_POLL_SECONDS = 0.05
+# 'view' hands generated code a copy-on-write view of the dataset: its writes copy only the columns
+# they touch and never reach the cached frame, and arrays it takes from df are read-only.
+# 'copy' duplicates the whole frame before every execution.
+EXEC_DATA = os.getenv("EXEC_DATA", "view")
+
+_pool = ThreadPoolExecutor(max_workers=EXEC_WORKERS, thread_name_prefix="exec")
+
+
+def _copy_on_write() -> bool:
+    # Always on from pandas 3; an option in pandas 2
+    return int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+
+
+def protected_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The frame generated code gets in place of df: a shallow copy when copy-on-write protects df
+    from its writes (EXEC_DATA=view), else a full copy.
+    """
+    if EXEC_DATA == "view" and _copy_on_write():
+        return df.copy(deep=False)
+    return df.copy()
+
+
+def execute_code(code: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Runs LLM-generated pandas code against a protected view or copy of df (see protected_frame)
+    and returns its 'result_df'.
+    """
+    local_scope = {'df': protected_frame(df), 'pd': pd}
+    exec(code, {}, local_scope)
+    result_df = local_scope.get('result_df')
+    if result_df is None:
+        raise ValueError("Code did not produce a 'result_df' dataframe.")
+    return result_df
+
+
+def _worker_main(conn):
+    """
+    Execution worker loop: receives (code, dataset_key, df) and replies (ok, result_df or
+    exception, generated code lines of the traceback). A dataset_key is memory-mapped from the
+    session store once and kept attached; without one the frame itself is sent.
+    """
+    datasets: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+    if EXEC_DATA == "view" and not _copy_on_write():
+        # Workers only run generated code, so pandas 2 can be switched to copy-on-write here
+        pd.set_option("mode.copy_on_write", True)
+    # Ready: the imports are done
+    conn.send(None)
+    while True:
+        try:
+            code, dataset_key, df = conn.recv()
+        except EOFError:
+            return
+        try:
+            if dataset_key is not None:
+                if dataset_key not in datasets:
+                    datasets[dataset_key] = session_store.load_dataframe(dataset_key)
+                    while len(datasets) > EXEC_WORKER_DATASETS:
+                        datasets.popitem(last=False)
+                datasets.move_to_end(dataset_key)
+                df = datasets[dataset_key]
+            reply = (True, execute_code(code, df), None)
+        except Exception as e:
+            reply = (False, e, generated_code_lines(e))
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The result or the exception cannot be pickled
+            conn.send((False, RuntimeError(f"The result could not be returned from the worker: {e!r}"), reply[2]))
+
+
+def _anonymous_rss_mb(pid: int) -> Optional[float]:
+    # Linux only; elsewhere the memory cap is not enforced
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True, name="exec-worker")
+        self.process.start()
+        child.close()
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.process.join()
+            raise RuntimeError(f"The execution worker exited on start (exit code {self.process.exitcode})")
+        # Datasets the worker has attached, for routing executions to a worker that has their data
+        self.datasets: "OrderedDict[str, None]" = OrderedDict()
+
+    def attached(self, dataset_key: str):
+        self.datasets[dataset_key] = None
+        self.datasets.move_to_end(dataset_key)
+        while len(self.datasets) > EXEC_WORKER_DATASETS:
+            self.datasets.popitem(last=False)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessSandbox:
+    """
+    Pool of up to `workers` execution processes, started on first use (or by start()) and reused.
+    An execution over the wall-clock timeout or the memory cap kills its worker, which is replaced
+    in the background, and raises ExecutionLimitError. Executions go preferably to a worker that
+    already has their dataset attached.
+    """
+
+    def __init__(self, workers: int = EXEC_WORKERS, timeout: float = EXEC_TIMEOUT_SECONDS, max_rss_mb: int = EXEC_MAX_RSS_MB):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        # spawn: the API process runs threads, which fork() does not copy safely
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._started = 0
+        self._cond = threading.Condition()
+        self.stats = {"executions": 0, "errors": 0, "timeouts": 0, "memory_kills": 0, "crashes": 0,
+                      "worker_starts": 0, "dataset_attaches": 0}
+
+    def _count(self, counter: str):
+        with self._cond:
+            self.stats[counter] += 1
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self._context)
+        self._count("worker_starts")
+        return worker
+
+    def _replace_worker(self):
+        try:
+            worker = self._start_worker()
+        except Exception as e:
+            logger.error(f"Could not start an execution worker: {e!r}")
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            return
+        self._release(worker)
+
+    def start(self):
+        """Starts the missing workers in the background, so the first executions find them warm."""
+        with self._cond:
+            missing = self.workers - self._started
+            self._started = self.workers
+        for _ in range(missing):
+            threading.Thread(target=self._replace_worker, daemon=True).start()
+
+    def _acquire(self, dataset_key: Optional[str]) -> _Worker:
+        with self._cond:
+            while not self._idle and self._started >= self.workers:
+                self._cond.wait()
+            if self._idle:
+                worker = next((w for w in self._idle if dataset_key in w.datasets), self._idle[-1])
+                self._idle.remove(worker)
+                return worker
+            self._started += 1
+        try:
+            return self._start_worker()
+        except Exception:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker: _Worker):
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker: _Worker):
+        worker.kill()
+        threading.Thread(target=self._replace_worker, daemon=True).start()
+
+    def _stop(self, worker: _Worker, counter: str, message: str) -> ExecutionLimitError:
+        self._discard(worker)
+        self._count(counter)
+        logger.warning(message)
+        return ExecutionLimitError(message)
+
+    def execute(self, code: str, df: pd.DataFrame, dataset_key: Optional[str] = None) -> pd.DataFrame:
+        """
+        Runs execute_code in a worker and returns its result_df; blocks until it is done.
+        With a dataset_key in the session store, the worker memory-maps that dataset instead of
+        receiving df. Exceptions of the code are re-raised here.
+        """
+        if dataset_key is not None and not session_store.has_dataframe(dataset_key):
+            dataset_key = None
+        worker = self._acquire(dataset_key)
+        self._count("executions")
+        if dataset_key is not None and dataset_key not in worker.datasets:
+            self._count("dataset_attaches")
+        try:
+            worker.conn.send((code, dataset_key, None if dataset_key is not None else df))
+            deadline = time.monotonic() + self.timeout
+            while not worker.conn.poll(EXEC_POLL_SECONDS):
+                if time.monotonic() > deadline:
+                    raise self._stop(worker, "timeouts", f"Execution stopped after {self.timeout:g}s. Avoid row-by-row "
+                                     "loops (iterrows, apply with axis=1) and merges that multiply rows.")
+                rss = _anonymous_rss_mb(worker.process.pid) if self.max_rss_mb else None
+                if rss is not None and rss > self.max_rss_mb:
+                    raise self._stop(worker, "memory_kills", f"Execution stopped after allocating more than {self.max_rss_mb} MB "
+                                     "of memory. Aggregate or filter before building large intermediate tables.")
+            ok, result, lines = worker.conn.recv()
+        except ExecutionLimitError:
+            raise
+        except (EOFError, OSError):
+            # The worker died (e.g. killed by the OS for memory)
+            raise self._stop(worker, "crashes", "The execution worker exited unexpectedly.")
+        except BaseException:
+            # E.g. df could not be pickled: the worker may hold a partial request
+            self._discard(worker)
+            raise
+        if dataset_key is not None:
+            worker.attached(dataset_key)
+        self._release(worker)
+        if not ok:
+            self._count("errors")
+            result.generated_code_lines = lines
+            raise result
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"workers": self.workers, "started": self._started, "idle": len(self._idle),
+                    "timeout_seconds": self.timeout, "max_rss_mb": self.max_rss_mb, **self.stats}
+
+
+sandbox = ProcessSandbox() if EXEC_MODE == "process" else None
+
+
+def start_exec_workers():
+    """Warms up the execution workers (a no-op in thread mode)."""
+    if sandbox is not None:
+        sandbox.start()
+
+
+def get_exec_stats() -> Dict[str, Any]:
+    return {"mode": EXEC_MODE, **(sandbox.get_stats() if sandbox is not None else {}), "optimizer": optimizer_stats.get_stats()}
+
+
+def _execute_pandas(code: str, df: pd.DataFrame, dataset_key: Optional[str]) -> pd.DataFrame:
+    return sandbox.execute(code, df, dataset_key) if sandbox is not None else execute_code(code, df)
+
+
+def _execute_optimized(code: str, df: pd.DataFrame, dataset_key: Optional[str]) -> pd.DataFrame:
+    # The rewrites give the same result as the code as written; should rewritten code still fail,
+    # the code as written runs, so errors shown to the model are always those of its own code
+    optimized, rewrites = optimize_code(code, df, EXEC_TIMEOUT_SECONDS, EXEC_MAX_RSS_MB * 2**20)
+    if not rewrites:
+        return _execute_pandas(code, df, dataset_key)
+    try:
+        return _execute_pandas(optimized, df, dataset_key)
+    except ExecutionLimitError:
+        raise
+    except Exception as e:
+        optimizer_stats.count("fallbacks")
+        logger.warning(f"Optimized code failed ({e!r}), running the code as written")
+        return _execute_pandas(code, df, dataset_key)
+
+
+def _run_cached(code: str, df: pd.DataFrame, dataset_key: Optional[str], engine: str) -> pd.DataFrame:
+    # Without a dataset_key the data has no version to key the result on
+    key = result_cache.make_key(dataset_key, code, engine) if dataset_key is not None else None
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    if engine == "sql":
+        # DuckDB runs outside the GIL and interrupts itself at the timeout, so it needs no worker
+        result = execute_sql(code, df, dataset_key, timeout=EXEC_TIMEOUT_SECONDS)
+    elif CODE_OPTIMIZER:
+        result = _execute_optimized(code, df, dataset_key)
+    else:
+        result = _execute_pandas(code, df, dataset_key)
+    result_cache.put(key, result, time.perf_counter() - start)
+    return result
+
+
+async def run_code(code: str, df: pd.DataFrame, dataset_key: Optional[str] = None, engine: str = "pandas") -> pd.DataFrame:
+    """
+    Runs the generated code without blocking the event loop: in a worker process in 'process'
+    mode (dataset_key, the version of df in the session store, lets the worker map it instead of
+    receiving a copy), else on the execution thread pool. Pandas code is first rewritten or
+    rejected by its estimated cost (see code_optimizer.py); with engine 'sql' the code is a DuckDB
+    query (see sql_engine.py). A result cached for the same code on the same dataset version is
+    returned without running it.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, _run_cached, code, df, dataset_key, engine)
@@ -2,13 +2,15 @@
 from typing import TypedDict, List, Optional
 import pandas as pd
 from langgraph.graph import StateGraph, END
-from .nodes import classify_query, code_generation, code_execution, suggestion, insight_generation
+from .nodes import classify_query, code_generation, code_execution, suggestion, speculative_classify, should_retry, SPECULATIVE_CODEGEN
 
 class AgentState(TypedDict):
     data_id: str
     dataframe: Optional[pd.DataFrame]
     query: str
     chat_history: List[str]
+    # The conversation as prompts include it: running summary and recent turns
+    conversation: str
     explanation: Optional[str]
     charts: Optional[List[dict]]
     suggestions: Optional[List[dict]]
@@ -16,6 +18,14 @@ class AgentState(TypedDict):
     insight: Optional[dict]
     classification: str
     code: Optional[str]
+    bypass_cache: bool
+    code_cache_key: Optional[str]
+    codegen_tokens: Optional[int]
+    speculation: Optional[dict]
+    plan_key: Optional[str]
+    attempts: int
+    # 'pandas' or 'sql': what the model writes and what runs it (see sql_engine.py)
+    engine: str
 
 workflow = StateGraph(AgentState)
 
@@ -23,32 +33,47 @@ workflow.add_node("classify_query", classify_query)
 workflow.add_node("code_generation", code_generation)
 workflow.add_node("code_execution", code_execution)
 workflow.add_node("suggestion", suggestion)
-workflow.add_node("insight_generation", insight_generation)
 
-workflow.set_entry_point("classify_query")
-
-workflow.add_conditional_edges(
-    "classify_query",
-    lambda state: state["classification"],
-    {
-        "code_generation": "code_generation",
-        "suggestion": "suggestion",
-        "greeting": END,
-    },
-)
+if SPECULATIVE_CODEGEN:
+    # Classification and code generation run together; code_generation queries go
+    # straight to execution (a retry still goes through code_generation)
+    workflow.add_node("speculative_classify", speculative_classify)
+    workflow.set_entry_point("speculative_classify")
+    workflow.add_conditional_edges(
+        "speculative_classify",
+        lambda state: state["classification"],
+        {
+            "code_generation": "code_execution",
+            "suggestion": "suggestion",
+            "greeting": END,
+        },
+    )
+else:
+    workflow.set_entry_point("classify_query")
+    workflow.add_conditional_edges(
+        "classify_query",
+        lambda state: state["classification"],
+        {
+            "code_generation": "code_generation",
+            "suggestion": "suggestion",
+            "greeting": END,
+        },
+    )
 
 workflow.add_edge("code_generation", "code_execution")
 
+# The proactive insight is not part of the graph: it is generated in the background once
+# the response has been returned (see insight_tasks.py). Failed code is regenerated with its
+# error at most MAX_CODE_RETRIES times (see code_checks.py); after that the error is returned.
 workflow.add_conditional_edges(
     "code_execution",
-    lambda state: "retry" if state.get("error") else "proceed",
+    lambda state: "retry" if should_retry(state) else "proceed",
     {
         "retry": "code_generation",
-        "proceed": "insight_generation",
+        "proceed": END,
     },
 )
 
 workflow.add_edge("suggestion", END)
-workflow.add_edge("insight_generation", END)
 
 app = workflow.compile()
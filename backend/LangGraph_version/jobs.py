@@ -0,0 +1,105 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .session_backend import backend
+
+logger = logging.getLogger(__name__)
+
+# Number of uploads parsed and profiled concurrently in the background
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+
+# Job statuses, in order: queued -> parsing -> profiling -> done (or failed at any point).
+# Queries can run once a job has reached 'profiling'.
+PARSED_STATUSES = ("profiling", "done")
+FINAL_STATUSES = ("done", "failed")
+# Workers touch the jobs they own this often; a job left untouched for JOB_STALE_SECONDS
+# (its worker crashed or was restarted mid-upload) is treated as failed
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+# Job records live in the session backend so any worker can report on them
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+# Queued or running jobs of this process, kept alive by the heartbeat thread
+_owned: set = set()
+_heartbeat: Optional[threading.Thread] = None
+
+
+def create_job(**fields) -> str:
+    """
+    Registers a new background job and returns its id.
+    """
+    job_id = str(uuid.uuid4())
+    with _lock:
+        backend.save_job({
+            "job_id": job_id,
+            "status": "queued",
+            "rows_parsed": 0,
+            "columns_profiled": 0,
+            "total_columns": None,
+            "error": None,
+            "created_at": time.time(),
+            **fields,
+        })
+    return job_id
+
+
+def update_job(job_id: str, **fields):
+    # Only the worker running a job updates it, so a process-local lock is enough
+    with _lock:
+        job = backend.get_job(job_id)
+        job.update(fields, updated_at=time.time())
+        backend.save_job(job)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieves a job, marking it failed first if its worker stopped updating it.
+    """
+    job = backend.get_job(job_id)
+    if job is not None and job["status"] not in FINAL_STATUSES and job_id not in _owned:
+        if time.time() - job.get("updated_at", job["created_at"]) > JOB_STALE_SECONDS:
+            logger.warning(f"Job {job_id} was left {job['status']} by a stopped worker, marking it failed.")
+            with _lock:
+                job.update(status="failed", error=f"Upload was interrupted while {job['status']}", updated_at=time.time())
+                backend.save_job(job)
+    return job
+
+
+def _beat():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        for job_id in list(_owned):
+            try:
+                update_job(job_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat of job {job_id} failed: {e}")
+
+
+def submit(job_id: str, fn: Callable, *args):
+    """
+    Runs fn(*args) on the upload pool, marking the job failed if it raises.
+    The job is kept alive by the heartbeat until it finishes.
+    """
+    global _heartbeat
+
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            update_job(job_id, status="failed", error=str(e))
+        finally:
+            _owned.discard(job_id)
+
+    with _lock:
+        _owned.add(job_id)
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_beat, name="job-heartbeat", daemon=True)
+            _heartbeat.start()
+    _executor.submit(run)
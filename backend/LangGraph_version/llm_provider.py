@@ -0,0 +1,299 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import session_store
+
+logger = logging.getLogger(__name__)
+
+# Which model answers the prompts:
+#   'gemini' - the backend's Gemini model (needs GOOGLE_API_KEY and network access)
+#   'record' - Gemini, with every prompt/response pair appended to LLM_RECORD_PATH
+#   'replay' - responses recorded by 'record', looked up by prompt; unknown prompts fail
+#   'fake'   - a scripted model (LLM_FAKE_SCRIPT, or a built-in script) for offline load tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH", os.path.join(session_store.STORE_DIR, "llm_recording.jsonl"))
+LLM_FAKE_SCRIPT = os.getenv("LLM_FAKE_SCRIPT")
+# Simulated latency of the fake and replay providers, per call (a batch counts as one call)
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+# Simulated provider limit on concurrent calls of the fake provider (0 means unlimited)
+LLM_FAKE_CONCURRENCY = int(os.getenv("LLM_FAKE_CONCURRENCY", "0"))
+# Concurrent calls with the same prompt share one request
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+# Prompts arriving within this window are sent together when the provider batches (0 disables)
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+LLM_MAX_BATCH = int(os.getenv("LLM_MAX_BATCH", "16"))
+
+# Enough for both backends to answer every kind of prompt offline: classification, code
+# generation (LangGraph node or the LLM version's single prompt), suggestions, insights, summaries
+DEFAULT_FAKE_SCRIPT = {
+    "rules": [
+        {"match": r"classify the user's query", "response": "code_generation"},
+        {"match": r"generate pandas code|User query:",
+         "response": json.dumps({"type": "code", "code": "result_df = df.head(10)", "explanation": "These are the first 10 rows of the data.",
+                                 "charts": []})},
+        {"match": r"query that is ambiguous",
+         "response": json.dumps({"suggestions": [{"query": "Show the first 10 rows", "explanation": "Shows a sample of the data."}]})},
+        {"match": r"proactive data analyst",
+         "response": json.dumps({"insight": "The result has 10 rows.", "follow_up_query": "Show the first 20 rows"})},
+    ],
+    "default": "The user explored the dataset.",
+}
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class LLMProvider:
+    """
+    Text-in, text-out model interface used by the nodes and the LLM handler.
+    Providers that can send several prompts in one request override agenerate_batch.
+    """
+
+    name = "base"
+    supports_batching = False
+
+    async def agenerate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        return list(await asyncio.gather(*(self.agenerate(p) for p in prompts)))
+
+
+class LangChainGeminiProvider(LLMProvider):
+    """Gemini through langchain-google-genai (LangGraph version)."""
+
+    name = "gemini"
+    supports_batching = True
+
+    def __init__(self, model: str):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        self.llm = ChatGoogleGenerativeAI(model=model)
+
+    async def agenerate(self, prompt: str) -> str:
+        return (await self.llm.ainvoke(prompt)).content
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        return [message.content for message in await self.llm.abatch(prompts)]
+
+
+class GenAIGeminiProvider(LLMProvider):
+    """Gemini through google-generativeai (LLM version)."""
+
+    name = "gemini"
+
+    def __init__(self, model: str):
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.model = genai.GenerativeModel(model)
+
+    async def agenerate(self, prompt: str) -> str:
+        return (await self.model.generate_content_async(prompt)).text
+
+
+class FakeProvider(LLMProvider):
+    """
+    Scripted model: the response of the first rule whose regex matches the prompt, else the
+    script's default, after `latency` seconds. A batch takes one latency, like a server-side batch.
+    With max_concurrency, calls beyond that many queue, like requests against a rate-limited API.
+    Scripts are JSON: {"rules": [{"match": regex, "response": text}], "default": text, "latency": s,
+    "max_concurrency": n}.
+    """
+
+    name = "fake"
+    supports_batching = True
+
+    def __init__(self, script: Optional[Dict[str, Any]] = None, latency: Optional[float] = None):
+        script = script or DEFAULT_FAKE_SCRIPT
+        self.rules = [(re.compile(rule["match"], re.IGNORECASE), rule["response"]) for rule in script.get("rules", [])]
+        self.default = script.get("default", "")
+        self.latency = script.get("latency", LLM_FAKE_LATENCY) if latency is None else latency
+        max_concurrency = script.get("max_concurrency", LLM_FAKE_CONCURRENCY)
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "FakeProvider":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def respond(self, prompt: str) -> str:
+        return next((response for pattern, response in self.rules if pattern.search(prompt)), self.default)
+
+    async def _call(self):
+        if self._slots is None:
+            await asyncio.sleep(self.latency)
+            return
+        async with self._slots:
+            await asyncio.sleep(self.latency)
+
+    async def agenerate(self, prompt: str) -> str:
+        await self._call()
+        return self.respond(prompt)
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        await self._call()
+        return [self.respond(p) for p in prompts]
+
+
+class RecordingProvider(LLMProvider):
+    """Passes prompts to another provider and appends each prompt/response pair to a JSONL file."""
+
+    name = "record"
+
+    def __init__(self, inner: LLMProvider, path: str = LLM_RECORD_PATH):
+        self.inner = inner
+        self.path = path
+        self.supports_batching = inner.supports_batching
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _record(self, prompt: str, response: str):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps({"key": prompt_key(prompt), "prompt": prompt, "response": response}) + "\n")
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.inner.agenerate(prompt)
+        await asyncio.to_thread(self._record, prompt, response)
+        return response
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        responses = await self.inner.agenerate_batch(prompts)
+        for prompt, response in zip(prompts, responses):
+            await asyncio.to_thread(self._record, prompt, response)
+        return responses
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Serves responses recorded by RecordingProvider, matched by the exact prompt. A prompt that
+    was not recorded raises KeyError, so a replayed run cannot silently diverge from the recording.
+    """
+
+    name = "replay"
+    supports_batching = True
+
+    def __init__(self, path: str = LLM_RECORD_PATH, latency: float = LLM_FAKE_LATENCY):
+        self.latency = latency
+        self.responses: Dict[str, str] = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry["key"]] = entry["response"]
+        logger.info(f"Replaying {len(self.responses)} recorded LLM responses from {path}")
+
+    def respond(self, prompt: str) -> str:
+        key = prompt_key(prompt)
+        if key not in self.responses:
+            raise KeyError(f"No recorded LLM response for prompt {key[:16]} ({prompt.strip()[:80]!r}...)")
+        return self.responses[key]
+
+    async def agenerate(self, prompt: str) -> str:
+        await asyncio.sleep(self.latency)
+        return self.respond(prompt)
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        await asyncio.sleep(self.latency)
+        return [self.respond(p) for p in prompts]
+
+
+class BatchingProvider(LLMProvider):
+    """
+    Front for another provider that coalesces concurrent calls with the same prompt into one,
+    and, with a batch window, collects distinct prompts for up to window seconds (or max_batch
+    prompts) and sends them in one agenerate_batch call when the provider batches.
+    """
+
+    def __init__(self, inner: LLMProvider, coalesce: bool = LLM_COALESCE,
+                 window_seconds: float = LLM_BATCH_WINDOW_MS / 1000, max_batch: int = LLM_MAX_BATCH):
+        self.inner = inner
+        self.name = inner.name
+        self.coalesce = coalesce
+        self.window_seconds = window_seconds if inner.supports_batching else 0.0
+        self.max_batch = max_batch
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+        self._pending: List[Tuple[str, "asyncio.Future[str]"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"requests": 0, "coalesced": 0, "calls": 0, "batches": 0, "batched_prompts": 0, "max_batch_size": 0, "errors": 0}
+
+    async def agenerate(self, prompt: str) -> str:
+        self.stats["requests"] += 1
+        if self.coalesce and prompt in self._inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._inflight[prompt])
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.coalesce:
+            self._inflight[prompt] = future
+        if self.window_seconds <= 0:
+            loop.create_task(self._send([(prompt, future)]))
+        else:
+            self._pending.append((prompt, future))
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[str, "asyncio.Future[str]"]]):
+        prompts = [prompt for prompt, _ in batch]
+        self.stats["calls"] += 1
+        if len(batch) > 1:
+            self.stats["batches"] += 1
+            self.stats["batched_prompts"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+        try:
+            responses = await self.inner.agenerate_batch(prompts) if len(batch) > 1 else [await self.inner.agenerate(prompts[0])]
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            self.stats["errors"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for prompt, future in batch:
+                if self._inflight.get(prompt) is future:
+                    del self._inflight[prompt]
+
+    async def agenerate_batch(self, prompts: List[str]) -> List[str]:
+        return list(await asyncio.gather(*(self.agenerate(p) for p in prompts)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"provider": self.inner.name, "coalesce": self.coalesce, "batch_window_ms": self.window_seconds * 1000,
+                "max_batch": self.max_batch, **self.stats}
+
+
+def create_provider(gemini: Callable[[], LLMProvider], kind: str = LLM_PROVIDER) -> BatchingProvider:
+    """
+    Builds the configured provider; gemini creates the backend's Gemini provider when needed.
+    """
+    if kind == "gemini":
+        provider = gemini()
+    elif kind == "record":
+        provider = RecordingProvider(gemini())
+    elif kind == "replay":
+        provider = ReplayProvider()
+    elif kind == "fake":
+        provider = FakeProvider.from_file(LLM_FAKE_SCRIPT) if LLM_FAKE_SCRIPT else FakeProvider()
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER: {kind}")
+    logger.info(f"Using {provider.name} LLM provider")
+    return BatchingProvider(provider)
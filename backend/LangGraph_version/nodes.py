@@ -1,29 +1,58 @@
 import os
 import re
 import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 import pandas as pd
-from .profiler import get_profile_as_dict
+from .data_tools import get_prompt_context, get_dataset_version
+from .llm_cache import response_cache, fingerprint
+from .prompt_context import estimate_tokens
+from .code_runner import run_code
+from .sql_engine import precheck_sql
+from .code_checks import MAX_CODE_RETRIES, precheck_code, describe_failure, failure_kind, repair_instructions, retry_stats
+from .query_classifier import fast_classify, FAST_CLASSIFY
+from .plan_cache import plan_cache
+from .conversation_memory import ConversationMemory, format_memory
+from .llm_provider import create_provider, LangChainGeminiProvider
 
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro")
+# Gemini by default; LLM_PROVIDER selects a recorded, replayed or scripted model instead (see llm_provider.py)
+llm = create_provider(lambda: LangChainGeminiProvider("gemini-1.5-pro"))
 logger = logging.getLogger(__name__)
 
-def classify_query(state):
-    """Classifies the user's query."""
+# Speculative mode: code generation starts alongside classification instead of after it
+SPECULATIVE_CODEGEN = os.getenv("SPECULATIVE_CODEGEN", "0") == "1"
+speculation_stats = {"runs": 0, "used": 0, "discarded": 0, "latency_saved_seconds": 0.0, "tokens_wasted": 0}
+# Cancelled speculative generations until they unwind (the event loop only keeps weak references)
+_background_tasks = set()
+
+async def _ainvoke(prompt: str) -> str:
+    return await llm.agenerate(prompt)
+
+async def _fast_classify(state):
+    """Local label for the query when the rule-based classifier is confident, else None."""
+    if not FAST_CLASSIFY:
+        return None
+    context = await asyncio.to_thread(get_prompt_context, state["data_id"])
+    return fast_classify(state["query"], context["columns"], context["numeric_columns"], has_history=bool(state["chat_history"]))
+
+async def classify_query(state):
+    """Classifies the user's query, asking the LLM only when the local classifier is unsure."""
+    label = await _fast_classify(state)
+    if label is not None:
+        state["classification"] = label
+        return state
+    return await _llm_classify(state)
+
+async def _llm_classify(state):
+    """Classifies the user's query with the LLM."""
     query = state["query"]
     
-    # Create a simplified history for the prompt
-    history = state["chat_history"][-2:]
-    simplified_history = []
-    for event in history:
-        simplified_history.append(f"User: {event['query']}")
-        if event.get('response', {}).get('explanation'):
-            simplified_history.append(f"Assistant: {event['response']['explanation']}")
-    history_str = "\n".join(simplified_history)
+    # Running summary of older turns plus the recent turns (see conversation_memory.py)
+    history_str = state.get("conversation", "")
 
     prompt = f"""You are a master at understanding user queries.
     Your task is to classify the user's query into one of the following categories:
@@ -42,46 +71,82 @@ def classify_query(state):
     - greeting
     """
 
-    response = llm.invoke(prompt)
-    classification = response.content.strip()
+    # The prompt doesn't describe the dataset, so classifications are shared across datasets
+    cache_key = response_cache.make_key("classify_query", query, history=history_str)
+    classification = (await response_cache.acached(
+        "classify_query", cache_key, lambda: _ainvoke(prompt), bypass=state.get("bypass_cache", False)
+    )).strip()
+    if classification not in ("code_generation", "suggestion", "greeting"):
+        await response_cache.ainvalidate(cache_key)
     state["classification"] = classification
     return state
 
-def code_generation(state):
-    """Generates pandas code to transform the dataframe."""
+def should_retry(state) -> bool:
+    """Whether a failed attempt goes back to code_generation: failed attempts get MAX_CODE_RETRIES retries."""
+    return bool(state.get("error")) and state.get("attempts", 1) <= MAX_CODE_RETRIES
+
+async def code_generation(state):
+    """
+    Generates pandas code to transform the dataframe, or a DuckDB query when the session uses
+    the 'sql' engine. A cached plan for the query's shape is bound to its literals instead of
+    calling the LLM (pandas only, not on retries or with bypass_cache).
+    On a retry the prompt carries the failed code and its error, for the model to repair.
+    """
     query = state["query"]
-    df = state["dataframe"]
-    profile = get_profile_as_dict(df)
+    engine = state.get("engine", "pandas")
+    # Summarised once per dataset version, not on every call and retry
+    context = await asyncio.to_thread(get_prompt_context, state["data_id"])
+    schema = context["schema"]
+
+    retrying = bool(state.get("error"))
+    repair = repair_instructions(state.get("code"), state["error"], "sql" if engine == "sql" else "python") if retrying else ""
+    state["attempts"] = state.get("attempts", 0) + 1
+    state["plan_key"] = None
+    if not retrying and not state.get("bypass_cache", False) and engine == "pandas":
+        plan = await asyncio.to_thread(plan_cache.lookup, query, state["dataframe"], context["fingerprint"])
+        if plan is not None:
+            state.update(code=plan["code"], explanation=plan["explanation"], charts=plan["charts"], error=None,
+                         plan_key=plan["key"], code_cache_key=None, codegen_tokens=0)
+            return state
     
-    # Create a simplified history for the prompt
-    history = state["chat_history"][-2:]
-    simplified_history = []
-    for event in history:
-        simplified_history.append(f"User: {event['query']}")
-        if event.get('response', {}).get('explanation'):
-            simplified_history.append(f"Assistant: {event['response']['explanation']}")
-    history_str = "\n".join(simplified_history)
-
-    prompt = f"""You are a Python pandas expert and a helpful data analyst.
+    # Running summary of older turns plus the recent turns (see conversation_memory.py)
+    history_str = state.get("conversation", "")
+
+    if engine == "sql":
+        expert = "a DuckDB SQL expert"
+        task = """Your task is to write a single DuckDB SQL SELECT query over the table 'df' that answers the current query.
+    Consider the conversation history for context if the user is asking a follow-up question.
+    The rows the query returns become 'result_df'; give computed columns clear aliases.
+    Quote column names with double quotes and text values with single quotes. Date columns are timestamps, so use date_trunc, year() and month() on them."""
+        example = "SELECT region, SUM(net_revenue) AS net_revenue FROM df GROUP BY region"
+        code_field = "the SQL query"
+    else:
+        expert = "a Python pandas expert"
+        task = """Your task is to generate pandas code to transform the dataframe based on the current query.
+    Consider the conversation history for context if the user is asking a follow-up question.
+    The final result MUST be assigned to a variable named 'result_df'.
+    Text columns with few distinct values are stored with the 'category' dtype, so always pass observed=True to groupby. Date columns are already parsed as datetime, so use the .dt accessor on them."""
+        example = "result_df = df.groupby('region')['net_revenue'].sum().reset_index()"
+        code_field = "the pandas code"
+
+    prompt = f"""You are {expert} and a helpful data analyst.
     A user has provided a dataframe named 'df' and a query in natural language.
-    Here is the data profile of the dataframe:
-    {profile}
+    Here is a summary of the dataframe's columns (dtype, nulls, example values or range):
+    {schema}
 
     Here is the summary of the previous conversation:
     {history_str}
 
     Now, address the user's current query: \"{query}\" 
 
-    Your task is to generate pandas code to transform the dataframe based on the current query.
-    Consider the conversation history for context if the user is asking a follow-up question.
-    The final result MUST be assigned to a variable named 'result_df'.
+    {task}
     After the main transformation, analyze the 'result_df' and generate a list of all suitable chart specifications in a 'charts' array.
     Provide a detailed but easy-to-understand explanation for a non-technical user.
     Return a single, valid JSON object.
 
     **JSON Output Specification:**
     - The JSON output must always have a 'type' field ('code').
-    - For 'code' type, it must include a 'code' field with the pandas code.
+    - For 'code' type, it must include a 'code' field with {code_field}.
     - It must also include a 'charts' array. For each suitable visualization, add a chart object to this array.
     - **Bar Chart**: Use for categorical comparisons. Include 'type': 'bar', 'x_column', and 'y_column'.
     - **Pie Chart**: Use for showing parts of a whole (if categories are less than 6). Include 'type': 'pie', 'names_column' (for labels), and 'values_column'.
@@ -93,7 +158,7 @@ def code_generation(state):
     
     {{
         "type": "code",
-        "code": "result_df = df.groupby('region')['net_revenue'].sum().reset_index()",
+        "code": "{example}",
         "explanation": "I have calculated the total net revenue for each region.",
         "charts": [
             {{
@@ -108,16 +173,30 @@ def code_generation(state):
             }}
         ]
     }}
-    
+    {repair}
     """
 
-    response = llm.invoke(prompt)
+    async def generate():
+        # Estimated tokens spent by the model call (cache hits spend none); the prompt is
+        # counted as soon as it is sent, so a cancelled call still reports its input
+        state["codegen_tokens"] = estimate_tokens(prompt)
+        content = await _ainvoke(prompt)
+        state["codegen_tokens"] += estimate_tokens(content)
+        return content
+
+    state["codegen_tokens"] = 0
+    # SQL sessions get SQL for the same query, so their responses are cached apart
+    node = "code_generation" if engine == "pandas" else "sql_generation"
+    cache_key = response_cache.make_key(node, query, context["fingerprint"], history_str + repair)
+    content = await response_cache.acached(node, cache_key, generate, bypass=state.get("bypass_cache", False))
+    # Remembered so that code_execution can drop the cached response if the code fails
+    state["code_cache_key"] = cache_key
     # Use regex to extract the JSON string from the markdown
-    json_match = re.search(r'```json\n(.*?)\n```', response.content, re.DOTALL)
+    json_match = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
     if json_match:
         json_str = json_match.group(1)
     else:
-        json_str = response.content
+        json_str = content
 
     try:
         response_dict = json.loads(json_str)
@@ -128,45 +207,135 @@ def code_generation(state):
         state["charts"] = response_dict.get("charts", [])
         state["error"] = None
     except (json.JSONDecodeError, KeyError) as e:
+        await response_cache.ainvalidate(cache_key)
+        retry_stats.failure("invalid_response")
+        state["code"] = None
         state["error"] = f"Invalid response from LLM: {e}"
 
     return state
 
-def code_execution(state):
-    """Executes the generated code."""
+def _discard_codegen(task, codegen_state):
+    # Cancels a speculative generation and counts the tokens it had already spent
+    task.cancel()
+    speculation_stats["tokens_wasted"] += codegen_state.get("codegen_tokens", 0)
+    _background_tasks.add(task)
+    # Retrieving the outcome keeps a generation that failed before the cancel from being logged as unhandled
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    task.add_done_callback(_background_tasks.discard)
+
+async def speculative_classify(state):
+    """
+    Classifies the query while generating code for it in parallel, on the bet that most
+    queries are code_generation. The generated code is kept only if the bet was right;
+    otherwise the generation is cancelled, and the tokens it already spent are counted as wasted.
+    """
+    # Nothing to speculate on when the local classifier settles the label
+    label = await _fast_classify(state)
+    if label is not None:
+        state["classification"] = label
+        return await code_generation(state) if label == "code_generation" else state
+
+    start = time.perf_counter()
+
+    async def generate(codegen_state):
+        generate_start = time.perf_counter()
+        return await code_generation(codegen_state), time.perf_counter() - generate_start
+
+    codegen_state = dict(state)
+    task = asyncio.create_task(generate(codegen_state))
+    classify_start = time.perf_counter()
+    try:
+        state = await _llm_classify(state)
+    except BaseException:
+        _discard_codegen(task, codegen_state)
+        raise
+    classify_seconds = time.perf_counter() - classify_start
+
+    if state["classification"] != "code_generation":
+        _discard_codegen(task, codegen_state)
+        state["speculation"] = {"used": False, "latency_saved_seconds": 0.0}
+        speculation_stats["runs"] += 1
+        speculation_stats["discarded"] += 1
+        return state
+
+    codegen_state, codegen_seconds = await task
+    for key in ("code", "explanation", "charts", "error", "code_cache_key", "codegen_tokens", "plan_key", "attempts"):
+        if key in codegen_state:
+            state[key] = codegen_state[key]
+    # Running the two calls one after the other would have taken classify + codegen
+    saved = max(0.0, classify_seconds + codegen_seconds - (time.perf_counter() - start))
+    state["speculation"] = {"used": True, "latency_saved_seconds": round(saved, 4)}
+    speculation_stats["runs"] += 1
+    speculation_stats["used"] += 1
+    speculation_stats["latency_saved_seconds"] += saved
+    return state
+
+def get_speculation_stats() -> dict:
+    """
+    Reports how often speculative code generation was used or discarded, the latency it
+    saved and the (estimated) tokens spent on discarded generations.
+    """
+    return {"enabled": SPECULATIVE_CODEGEN, **speculation_stats,
+            "latency_saved_seconds": round(speculation_stats["latency_saved_seconds"], 4)}
+
+async def code_execution(state):
+    """
+    Pre-checks the generated code (syntax, result_df, column names) and executes it in the
+    execution sandbox (see code_runner.py), or pre-checks and runs the generated SQL on DuckDB
+    for the 'sql' engine. Pandas code from the LLM that runs is stored as a plan for queries of the same
+    shape; a cached plan that fails is dropped. A failure is described in state['error'] for
+    the repair prompt, and the query's retry count is recorded once it succeeds or runs out.
+    """
     if state.get("error"):
+        if not should_retry(state):
+            retry_stats.record(state.get("attempts", 1) - 1, succeeded=False)
         return state
         
     code = state["code"]
     df = state["dataframe"]
+    engine = state.get("engine", "pandas")
 
-    local_scope = {'df': df.copy(), 'pd': pd}
     try:
-        exec(code, {}, local_scope)
-        result_df = local_scope.get('result_df')
-        if result_df is None:
-            raise ValueError("Code did not produce a 'result_df' dataframe.")
-        state["dataframe"] = result_df
+        if engine == "sql":
+            precheck_sql(code)
+        else:
+            precheck_code(code, df.columns)
+        # The worker (or DuckDB) maps the session's stored dataset rather than receiving a copy of df
+        dataset_key = await asyncio.to_thread(get_dataset_version, state["data_id"])
+        state["dataframe"] = await run_code(code, df, dataset_key, engine)
         state["error"] = None
     except Exception as e:
-        state["error"] = str(e)
+        await response_cache.ainvalidate(state.get("code_cache_key"))
+        await asyncio.to_thread(plan_cache.invalidate, state.get("plan_key"))
+        retry_stats.failure(failure_kind(e))
+        state["error"] = describe_failure(e, code)
+        logger.info(f"Attempt {state.get('attempts', 1)} failed: {state['error']}")
+        if not should_retry(state):
+            retry_stats.record(state.get("attempts", 1) - 1, succeeded=False)
+        return state
 
+    retry_stats.record(state.get("attempts", 1) - 1, succeeded=True)
+
+    if state.get("plan_key") is None and engine == "pandas":
+        context = await asyncio.to_thread(get_prompt_context, state["data_id"])
+        await asyncio.to_thread(plan_cache.store, state["query"], df, context["fingerprint"],
+                                code, state.get("explanation"), state.get("charts"))
     return state
 
-def suggestion(state):
+async def suggestion(state):
     """Generates suggestions for ambiguous queries."""
     query = state["query"]
-    df = state["dataframe"]
-    profile = get_profile_as_dict(df)
-    chat_history = state["chat_history"][-2:]
+    context = await asyncio.to_thread(get_prompt_context, state["data_id"])
+    schema = context["schema"]
+    chat_history = state.get("conversation", "")
 
     prompt = f"""You are a helpful data analyst. A user has provided a query that is ambiguous.
     Your task is to generate 2-3 specific, alternative query suggestions in **natural language** that are relevant to the user's query and the available data.
     For each suggestion, provide the refined **natural language query** and a short explanation of what it does.
     Return a single, valid JSON object.
 
-    Here is the data profile of the dataframe:
-    {profile}
+    Here is a summary of the dataframe's columns (dtype, nulls, example values or range):
+    {schema}
 
     User's ambiguous query: \"{query}\" 
 
@@ -185,26 +354,31 @@ def suggestion(state):
     }}
     """
 
-    response = llm.invoke(prompt)
+    cache_key = response_cache.make_key("suggestion", query, context["fingerprint"], str(chat_history))
+    content = await response_cache.acached("suggestion", cache_key, lambda: _ainvoke(prompt), bypass=state.get("bypass_cache", False))
     # Use regex to extract the JSON string from the markdown
-    json_match = re.search(r'```json\n(.*?)\n```', response.content, re.DOTALL)
+    json_match = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
     if json_match:
         json_str = json_match.group(1)
     else:
-        json_str = response.content
+        json_str = content
 
     try:
         response_dict = json.loads(json_str)
         state["suggestions"] = response_dict["suggestions"]
         state["error"] = None
     except (json.JSONDecodeError, KeyError) as e:
+        await response_cache.ainvalidate(cache_key)
         state["error"] = f"Invalid JSON response: {e}"
 
     return state
 
 
-def insight_generation(state):
-    """Generates a proactive insight based on the result."""
+async def insight_generation(state):
+    """
+    Generates a proactive insight based on the result. Not a graph node: main.py runs it
+    in the background after the response has been returned.
+    """
     if state.get("error"):
         return state
         
@@ -233,35 +407,32 @@ def insight_generation(state):
     
     """
 
-    response = llm.invoke(prompt)
+    # The insight depends on the result rows rather than the dataset schema
+    cache_key = response_cache.make_key("insight_generation", query, fingerprint(result_head))
+    content = await response_cache.acached("insight_generation", cache_key, lambda: _ainvoke(prompt), bypass=state.get("bypass_cache", False))
     # Use regex to extract the JSON string from the markdown
-    json_match = re.search(r'```json\n(.*?)\n```', response.content, re.DOTALL)
+    json_match = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
     if json_match:
         json_str = json_match.group(1)
     else:
-        json_str = response.content
+        json_str = content
 
     try:
         response_dict = json.loads(json_str)
         state["insight"] = response_dict
         state["error"] = None
     except (json.JSONDecodeError, KeyError) as e:
+        await response_cache.ainvalidate(cache_key)
         state["error"] = f"Invalid JSON response: {e}"
 
     return state
 
-def generate_chat_summary(history: list) -> str:
+async def generate_chat_summary(memory: ConversationMemory) -> str:
     """
-    Generates a summary of the chat history.
+    Generates a summary of the chat history from the session's memory (the running summary
+    and the recent turns), so the prompt does not grow with the length of the session.
     """
-    
-    # Create a simplified history for the prompt
-    simplified_history = []
-    for event in history:
-        simplified_history.append(f"User: {event['query']}")
-        simplified_history.append(f"Assistant: {event['response'].get('explanation', '')}")
-    
-    conversation = "\n".join(simplified_history)
+    conversation = format_memory(memory)
 
     prompt = f"""You are a helpful assistant. A user has had a conversation with a data analyst bot. 
     Your task is to provide a concise summary of the entire conversation.
@@ -271,6 +442,6 @@ def generate_chat_summary(history: list) -> str:
 
     Please provide a summary of the key findings and the flow of the analysis.
     """
-    response = llm.invoke(prompt)
-    summary = response.content.strip()
+    cache_key = response_cache.make_key("chat_summary", "", history=conversation)
+    summary = (await response_cache.acached("chat_summary", cache_key, lambda: _ainvoke(prompt))).strip()
     return summary
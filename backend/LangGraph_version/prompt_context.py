@@ -0,0 +1,127 @@
+import os
+import json
+import math
+import hashlib
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+# Upper bound on the size of the schema summary pasted into prompts, in estimated tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# Example values shown per text column, and the characters kept of each
+EXAMPLE_VALUES = 3
+EXAMPLE_MAX_CHARS = 30
+# Rows scanned for examples of free-text columns
+EXAMPLE_SCAN_ROWS = 1000
+# Rough characters-per-token ratio of Gemini/GPT tokenizers on English and code
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _format_value(value) -> str:
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat() if value.time() != pd.Timestamp(0).time() else value.date().isoformat()
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    text = str(value)
+    return text if len(text) <= EXAMPLE_MAX_CHARS else text[:EXAMPLE_MAX_CHARS - 3] + "..."
+
+
+def _is_text(series: pd.Series) -> bool:
+    return not (isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(series)
+                or pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series))
+
+
+def _examples(series: pd.Series, count: int) -> List[str]:
+    """
+    A few representative values, deterministically: the most frequent categories,
+    or the first distinct values of a text column.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Most frequent first, ties in category order
+        counts = series.value_counts(sort=False).sort_values(ascending=False, kind="stable")
+        return [_format_value(v) for v in counts.index[:count]]
+    values = series.head(EXAMPLE_SCAN_ROWS).dropna().drop_duplicates().head(count)
+    return [_format_value(v) for v in values]
+
+
+def sample_examples(sample: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Example values of the free-text columns of a sample of the rows, for build_schema_summary.
+    """
+    return {str(col): _examples(sample[col], EXAMPLE_VALUES) for col in sample.columns if _is_text(sample[col])}
+
+
+def _column_facts(series: pd.Series, examples: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    The facts summarised for one column: dtype, null count, and examples or the value range.
+    examples replaces the first distinct values of a text column.
+    """
+    facts = {"dtype": str(series.dtype), "nulls": int(series.isna().sum()), "details": [], "examples": []}
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        facts["details"].append(f"{len(series.cat.categories)} values")
+        facts["examples"] = _examples(series, EXAMPLE_VALUES)
+    elif pd.api.types.is_bool_dtype(series):
+        pass
+    elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        if facts["nulls"] < len(series):
+            facts["details"].append(f"range {_format_value(series.min())} to {_format_value(series.max())}")
+    else:
+        facts["examples"] = _examples(series, EXAMPLE_VALUES) if examples is None else examples
+    return facts
+
+
+def _format_column(name, facts: Dict[str, Any], examples: int) -> str:
+    details = ([f"nulls={facts['nulls']}"] if facts["nulls"] else []) + facts["details"]
+    if examples and facts["examples"]:
+        details.append("e.g. " + ", ".join(repr(v) for v in facts["examples"][:examples]))
+    line = f"- {name} ({facts['dtype']})"
+    return line + ": " + "; ".join(details) if details else line
+
+
+def build_schema_summary(df: pd.DataFrame, token_budget: int = PROMPT_TOKEN_BUDGET,
+                         examples: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    Builds a compact, deterministic description of a DataFrame for LLM prompts: the shape,
+    then one line per column with its dtype, nulls and example values or range.
+    Text columns found in examples (see sample_examples) show those values instead of
+    the first distinct ones.
+    Detail is dropped in steps (fewer examples, then names and dtypes only, then
+    trailing columns) until the summary fits in token_budget estimated tokens.
+    """
+    header = f"{len(df)} rows x {len(df.columns)} columns."
+    columns = list(df.columns)
+    examples = examples or {}
+    facts = [_column_facts(df[col], examples.get(str(col))) for col in columns]
+
+    for per_column in (EXAMPLE_VALUES, 1, 0):
+        lines = [header] + [_format_column(col, column, per_column) for col, column in zip(columns, facts)]
+        summary = "\n".join(lines)
+        if estimate_tokens(summary) <= token_budget:
+            return summary
+
+    # Names and dtypes only, then as many columns as fit
+    entries = [f"{col} ({column['dtype']})" for col, column in zip(columns, facts)]
+    budget_chars = token_budget * CHARS_PER_TOKEN - len(header) - 40
+    kept, used = [], 0
+    for entry in entries:
+        if used + len(entry) + 2 > budget_chars:
+            break
+        kept.append(entry)
+        used += len(entry) + 2
+    summary = header + "\nColumns: " + ", ".join(kept)
+    if len(kept) < len(entries):
+        summary += f", ... and {len(entries) - len(kept)} more columns"
+    return summary
+
+
+def schema_fingerprint(df: pd.DataFrame, summary: str) -> str:
+    """
+    Short hash of what a prompt knows about a dataset (column dtypes and the schema summary),
+    so cached LLM responses are only reused for datasets the prompt would describe identically.
+    """
+    dtypes = json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()])
+    return hashlib.sha256((dtypes + summary).encode()).hexdigest()[:16]
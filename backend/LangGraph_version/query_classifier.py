@@ -0,0 +1,181 @@
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Collection, Dict, List, NamedTuple, Optional, Sequence
+
+# Queries are first classified locally from keyword rules and the dataset's column names;
+# only queries the rules are unsure about cost an LLM round trip in classify_query.
+FAST_CLASSIFY = os.getenv("FAST_CLASSIFY", "1") == "1"
+# Local labels below this confidence fall back to the LLM
+FAST_CLASSIFY_MIN_CONFIDENCE = float(os.getenv("FAST_CLASSIFY_MIN_CONFIDENCE", "0.8"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+GREETING_WORDS = {
+    "hi", "hello", "hey", "hiya", "yo", "greeting", "morning", "afternoon", "evening", "thank", "thx", "bye",
+    "goodbye", "cheer", "sup",
+}
+# Words that may accompany a greeting ("hey there, how are you?")
+GREETING_FILLER = {
+    "good", "you", "there", "how", "are", "is", "it", "going", "what", "s", "up", "ok", "okay", "great", "nice",
+    "cool", "awesome", "a", "lot", "much", "so", "very", "again",
+}
+# Operations on the data: these make a query actionable when it names what to operate on
+ACTION_WORDS = {
+    "show", "display", "list", "calculate", "compute", "sum", "total", "average", "avg", "mean", "median",
+    "count", "group", "grouped", "sort", "sorted", "order", "filter", "where", "plot", "chart", "compare",
+    "correlation", "correlate", "distribution", "breakdown", "split", "percentage", "percent", "share", "ratio",
+    "max", "maximum", "min", "minimum", "distinct", "unique", "different", "rank", "per", "each", "by",
+    "between", "first", "last", "head", "tail", "std", "variance",
+}
+QUESTION_WORDS = {"what", "which", "how", "when", "who", "many", "much"}
+# Words that refer to the table itself rather than a column
+DATASET_WORDS = {"row", "record", "dataset", "table", "column", "entry"}
+# Open-ended requests: without a concrete column they call for suggestions
+VAGUE_WORDS = {
+    "analyze", "analyse", "analysis", "interesting", "insight", "explore", "overview", "trend", "seasonality",
+    "pattern", "anything", "something", "tell", "summarize", "summarise", "understand", "investigate",
+}
+# Rankings need a metric to rank by
+RANK_WORDS = {"top", "best", "worst", "most", "least", "highest", "lowest", "leading", "popular", "biggest", "smallest"}
+# References to an earlier answer: the conversation decides the intent
+FOLLOW_UP_WORDS = {"those", "these", "them", "that", "it", "same", "previous", "above", "now"}
+# Column-name tokens too generic to count as a mention on their own
+GENERIC_COLUMN_TOKENS = {"name", "pct", "amount", "id", "value", "type", "no", "num", "code"}
+
+_classifier_lock = threading.Lock()
+classifier_stats: Dict[str, Any] = {"local": defaultdict(int), "llm_fallbacks": 0, "local_seconds": 0.0}
+
+
+class LocalClassification(NamedTuple):
+    label: Optional[str]
+    confidence: float
+    reason: str
+
+
+def _stem(token: str) -> str:
+    # Plural-insensitive matching ("regions" ~ "region", "units" ~ "unit"), enough for column names
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN.findall(text.lower().replace("_", " "))]
+
+
+@lru_cache(maxsize=4096)
+def _column_words(column: str) -> tuple:
+    return tuple(tokenize(column))
+
+
+def _contains(tokens: Sequence[str], phrase: Sequence[str]) -> bool:
+    n = len(phrase)
+    return any(list(tokens[i:i + n]) == list(phrase) for i in range(len(tokens) - n + 1))
+
+
+def match_columns(tokens: Sequence[str], columns: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    Finds the columns a tokenized query mentions: 'strong' when all of the column name's words
+    appear in order ("net revenue" for net_revenue), 'weak' when only one of its distinctive words does.
+    """
+    present = set(tokens)
+    strong, weak = [], []
+    for column in columns:
+        words = _column_words(str(column))
+        if not words:
+            continue
+        if _contains(tokens, words):
+            strong.append(column)
+        elif any(w in present for w in words if w not in GENERIC_COLUMN_TOKENS and len(w) > 2):
+            weak.append(column)
+    return {"strong": strong, "weak": weak}
+
+
+def classify_locally(query: str, columns: Sequence[str], numeric_columns: Collection[str] = (),
+                     has_history: bool = False) -> LocalClassification:
+    """
+    Labels a query 'greeting', 'suggestion' or 'code_generation' from keyword rules and the
+    columns it mentions, with a confidence in [0, 1]. The label is None when no rule applies.
+    """
+    tokens = tokenize(query)
+    present = set(tokens)
+    if not tokens:
+        return LocalClassification(None, 0.0, "empty query")
+
+    mentioned = match_columns(tokens, columns)
+    strong, weak = mentioned["strong"], mentioned["weak"]
+    column_words = {w for column in strong + weak for w in _column_words(str(column))}
+    metric_mentioned = any(column in numeric_columns for column in strong + weak)
+
+    if present & GREETING_WORDS and present <= GREETING_WORDS | GREETING_FILLER:
+        return LocalClassification("greeting", 0.95, "only greeting words")
+
+    vague = present & VAGUE_WORDS
+    if vague:
+        if strong:
+            return LocalClassification(None, 0.5, f"open-ended ({', '.join(sorted(vague))}) but names {', '.join(strong)}")
+        return LocalClassification("suggestion", 0.85, f"open-ended ({', '.join(sorted(vague))}) without a column")
+
+    # "top 10 rows" asks for rows, not for a metric to rank by
+    rank = present & RANK_WORDS
+    if rank and not metric_mentioned and not present & DATASET_WORDS and not any(t.isdigit() for t in tokens):
+        return LocalClassification("suggestion", 0.85, f"ranking ({', '.join(sorted(rank))}) without a metric column")
+
+    # Words that are part of a mentioned column name (e.g. "total" in total_sales) are not actions
+    actions = (present & ACTION_WORDS) - column_words
+    confidence = 0.0
+    if actions:
+        confidence += 0.45
+    elif present & QUESTION_WORDS:
+        confidence += 0.3
+    if strong or present & DATASET_WORDS:
+        confidence += 0.45
+    elif weak:
+        confidence += 0.25
+    if any(t.isdigit() for t in tokens):
+        confidence += 0.05
+    if has_history and present & FOLLOW_UP_WORDS:
+        confidence -= 0.2
+    confidence = round(min(max(confidence, 0.0), 0.95), 2)
+    if confidence == 0.0:
+        return LocalClassification(None, 0.0, "no rule applies")
+    reason = f"actions: {', '.join(sorted(actions)) or '-'}; columns: {', '.join(strong) or '-'} (weak: {', '.join(weak) or '-'})"
+    return LocalClassification("code_generation", confidence, reason)
+
+
+def fast_classify(query: str, columns: Sequence[str], numeric_columns: Collection[str] = (),
+                  has_history: bool = False) -> Optional[str]:
+    """
+    Returns the local label when it is confident enough to skip the LLM, else None.
+    Counts local decisions and fallbacks for get_classifier_stats.
+    """
+    if not FAST_CLASSIFY:
+        return None
+    start = time.perf_counter()
+    result = classify_locally(query, columns, numeric_columns, has_history)
+    confident = result.label is not None and result.confidence >= FAST_CLASSIFY_MIN_CONFIDENCE
+    with _classifier_lock:
+        classifier_stats["local_seconds"] += time.perf_counter() - start
+        if confident:
+            classifier_stats["local"][result.label] += 1
+        else:
+            classifier_stats["llm_fallbacks"] += 1
+    return result.label if confident else None
+
+
+def get_classifier_stats() -> Dict[str, Any]:
+    with _classifier_lock:
+        local = dict(classifier_stats["local"])
+        total = sum(local.values()) + classifier_stats["llm_fallbacks"]
+        return {
+            "enabled": FAST_CLASSIFY,
+            "min_confidence": FAST_CLASSIFY_MIN_CONFIDENCE,
+            "local": local,
+            "llm_fallbacks": classifier_stats["llm_fallbacks"],
+            "local_rate": round(sum(local.values()) / total, 4) if total else None,
+            "mean_local_ms": round(classifier_stats["local_seconds"] * 1000 / total, 4) if total else None,
+        }
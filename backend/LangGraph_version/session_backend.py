@@ -0,0 +1,219 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from . import session_store
+from .cache import SessionCache
+
+logger = logging.getLogger(__name__)
+
+# 'memory' keeps sessions, histories and jobs in this process (single worker).
+# 'sqlite' keeps them in a SQLite database next to the session store so that several
+# uvicorn workers can serve the same data_id.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(session_store.STORE_DIR, "sessions.db"))
+
+
+class MemorySessionBackend:
+    """
+    Process-local backend. Histories live in the byte-budgeted session cache; session
+    bindings are also written to the session store so they survive a restart.
+    """
+
+    def __init__(self, cache: SessionCache):
+        self.cache = cache
+        # Every stored binding is loaded up front so that datasets are reference-counted correctly
+        self._sessions: Dict[str, str] = {}
+        for data_id in session_store.list_json("session"):
+            meta = session_store.load_json(data_id, "session")
+            if meta is not None:
+                self._sessions[data_id] = meta["dataset"]
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._dataset_jobs: Dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    def bind_session(self, data_id: str, dataset_key: str) -> Optional[str]:
+        """
+        Points a session at a dataset. Returns the dataset it pointed at before if no session is bound to that one any more.
+        """
+        with self._lock:
+            previous = self.get_session_dataset(data_id)
+            self._sessions[data_id] = dataset_key
+            session_store.save_json(data_id, "session", {"dataset": dataset_key})
+            if previous is not None and previous != dataset_key and not self.has_sessions(previous):
+                return previous
+        return None
+
+    def has_sessions(self, dataset_key: str) -> bool:
+        return dataset_key in self._sessions.values()
+
+    def get_session_dataset(self, data_id: str) -> Optional[str]:
+        if data_id not in self._sessions:
+            meta = session_store.load_json(data_id, "session")
+            if meta is None:
+                return None
+            self._sessions[data_id] = meta["dataset"]
+        return self._sessions[data_id]
+
+    def list_sessions(self) -> Dict[str, str]:
+        return dict(self._sessions)
+
+    def put_history(self, data_id: str, history: List[Dict[str, Any]]):
+        self.cache.put_history(data_id, history)
+
+    def append_history(self, data_id: str, event: Dict[str, Any]) -> int:
+        return self.cache.append_history(data_id, event)
+
+    def update_history_response(self, data_id: str, seq: int, updates: Dict[str, Any]) -> bool:
+        return self.cache.update_history_response(data_id, seq, updates)
+
+    def get_history(self, data_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self.cache.get_history(data_id)
+
+    def get_history_event(self, data_id: str, seq: int) -> Optional[Dict[str, Any]]:
+        history = self.cache.get_history(data_id)
+        return history[seq] if history is not None and 0 <= seq < len(history) else None
+
+    def save_job(self, job: Dict[str, Any]):
+        with self._lock:
+            self._jobs[job["job_id"]] = dict(job)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def set_dataset_job(self, dataset_key: str, job_id: str):
+        self._dataset_jobs[dataset_key] = job_id
+
+    def get_dataset_job(self, dataset_key: str) -> Optional[str]:
+        return self._dataset_jobs.get(dataset_key)
+
+
+class SQLiteSessionBackend:
+    """
+    Backend shared by every worker process through a SQLite database (WAL mode).
+    DataFrames are not stored here: workers memory-map them from the shared session store.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (data_id TEXT PRIMARY KEY, dataset_key TEXT NOT NULL);
+    CREATE INDEX IF NOT EXISTS sessions_by_dataset ON sessions (dataset_key);
+    CREATE TABLE IF NOT EXISTS history (data_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (data_id, seq));
+    CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS dataset_jobs (dataset_key TEXT PRIMARY KEY, job_id TEXT NOT NULL);
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def bind_session(self, data_id: str, dataset_key: str) -> Optional[str]:
+        conn = self._conn()
+        with conn:
+            # Rebinding and counting the remaining sessions of the old dataset is one transaction
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT dataset_key FROM sessions WHERE data_id = ?", (data_id,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (data_id, dataset_key))
+            if row is None or row[0] == dataset_key:
+                return None
+            bound = conn.execute("SELECT 1 FROM sessions WHERE dataset_key = ? LIMIT 1", (row[0],)).fetchone()
+        return None if bound else row[0]
+
+    def has_sessions(self, dataset_key: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM sessions WHERE dataset_key = ? LIMIT 1", (dataset_key,)).fetchone() is not None
+
+    def get_session_dataset(self, data_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT dataset_key FROM sessions WHERE data_id = ?", (data_id,)).fetchone()
+        return row[0] if row else None
+
+    def list_sessions(self) -> Dict[str, str]:
+        return dict(self._conn().execute("SELECT data_id, dataset_key FROM sessions").fetchall())
+
+    def put_history(self, data_id: str, history: List[Dict[str, Any]]):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM history WHERE data_id = ?", (data_id,))
+            conn.executemany(
+                "INSERT INTO history VALUES (?, ?, ?)",
+                [(data_id, seq, json.dumps(event, default=str)) for seq, event in enumerate(history)],
+            )
+
+    def append_history(self, data_id: str, event: Dict[str, Any]) -> int:
+        with self._conn() as conn:
+            return conn.execute(
+                "INSERT INTO history SELECT ?, COALESCE(MAX(seq) + 1, 0), ? FROM history WHERE data_id = ? RETURNING seq",
+                (data_id, json.dumps(event, default=str), data_id),
+            ).fetchone()[0]
+
+    def update_history_response(self, data_id: str, seq: int, updates: Dict[str, Any]) -> bool:
+        conn = self._conn()
+        with conn:
+            # Take the write lock before reading so a concurrent update of the same event is not lost
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT event FROM history WHERE data_id = ? AND seq = ?", (data_id, seq)).fetchone()
+            if row is None:
+                return False
+            event = json.loads(row[0])
+            event["response"].update(updates)
+            conn.execute("UPDATE history SET event = ? WHERE data_id = ? AND seq = ?", (json.dumps(event, default=str), data_id, seq))
+        return True
+
+    def get_history(self, data_id: str) -> Optional[List[Dict[str, Any]]]:
+        rows = self._conn().execute("SELECT event FROM history WHERE data_id = ? ORDER BY seq", (data_id,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_history_event(self, data_id: str, seq: int) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT event FROM history WHERE data_id = ? AND seq = ?", (data_id, seq)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_job(self, job: Dict[str, Any]):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?)", (job["job_id"], json.dumps(job, default=str)))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_dataset_job(self, dataset_key: str, job_id: str):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO dataset_jobs VALUES (?, ?)", (dataset_key, job_id))
+
+    def get_dataset_job(self, dataset_key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT job_id FROM dataset_jobs WHERE dataset_key = ?", (dataset_key,)).fetchone()
+        return row[0] if row else None
+
+
+def create_backend(kind: str, cache: SessionCache):
+    if kind == "memory":
+        return MemorySessionBackend(cache)
+    if kind == "sqlite":
+        if not session_store.STORE_ENABLED:
+            raise RuntimeError("The sqlite session backend needs the session store (pyarrow, SESSION_STORE=1)")
+        return SQLiteSessionBackend()
+    raise ValueError(f"Unknown SESSION_BACKEND: {kind}")
+
+
+# DataFrames (keyed by dataset) and, for the memory backend, histories (keyed by data_id)
+# live in a byte-budgeted LRU/TTL cache. Cached frames are memory-mapped views over the
+# stored Arrow files, so workers share them through the page cache.
+session_cache = SessionCache()
+backend = create_backend(SESSION_BACKEND, session_cache)
+# Dropping a frame from the cache keeps its stored file while sessions are bound to its dataset
+session_cache.is_bound = backend.has_sessions
+logger.info(f"Using {SESSION_BACKEND} session backend")
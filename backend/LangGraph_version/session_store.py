@@ -0,0 +1,141 @@
+import os
+import json
+import uuid
+import logging
+import tempfile
+from typing import Any, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # the store is optional
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one Arrow IPC (Feather v2) file per stored DataFrame
+STORE_DIR = os.getenv("SESSION_STORE_DIR", os.path.join(tempfile.gettempdir(), "finkraft_sessions"))
+STORE_ENABLED = os.getenv("SESSION_STORE", "1") == "1" and pa is not None
+
+
+def _path(key: str, suffix: str = "arrow") -> str:
+    # Keys end up in file paths and may come from request URLs, so only accept uuids
+    try:
+        key = str(uuid.UUID(key))
+    except ValueError:
+        raise ValueError("Invalid data_id")
+    return os.path.join(STORE_DIR, f"{key}.{suffix}")
+
+
+def save_dataframe(key: str, df: pd.DataFrame) -> bool:
+    """
+    Persists a DataFrame as an uncompressed Arrow IPC file so it can be memory-mapped back.
+    Returns False when the store is disabled or the frame cannot be represented in Arrow.
+    """
+    if not STORE_ENABLED:
+        return False
+    path = _path(key)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=not isinstance(df.index, pd.RangeIndex))
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        logger.warning(f"DataFrame {key} cannot be stored as Arrow, keeping it in memory: {e}")
+        return False
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    # Write next to the target and rename so readers in other processes never see a partial file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return True
+
+
+def load_table(key: str) -> Optional["pa.Table"]:
+    """
+    Memory-maps a stored DataFrame as an Arrow table, without converting it to pandas.
+    Returns None when the key is not in the store.
+    """
+    if not STORE_ENABLED:
+        return None
+    path = _path(key)
+    if not os.path.exists(path):
+        return None
+    source = pa.memory_map(path, "r")
+    return ipc.open_file(source).read_all()
+
+
+def load_dataframe(key: str) -> Optional[pd.DataFrame]:
+    """
+    Memory-maps a stored DataFrame. Numeric columns without nulls are zero-copy views
+    over the mapped file; pages are shared through the OS page cache.
+    Returns None when the key is not in the store.
+    """
+    table = load_table(key)
+    if table is None:
+        return None
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+
+def has_dataframe(key: str) -> bool:
+    try:
+        return STORE_ENABLED and os.path.exists(_path(key))
+    except ValueError:
+        return False
+
+
+def delete_dataframe(key: str):
+    """
+    Removes a stored DataFrame. Existing memory-mapped views stay valid until released.
+    """
+    if STORE_ENABLED and os.path.exists(_path(key)):
+        os.remove(_path(key))
+
+
+def save_json(key: str, name: str, obj: Any) -> bool:
+    """
+    Persists a JSON document (history, profile, session metadata) for a key.
+    Returns False when the store is disabled.
+    """
+    if not STORE_ENABLED:
+        return False
+    path = _path(key, f"{name}.json")
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, default=str)
+    os.replace(tmp_path, path)
+    return True
+
+
+def load_json(key: str, name: str) -> Optional[Any]:
+    """
+    Loads a JSON document stored for a key. Returns None when there is none.
+    """
+    if not STORE_ENABLED:
+        return None
+    try:
+        path = _path(key, f"{name}.json")
+    except ValueError:
+        return None
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def list_json(name: str) -> List[str]:
+    """
+    Keys that have a JSON document of the given name stored.
+    """
+    if not STORE_ENABLED or not os.path.isdir(STORE_DIR):
+        return []
+    suffix = f".{name}.json"
+    return [entry[:-len(suffix)] for entry in os.listdir(STORE_DIR) if entry.endswith(suffix)]
+
+
+def delete_json(key: str, name: str):
+    if STORE_ENABLED and os.path.exists(_path(key, f"{name}.json")):
+        os.remove(_path(key, f"{name}.json"))
@@ -0,0 +1,270 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+from .prompt_context import sample_examples
+
+# Sketch sizes: HLL_PRECISION=14 gives 16384 registers (~0.8% standard error);
+# QUANTILE_K items per quantile-sketch level; RESERVOIR_SIZE example rows kept.
+HLL_PRECISION = 14
+QUANTILE_K = 2048
+RESERVOIR_SIZE = 1000
+
+_MIX = np.uint64(0x100000001B3)
+
+
+def hash_series(series: pd.Series) -> np.ndarray:
+    """
+    64-bit hash of every value, consistent across chunks (categories are hashed by value, not code).
+    """
+    return pd.util.hash_pandas_object(series, index=False, categorize=False).to_numpy()
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch over 64-bit hashes (Flajolet et al.), with linear counting for small ranges.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes << np.uint64(self.p)
+        # rank = leading zeros of the remaining bits + 1; log2 on floats can round up, so correct it
+        nonzero = rest != 0
+        top_bit = np.zeros(len(rest), dtype=np.int64)
+        top_bit[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64)
+        overshoot = nonzero & ((rest >> top_bit.astype(np.uint64)) == 0)
+        top_bit[overshoot] -= 1
+        rank = np.where(nonzero, 64 - top_bit, 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, np.minimum(rank, 64 - self.p + 1).astype(np.uint8))
+
+    def estimate(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros > 0:
+            return self.m * math.log(self.m / zeros)
+        return float(raw)
+
+    def relative_error(self) -> float:
+        # Two standard errors, i.e. ~95% of estimates fall within this fraction of the truth
+        return 2 * 1.04 / math.sqrt(self.m)
+
+
+class QuantileSketch:
+    """
+    KLL-style quantile sketch: a stack of compactors holding at most k items each. A full
+    compactor sorts its items and promotes every other one (random offset) with doubled weight.
+    Each compaction at level h shifts any rank by at most 2^h, which bounds the normalized
+    rank error by (number of levels) / k.
+    """
+
+    def __init__(self, k: int = QUANTILE_K, seed: int = 0):
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # Keep an even number of items in the compaction; a leftover stays at this level
+                leftover = items[:len(items) % 2]
+                promoted = items[len(leftover):][self._rng.integers(2)::2]
+                self.levels[level] = leftover
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q: float) -> float:
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return float("nan")
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return float(items[order][min(position, len(items) - 1)])
+
+    def rank_error(self) -> float:
+        return 0.0 if len(self.levels) == 1 else (len(self.levels) - 1) / self.k
+
+
+class Reservoir:
+    """
+    Uniform sample of row positions over a stream of chunks (Algorithm R, vectorized per chunk).
+    Positions rather than rows are kept since the parsed chunks end up in the final frame anyway.
+    """
+
+    def __init__(self, size: int = RESERVOIR_SIZE, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self.positions = np.empty(0, dtype=np.int64)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, n: int):
+        positions = np.arange(self.seen, self.seen + n)
+        self.seen += n
+        fill = min(max(self.size - len(self.positions), 0), n)
+        self.positions = np.concatenate([self.positions, positions[:fill]])
+        positions = positions[fill:]
+        slots = self._rng.integers(0, positions + 1) if len(positions) else positions
+        accepted = slots < self.size
+        slots, positions = slots[accepted][::-1], positions[accepted][::-1]
+        # A slot replaced several times within a chunk keeps the latest row
+        slots, latest = np.unique(slots, return_index=True)
+        self.positions[slots] = positions[latest]
+
+    def take(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df.iloc[np.sort(self.positions)]
+
+
+class StreamingProfile:
+    """
+    Builds an approximate profile from the chunks seen during ingestion, without another
+    pass over the data: exact nulls/counts/mean/std/min/max, HyperLogLog distinct counts and
+    duplicate rows, quantile-sketch percentiles and a reservoir sample of rows, which supplies
+    the example values of text columns (see examples()).
+    The result has the same shape as profiler.get_profile, plus an 'approximate' section
+    holding the error bound of every estimated figure.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns: Dict[str, Dict[str, Any]] = {}
+        self.row_hll = HyperLogLog()
+        self.reservoir = Reservoir()
+
+    def _column(self, col: str) -> Dict[str, Any]:
+        if col not in self.columns:
+            self.columns[col] = {"nulls": 0, "hll": HyperLogLog(), "categories": set(), "numeric": None}
+        return self.columns[col]
+
+    def update(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        row_hash = np.zeros(len(chunk), dtype=np.uint64)
+        for col in chunk.columns:
+            series = chunk[col]
+            state = self._column(col)
+            nulls = series.isna().to_numpy()
+            state["nulls"] += int(nulls.sum())
+            hashes = hash_series(series)
+            with np.errstate(over="ignore"):
+                row_hash = (row_hash ^ hashes) * _MIX
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Categorical columns are low-cardinality by construction: count them exactly
+                codes = series.cat.codes.to_numpy()
+                state["categories"].update(series.cat.categories[np.unique(codes[codes >= 0])].tolist())
+            else:
+                state["hll"].update(hashes[~nulls])
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                self._update_numeric(state, series.to_numpy(dtype=np.float64, na_value=np.nan))
+        self.row_hll.update(row_hash)
+        self.reservoir.update(len(chunk))
+
+    def _update_numeric(self, state: Dict[str, Any], values: np.ndarray):
+        numeric = state["numeric"]
+        if numeric is None:
+            numeric = state["numeric"] = {"count": 0, "mean": 0.0, "m2": 0.0, "min": np.inf, "max": -np.inf, "sketch": QuantileSketch()}
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            return
+        # Chan et al. parallel update of the running mean and sum of squared deviations
+        n_a, n_b = numeric["count"], len(present)
+        mean_b = float(present.mean())
+        m2_b = float(((present - mean_b) ** 2).sum())
+        delta = mean_b - numeric["mean"]
+        total = n_a + n_b
+        numeric["mean"] += delta * n_b / total
+        numeric["m2"] += m2_b + delta ** 2 * n_a * n_b / total
+        numeric["count"] = total
+        numeric["min"] = min(numeric["min"], float(present.min()))
+        numeric["max"] = max(numeric["max"], float(present.max()))
+        numeric["sketch"].update(present)
+
+    def sample(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Uniform sample of the rows of the parsed frame.
+        """
+        return self.reservoir.take(df)
+
+    def examples(self, df: pd.DataFrame) -> Dict[str, List[str]]:
+        """
+        Example values of the text columns drawn from the sample, rather than from the first rows.
+        """
+        return sample_examples(self.sample(df))
+
+    def to_profile(self, df: pd.DataFrame) -> dict:
+        """
+        Finalizes the profile. df is only used for its final dtypes and memory usage.
+        """
+        column_details = []
+        numeric_summary = {}
+        bounds = {"Distinct Count": {}, "numeric_summary": {}}
+        for col in df.columns:
+            state = self._column(col)
+            if state["categories"]:
+                distinct, distinct_error = len(state["categories"]), 0
+            else:
+                distinct = int(round(state["hll"].estimate()))
+                distinct_error = int(math.ceil(distinct * state["hll"].relative_error()))
+            column_details.append({
+                "Column": col,
+                "Non-Null Count": self.rows - state["nulls"],
+                "Null Count": state["nulls"],
+                "Data Type": str(df[col].dtype),
+                "Distinct Count": distinct,
+            })
+            bounds["Distinct Count"][col] = distinct_error
+
+            numeric = state["numeric"]
+            if numeric is not None and pd.api.types.is_numeric_dtype(df[col]):
+                count = numeric["count"]
+                sketch = numeric["sketch"]
+                summary = {
+                    "count": float(count),
+                    "mean": numeric["mean"] if count else np.nan,
+                    "std": math.sqrt(numeric["m2"] / (count - 1)) if count > 1 else np.nan,
+                    "min": numeric["min"] if count else np.nan,
+                    "25%": sketch.quantile(0.25),
+                    "50%": sketch.quantile(0.5),
+                    "75%": sketch.quantile(0.75),
+                    "max": numeric["max"] if count else np.nan,
+                }
+                numeric_summary[col] = {stat: round(float(value), 2) for stat, value in summary.items()}
+                # Percentiles are within this fraction of the rows of their true rank
+                bounds["numeric_summary"][col] = {"25%": sketch.rank_error(), "50%": sketch.rank_error(), "75%": sketch.rank_error()}
+
+        distinct_rows = min(self.rows, int(round(self.row_hll.estimate())))
+        bounds["Duplicate Rows"] = int(math.ceil(distinct_rows * self.row_hll.relative_error()))
+        return {
+            "dataset_summary": {
+                "Number of Rows": self.rows,
+                "Number of Columns": len(df.columns),
+                "Duplicate Rows": self.rows - distinct_rows,
+                "Memory Usage": f"{df.memory_usage(deep=True).sum() / 1024**2:.2f} MB",
+            },
+            "column_details": column_details,
+            "numeric_summary": numeric_summary,
+            "approximate": {
+                "method": "HyperLogLog distinct counts, KLL-style quantiles, reservoir sample",
+                "error_bounds": bounds,
+                "sample_rows": len(self.reservoir.positions),
+                "examples": self.examples(df),
+            },
+        }
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from . import session_store
+
+logger = logging.getLogger(__name__)
+
+# Global budget for resident DataFrames plus histories, in bytes
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 * 1024**3)))
+# Sessions idle for longer than this are evicted (0 disables the TTL)
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+# Evicted sessions are spilled to the session store instead of being dropped
+CACHE_SPILL = os.getenv("CACHE_SPILL", "1") == "1"
+
+
+def _event_size(event: Dict[str, Any]) -> int:
+    return len(json.dumps(event, default=str))
+
+
+class SessionCache:
+    """
+    Holds DataFrames (keyed by dataset) and histories (keyed by session) under a
+    global byte budget. Entries are evicted least-recently-used first when the budget is exceeded, and
+    after CACHE_TTL_SECONDS of inactivity. Evicted sessions are either spilled to the
+    session store (and transparently reloaded on the next access) or dropped. A dropped
+    frame's stored file is kept while is_bound reports sessions bound to its dataset.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl_seconds: float = CACHE_TTL_SECONDS, spill: bool = CACHE_SPILL):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill = spill
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.is_bound: Callable[[str], bool] = lambda key: False
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "spills": 0, "reloads": 0}
+
+    def _entry(self, data_id: str) -> Dict[str, Any]:
+        entry = self._sessions.get(data_id)
+        if entry is None:
+            entry = {"df": None, "df_bytes": 0, "history": None, "history_bytes": 0}
+            self._sessions[data_id] = entry
+        entry["last_access"] = time.monotonic()
+        self._sessions.move_to_end(data_id)
+        return entry
+
+    def resident_bytes(self) -> int:
+        return sum(e["df_bytes"] + e["history_bytes"] for e in self._sessions.values())
+
+    def get_dataframe(self, data_id: str) -> Optional[pd.DataFrame]:
+        """
+        Returns the DataFrame stored under a key, reloading it from the session store on a miss.
+        Returns None when the key is unknown.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(data_id)
+            if entry is not None and entry["df"] is not None:
+                self.counters["hits"] += 1
+                return self._entry(data_id)["df"]
+            self.counters["misses"] += 1
+            df = session_store.load_dataframe(data_id)
+            if df is None:
+                return None
+            self.counters["reloads"] += 1
+            self.put_dataframe(data_id, df)
+            return df
+
+    def put_dataframe(self, data_id: str, df: pd.DataFrame):
+        with self._lock:
+            entry = self._entry(data_id)
+            entry["df"] = df
+            entry["df_bytes"] = int(df.memory_usage(deep=True).sum())
+            self._enforce_budget(data_id)
+
+    def get_history(self, data_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns the session's history, reloading a spilled history from the session store.
+        Returns None when the session has no history.
+        """
+        with self._lock:
+            entry = self._sessions.get(data_id)
+            if entry is not None and entry["history"] is not None:
+                return self._entry(data_id)["history"]
+            history = session_store.load_json(data_id, "history")
+            if history is None:
+                return None
+            self.counters["reloads"] += 1
+            self.put_history(data_id, history)
+            return history
+
+    def put_history(self, data_id: str, history: List[Dict[str, Any]]):
+        with self._lock:
+            entry = self._entry(data_id)
+            entry["history"] = history
+            entry["history_bytes"] = sum(_event_size(event) for event in history)
+            self._enforce_budget(data_id)
+
+    def append_history(self, data_id: str, event: Dict[str, Any]) -> int:
+        with self._lock:
+            history = self.get_history(data_id)
+            if history is None:
+                history = []
+                self.put_history(data_id, history)
+            history.append(event)
+            self._sessions[data_id]["history_bytes"] += _event_size(event)
+            self._enforce_budget(data_id)
+            return len(history) - 1
+
+    def update_history_response(self, data_id: str, seq: int, updates: Dict[str, Any]) -> bool:
+        """
+        Merges updates into the response of the seq-th history event. Returns False if there is no such event.
+        """
+        with self._lock:
+            history = self.get_history(data_id)
+            if history is None or not 0 <= seq < len(history):
+                return False
+            event = history[seq]
+            size = _event_size(event)
+            event["response"].update(updates)
+            self._sessions[data_id]["history_bytes"] += _event_size(event) - size
+            self._enforce_budget(data_id)
+            return True
+
+    def contains(self, data_id: str) -> bool:
+        with self._lock:
+            return data_id in self._sessions or session_store.has_dataframe(data_id)
+
+    def _evict(self, data_id: str, reason: str):
+        entry = self._sessions.pop(data_id)
+        self.counters[reason] += 1
+        if self.spill:
+            # Frames are normally already in the store; only frames that were never stored need writing
+            if entry["df"] is not None and not session_store.has_dataframe(data_id):
+                session_store.save_dataframe(data_id, entry["df"])
+            if entry["history"] is not None:
+                session_store.save_json(data_id, "history", entry["history"])
+            self.counters["spills"] += 1
+        else:
+            if not self.is_bound(data_id):
+                session_store.delete_dataframe(data_id)
+            session_store.delete_json(data_id, "history")
+        logger.info(f"Evicted session {data_id} ({reason}, {entry['df_bytes'] + entry['history_bytes']} bytes)")
+
+    def discard(self, data_id: str):
+        """
+        Forgets an entry without spilling it, e.g. a dataset no session is bound to any more.
+        """
+        with self._lock:
+            self._sessions.pop(data_id, None)
+
+    def _expire(self):
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        for data_id in [k for k, e in self._sessions.items() if e["last_access"] < cutoff]:
+            self._evict(data_id, "expirations")
+
+    def _enforce_budget(self, keep: str):
+        # The session being accessed is never evicted, even if it alone exceeds the budget
+        while self.resident_bytes() > self.max_bytes and len(self._sessions) > 1:
+            lru_id = next(iter(self._sessions))
+            if lru_id == keep:
+                self._sessions.move_to_end(keep)
+                lru_id = next(iter(self._sessions))
+            self._evict(lru_id, "evictions")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Reports hit/miss/eviction counters and resident bytes per session.
+        """
+        with self._lock:
+            self._expire()
+            now = time.monotonic()
+            sessions = {
+                data_id: {
+                    "dataframe_bytes": e["df_bytes"],
+                    "history_bytes": e["history_bytes"],
+                    "idle_seconds": round(now - e["last_access"], 1),
+                }
+                for data_id, e in self._sessions.items()
+            }
+            return {
+                **self.counters,
+                "resident_bytes": self.resident_bytes(),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "spill": self.spill,
+                "sessions": sessions,
+            }
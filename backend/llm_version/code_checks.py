@@ -0,0 +1,186 @@
+import os
+import ast
+import difflib
+import logging
+import threading
+import traceback
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Generated code that fails (pre-check or execution) goes back to the model with its error
+# at most this many times per query before the error is returned to the user
+MAX_CODE_RETRIES = int(os.getenv("MAX_CODE_RETRIES", "2"))
+# Characters of the error message passed to the repair prompt
+REPAIR_ERROR_CHARS = 1500
+
+# df methods whose positional or keyword arguments name existing columns
+_COLUMN_METHODS = {
+    "groupby": ("by",), "sort_values": ("by",), "set_index": ("keys",), "nlargest": ("columns",),
+    "nsmallest": ("columns",), "drop_duplicates": ("subset",), "dropna": ("subset",),
+    "pivot_table": ("values", "index", "columns"), "value_counts": ("subset",),
+}
+# Position of the column argument, for methods that take it positionally (nlargest(n, columns))
+_COLUMN_POSITIONS = {"groupby": 0, "sort_values": 0, "set_index": 0, "nlargest": 1, "nsmallest": 1,
+                     "drop_duplicates": 0, "pivot_table": 0, "value_counts": 0}
+
+
+class PrecheckError(ValueError):
+    """
+    Generated code rejected before execution. kind is 'syntax', 'columns', 'result' or 'cost'.
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+class ExecutionLimitError(RuntimeError):
+    """An execution that was stopped for exceeding EXEC_TIMEOUT_SECONDS or EXEC_MAX_RSS_MB."""
+
+
+def _column_names(node: Optional[ast.AST]) -> list:
+    # A string constant or a list/tuple of string constants; anything computed is not checked
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)) and all(isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts):
+        return [e.value for e in node.elts]
+    return []
+
+
+def _referenced_columns(tree: ast.AST) -> Dict[str, int]:
+    """
+    Column names the code reads directly from df ({name: line}): df['a'], df[['a', 'b']] and the
+    column arguments of df.groupby, df.sort_values, df.nlargest, ... Columns the code assigns to df
+    are left out, and nothing is returned when df itself is rebound.
+    """
+    created, referenced = set(), {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "df" and isinstance(node.ctx, ast.Store):
+            return {}
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "df":
+            names = _column_names(node.slice)
+            if isinstance(node.ctx, ast.Store):
+                created.update(names)
+            else:
+                referenced.update((name, node.lineno) for name in names if name not in referenced)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name)
+              and node.func.value.id == "df" and node.func.attr in _COLUMN_METHODS):
+            arguments = [kw.value for kw in node.keywords if kw.arg in _COLUMN_METHODS[node.func.attr]]
+            position = _COLUMN_POSITIONS.get(node.func.attr)
+            if position is not None and len(node.args) > position:
+                arguments.append(node.args[position])
+            for argument in arguments:
+                referenced.update((name, node.lineno) for name in _column_names(argument) if name not in referenced)
+    return {name: line for name, line in referenced.items() if name not in created}
+
+
+def precheck_code(code: str, columns: Iterable[Any]):
+    """
+    Cheap checks of generated code before it runs: it must parse, assign 'result_df', and only
+    read columns df has. Raises PrecheckError with a message the model can act on.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise PrecheckError("syntax", f"SyntaxError: {e.msg} (line {e.lineno}: {(e.text or '').strip()})")
+    if not any(isinstance(node, ast.Name) and node.id == "result_df" and isinstance(node.ctx, ast.Store) for node in ast.walk(tree)):
+        raise PrecheckError("result", "The code does not assign a variable named 'result_df'.")
+    available = [str(column) for column in columns]
+    known = set(available)
+    unknown = [(name, line) for name, line in _referenced_columns(tree).items() if name not in known]
+    if unknown:
+        problems = []
+        for name, line in unknown:
+            close = difflib.get_close_matches(name, available, n=3, cutoff=0.6)
+            hint = f"; did you mean {', '.join(repr(c) for c in close)}?" if close else ""
+            problems.append(f"'{name}' (line {line}){hint}")
+        raise PrecheckError("columns", f"Unknown column(s) in df: {'; '.join(problems)}")
+
+
+def generated_code_lines(error: BaseException) -> List[int]:
+    """
+    Line numbers of the generated code the exception's traceback passed through. Errors raised
+    in an execution worker carry them in 'generated_code_lines', as their traceback is lost.
+    """
+    lines = getattr(error, "generated_code_lines", None)
+    if lines is None:
+        lines = [frame.lineno for frame in traceback.extract_tb(error.__traceback__) if frame.filename == "<string>"]
+    return lines
+
+
+def describe_failure(error: Exception, code: Optional[str] = None) -> str:
+    """
+    The exception as the repair prompt shows it: type and message, preceded by the lines of the
+    generated code the traceback passed through (pandas' internal frames are left out).
+    """
+    message = "".join(traceback.format_exception_only(type(error), error)).strip()
+    if isinstance(error, PrecheckError):
+        message = str(error)
+    lines = code.splitlines() if code else []
+    frames = [f"  line {line}: {lines[line - 1].strip()}" for line in generated_code_lines(error) if line and 0 < line <= len(lines)]
+    if frames:
+        message = "Traceback (generated code):\n" + "\n".join(frames) + "\n" + message
+    return message[-REPAIR_ERROR_CHARS:]
+
+
+def failure_kind(error: Exception) -> str:
+    return error.kind if isinstance(error, PrecheckError) else "execution"
+
+
+def repair_instructions(code: Optional[str], error: str, language: str = "python") -> str:
+    """
+    Prompt section asking the model to fix its previous attempt.
+    """
+    previous = f"Your previous code was:\n```{language}\n{code}\n```\n" if code else "Your previous response could not be used.\n"
+    return (f"\n{previous}It failed with:\n{error}\n"
+            "Fix the problem and return the complete corrected response in the same JSON format. "
+            "Only use columns that exist in the dataframe.\n")
+
+
+class RetryStats:
+    """
+    Per-process counters of code generation attempts: how many retries each query needed,
+    how many ran out of retries, and what the failed attempts failed on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries: Dict[int, int] = defaultdict(int)
+        self.first_attempt = 0
+        self.exhausted = 0
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    def failure(self, kind: str):
+        with self._lock:
+            self.failures[kind] += 1
+
+    def record(self, retries: int, succeeded: bool):
+        """Counts a finished query that needed `retries` retries."""
+        with self._lock:
+            self.retries[retries] += 1
+            if succeeded and not retries:
+                self.first_attempt += 1
+            if not succeeded:
+                self.exhausted += 1
+        if retries:
+            logger.info(f"Code generation {'succeeded' if succeeded else 'gave up'} after {retries} retries")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queries = sum(self.retries.values())
+            total = sum(retries * count for retries, count in self.retries.items())
+            return {
+                "max_retries": MAX_CODE_RETRIES,
+                "queries": queries,
+                "first_attempt_success": self.first_attempt,
+                "exhausted": self.exhausted,
+                "retries": total,
+                "mean_retries": round(total / queries, 4) if queries else None,
+                "retry_histogram": dict(sorted(self.retries.items())),
+                "failures": dict(self.failures),
+            }
+
+
+retry_stats = RetryStats()
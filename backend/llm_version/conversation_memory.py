@@ -0,0 +1,162 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from . import session_store
+from .data_tools import get_history
+from .llm_cache import response_cache
+from .prompt_context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Prompts carry the conversation as a running summary of the older turns plus the latest turns
+# verbatim, so their size stays flat however long the session gets. After each turn, the turns
+# that dropped out of the recent window are folded into the summary in the background.
+MEMORY_RECENT_TOKENS = int(os.getenv("MEMORY_RECENT_TOKENS", "600"))
+# Length the model is asked to keep the running summary under, in words
+MEMORY_SUMMARY_WORDS = int(os.getenv("MEMORY_SUMMARY_WORDS", "150"))
+# Characters of an assistant explanation kept per turn
+MEMORY_EXPLANATION_CHARS = 600
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# Memories of sessions whose store is disabled, and per-session locks serializing updates
+_memories: Dict[str, Dict[str, Any]] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+# Background updates still running (the event loop only keeps weak references)
+_background_tasks = set()
+
+
+class ConversationMemory(NamedTuple):
+    summary: str
+    # History events folded into the summary (they precede the recent turns)
+    summarized: int
+    recent: List[Dict[str, Any]]
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def format_turn(event: Dict[str, Any]) -> str:
+    lines = [f"User: {event['query']}"]
+    response = event.get("response") or {}
+    if response.get("explanation"):
+        lines.append(f"Assistant: {_clip(str(response['explanation']), MEMORY_EXPLANATION_CHARS)}")
+    elif response.get("suggestions"):
+        queries = "; ".join(str(s.get("query", "")) for s in response["suggestions"] if isinstance(s, dict))
+        lines.append(f"Assistant suggested: {queries}")
+    return "\n".join(lines)
+
+
+def recent_window(history: List[Dict[str, Any]], budget: Optional[int] = None) -> int:
+    """
+    Index of the first turn of the recent window: the latest turns that fit in budget tokens
+    (MEMORY_RECENT_TOKENS by default), and always the last turn.
+    """
+    budget = MEMORY_RECENT_TOKENS if budget is None else budget
+    start, used = len(history), 0
+    while start > 0:
+        tokens = estimate_tokens(format_turn(history[start - 1]))
+        if start < len(history) and used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    return start
+
+
+def _load(data_id: str) -> Dict[str, Any]:
+    state = session_store.load_json(data_id, "memory") or _memories.get(data_id)
+    return state or {"summary": "", "summarized": 0}
+
+
+def _save(data_id: str, state: Dict[str, Any]):
+    if not session_store.save_json(data_id, "memory", state):
+        _memories[data_id] = state
+
+
+def get_memory(data_id: Optional[str], history: List[Dict[str, Any]]) -> ConversationMemory:
+    """
+    The session's running summary and the recent turns of history that it does not cover
+    (only the recent turns without a data_id). A turn that has left the window but is not
+    summarized yet (its update is still running) is left out.
+    """
+    state = _load(data_id) if data_id else {"summary": "", "summarized": 0}
+    summarized = min(state["summarized"], len(history))
+    start = max(recent_window(history), summarized)
+    return ConversationMemory(state["summary"] if summarized else "", summarized, history[start:])
+
+
+def format_memory(memory: ConversationMemory) -> str:
+    """
+    The conversation as prompts include it: the summary of earlier turns, then the recent turns.
+    """
+    parts = [f"Summary of the earlier conversation: {memory.summary}"] if memory.summary else []
+    parts.extend(format_turn(event) for event in memory.recent)
+    return "\n".join(parts)
+
+
+def _extractive_summary(summary: str, turns: List[Dict[str, Any]]) -> str:
+    # Without the model: each question with the first sentence of its answer, oldest dropped first
+    lines = [line for line in summary.split("\n") if line] if summary else []
+    for event in turns:
+        explanation = str((event.get("response") or {}).get("explanation") or "")
+        answer = _SENTENCE_END.split(explanation.strip(), 1)[0] if explanation else "no answer"
+        lines.append(f"- {_clip(event['query'], 120)}: {_clip(answer, 160)}")
+    while len(lines) > 1 and len(" ".join(lines).split()) > MEMORY_SUMMARY_WORDS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+async def _fold(summary: str, turns: List[Dict[str, Any]], generate: Callable[[str], Awaitable[str]]) -> str:
+    new_turns = "\n".join(format_turn(event) for event in turns)
+    prompt = f"""You maintain the running summary of a conversation between a user and a data analyst bot.
+    Update the summary with the new turns, in at most {MEMORY_SUMMARY_WORDS} words. Keep what later
+    questions may refer back to: the filters, columns, groupings and key numbers of each result.
+
+    Current summary:
+    {summary or "(none)"}
+
+    New turns:
+    {new_turns}
+
+    Reply with the updated summary only.
+    """
+    cache_key = response_cache.make_key("memory_summary", "", history=[summary, new_turns])
+    return (await response_cache.acached("memory_summary", cache_key, lambda: generate(prompt))).strip()
+
+
+async def update_memory(data_id: str, generate: Callable[[str], Awaitable[str]],
+                        history: Optional[List[Dict[str, Any]]] = None) -> ConversationMemory:
+    """
+    Folds the turns that left the recent window into the session's summary, with one model call
+    over the current summary and those turns only. The extractive summary is used if the call fails.
+    """
+    lock = _locks.setdefault(data_id, asyncio.Lock())
+    async with lock:
+        if history is None:
+            history = await asyncio.to_thread(get_history, data_id)
+        state = await asyncio.to_thread(_load, data_id)
+        start = recent_window(history)
+        if start > state["summarized"]:
+            turns = history[state["summarized"]:start]
+            try:
+                summary = await _fold(state["summary"], turns, generate)
+            except Exception as e:
+                logger.warning(f"Summarizing {len(turns)} turns of {data_id} failed, keeping an extractive summary: {e!r}")
+                summary = _extractive_summary(state["summary"], turns)
+            state = {"summary": summary, "summarized": start}
+            await asyncio.to_thread(_save, data_id, state)
+        return ConversationMemory(state["summary"], state["summarized"], history[max(start, state["summarized"]):])
+
+
+def schedule_memory_update(data_id: str, generate: Callable[[str], Awaitable[str]]) -> "asyncio.Task[ConversationMemory]":
+    """
+    Runs update_memory in the background once a turn has been added to the history.
+    """
+    task = asyncio.create_task(update_memory(data_id, generate))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
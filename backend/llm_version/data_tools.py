@@ -1,48 +1,315 @@
+import os
+import json
+import hashlib
+import logging
+import time
+import tempfile
+import threading
 import pandas as pd
-from typing import Dict, List, Any
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
 import uuid
+from .ingest import read_csv_compact
+from .profiler import get_profile
+from .sketches import StreamingProfile
+from .prompt_context import build_schema_summary, schema_fingerprint
+from . import session_store
+from .session_backend import backend, session_cache
+from . import jobs
 
-# In-memory caches
-data_cache: Dict[str, pd.DataFrame] = {}
-history_cache: Dict[str, List[Dict[str, Any]]] = {}
+logger = logging.getLogger(__name__)
 
-def load_csv_from_upload(file) -> str:
+# Parse uploads into compact dtypes (category / downcast numerics / datetimes)
+COMPACT_INGEST = os.getenv("COMPACT_INGEST", "1") == "1"
+HASH_BLOCK_SIZE = 1024 * 1024
+# How long a query waits for its upload to finish parsing before giving up
+PARSE_WAIT_SECONDS = float(os.getenv("PARSE_WAIT_SECONDS", "600"))
+# Polling interval when the upload is being parsed by another worker
+PARSE_POLL_SECONDS = 0.2
+# Default for uploads that don't choose: build an approximate profile from streaming sketches
+# while parsing instead of an exact profile afterwards (for very large uploads)
+APPROX_PROFILE = os.getenv("APPROX_PROFILE", "0") == "1"
+
+# Uploads are content-addressed: every data_id points at a dataset key derived from the
+# hash of the uploaded bytes, so identical uploads share one read-only frame and profile.
+# Session bindings, histories and jobs live in the session backend (see session_backend.py);
+# the dicts below are per-process memos keyed by dataset key. A dataset key never changes
+# content (updates re-point the session at a new key), so it doubles as the dataset version
+# and the memos never need invalidating.
+dataset_stats_cache: Dict[str, Dict[str, Any]] = {}
+profile_cache: Dict[str, dict] = {}
+prompt_context_cache: Dict[str, Dict[str, Any]] = {}
+# Example values of text columns from the reservoir sample of approximately profiled datasets
+example_cache: Dict[str, Dict[str, List[str]]] = {}
+# Background ingestion in this process: an event set once each dataset is parsed
+_parsed_events: Dict[str, threading.Event] = {}
+_ingest_lock = threading.Lock()
+_profile_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+def _stage_upload(file, optimize: bool) -> Tuple[str, str]:
+    """
+    Copies the uploaded bytes to a staging file while hashing them.
+    Returns the content-addressed dataset key and the staging path.
+    The ingestion mode is part of the hash since it changes the parsed frame.
+    """
+    digest = hashlib.sha256(b"compact:" if optimize else b"raw:")
+    with tempfile.NamedTemporaryFile(prefix="upload-", suffix=".csv", delete=False) as staged:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+            staged.write(block)
+    return str(uuid.UUID(bytes=digest.digest()[:16])), staged.name
+
+def _dataset_key(data_id: str) -> str:
+    dataset_key = backend.get_session_dataset(data_id)
+    if dataset_key is None:
+        raise ValueError("Invalid data_id")
+    return dataset_key
+
+def _ingest_dataset(job_id: str, dataset_key: str, path: str, optimize: bool, approx_profile: bool = False):
+    """
+    Background job: parses a staged upload, stores the frame, then profiles it.
+    With approx_profile, the profile is sketched from the chunks as they are parsed instead.
+    """
+    sketch = StreamingProfile() if approx_profile else None
+    try:
+        jobs.update_job(job_id, status="parsing")
+        with open(path, "rb") as f:
+            if optimize:
+                df, stats = read_csv_compact(f, progress=lambda rows: jobs.update_job(job_id, rows_parsed=rows),
+                                             on_chunk=sketch.update if sketch else None)
+            else:
+                df = pd.read_csv(f)
+                stats = {"rows": len(df), "columns": len(df.columns), "bytes_saved": 0}
+                if sketch:
+                    sketch.update(df)
+        if session_store.save_dataframe(dataset_key, df):
+            # Swap the parsed heap copy for a view over the stored file
+            df = session_store.load_dataframe(dataset_key)
+        session_cache.put_dataframe(dataset_key, df)
+        dataset_stats_cache[dataset_key] = stats
+        session_store.save_json(dataset_key, "ingest", stats)
+        if sketch:
+            # Stored before waking waiters, so the first prompt already uses the sampled examples
+            example_cache[dataset_key] = sketch.examples(df)
+            session_store.save_json(dataset_key, "examples", example_cache[dataset_key])
+        # Mark the job parsed before waking waiters, so queries can start while profiling runs
+        jobs.update_job(job_id, status="profiling", rows_parsed=len(df), total_columns=len(df.columns))
+    except Exception as e:
+        jobs.update_job(job_id, status="failed", error=str(e))
+        raise
+    finally:
+        os.remove(path)
+        _parsed_events[dataset_key].set()
+
+    timings = {}
+    if sketch:
+        start = time.perf_counter()
+        profile = sketch.to_profile(df)
+        with _profile_locks[dataset_key]:
+            session_store.save_json(dataset_key, "profile", profile)
+            profile_cache[dataset_key] = profile
+        timings["total"] = round(time.perf_counter() - start, 4)
+        jobs.update_job(job_id, columns_profiled=len(df.columns))
+    else:
+        _profile_dataset(dataset_key, df, progress=lambda cols: jobs.update_job(job_id, columns_profiled=cols), timings=timings)
+    logger.info(f"Profiled dataset {dataset_key}: {timings}")
+    jobs.update_job(job_id, status="done", profile_timings=timings)
+
+def stage_upload(file, optimize: bool = COMPACT_INGEST, approx_profile: Optional[bool] = None) -> Dict[str, str]:
     """
-    Loads a CSV file into a pandas DataFrame and stores it in the cache.
-    Initializes an empty history for the session.
+    Stores the uploaded bytes and schedules parsing and profiling in the background.
+    approx_profile selects the sketch-based profile, whose figures carry error bounds
+    (defaults to APPROX_PROFILE).
+    Uploads whose bytes match an existing or in-flight dataset reuse it (and its profile) without re-parsing.
+    Initializes an empty history for the session and returns its data_id and job_id.
     """
-    df = pd.read_csv(file)
+    if approx_profile is None:
+        approx_profile = APPROX_PROFILE
+    dataset_key, staged_path = _stage_upload(file, optimize)
     data_id = str(uuid.uuid4())
-    data_cache[data_id] = df
-    history_cache[data_id] = []  # Initialize history
-    return data_id
+    backend.bind_session(data_id, dataset_key)
+    backend.put_history(data_id, [])  # Initialize history
+
+    with _ingest_lock:
+        job_id = backend.get_dataset_job(dataset_key)
+        job = jobs.get_job(job_id) if job_id else None
+        if job is not None and job["status"] not in jobs.FINAL_STATUSES:
+            logger.info(f"Upload matches in-flight dataset {dataset_key} (job {job_id}), skipping parse.")
+            os.remove(staged_path)
+        elif session_cache.contains(dataset_key):
+            logger.info(f"Upload matches stored dataset {dataset_key}, skipping parse.")
+            os.remove(staged_path)
+            if job is None or job["status"] != "done":
+                stats = session_store.load_json(dataset_key, "ingest") or {}
+                job_id = jobs.create_job(dataset_key=dataset_key, status="done", rows_parsed=stats.get("rows", 0))
+                backend.set_dataset_job(dataset_key, job_id)
+        else:
+            job_id = jobs.create_job(dataset_key=dataset_key)
+            backend.set_dataset_job(dataset_key, job_id)
+            _parsed_events[dataset_key] = threading.Event()
+            jobs.submit(job_id, _ingest_dataset, job_id, dataset_key, staged_path, optimize, approx_profile)
+    return {"data_id": data_id, "job_id": job_id}
+
+def get_upload_job(job_id: str) -> Dict[str, Any]:
+    """
+    Retrieves the status of a background upload job.
+    Once the job is done, the dataset profile and ingestion stats are included.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise ValueError("Invalid job_id")
+    if job["status"] == "done":
+        dataset_key = job["dataset_key"]
+        df = session_cache.get_dataframe(dataset_key)
+        if df is not None:
+            job["profile"] = _profile_dataset(dataset_key, df)
+        job["memory"] = dataset_stats_cache.get(dataset_key) or session_store.load_json(dataset_key, "ingest") or {}
+    return job
+
+def _wait_for_parse(dataset_key: str):
+    """
+    Blocks until the dataset's upload job has parsed it, whichever worker runs the job.
+    """
+    parsed = _parsed_events.get(dataset_key)
+    if parsed is not None and not parsed.wait(PARSE_WAIT_SECONDS):
+        raise ValueError("Upload is still being parsed")
+    job_id = backend.get_dataset_job(dataset_key)
+    deadline = time.monotonic() + PARSE_WAIT_SECONDS
+    while job_id is not None:
+        job = jobs.get_job(job_id)
+        if job is None or job["status"] in jobs.PARSED_STATUSES:
+            return
+        if job["status"] == "failed":
+            raise ValueError(f"Upload failed: {job['error']}")
+        if time.monotonic() > deadline:
+            raise ValueError("Upload is still being parsed")
+        time.sleep(PARSE_POLL_SECONDS)
 
 def get_dataframe(data_id: str) -> pd.DataFrame:
     """
-    Retrieves a DataFrame from the cache.
+    Retrieves a DataFrame from the cache, reloading it from the session store
+    (e.g. after a restart or an eviction) when it is not resident.
+    The frame may be shared with other sessions and must be treated as read-only.
+    Waits for the upload to finish parsing if it is still in progress.
     """
-    if data_id not in data_cache:
+    dataset_key = _dataset_key(data_id)
+    _wait_for_parse(dataset_key)
+    df = session_cache.get_dataframe(dataset_key)
+    if df is None:
         raise ValueError("Invalid data_id")
-    return data_cache[data_id]
+    return df
+
+def _profile_dataset(dataset_key: str, df: pd.DataFrame, progress=None, timings=None) -> dict:
+    # A per-dataset lock makes concurrent callers wait for a profile already in progress
+    with _profile_locks[dataset_key]:
+        if dataset_key not in profile_cache:
+            profile = session_store.load_json(dataset_key, "profile")
+            if profile is None:
+                profile = get_profile(df, progress=progress, timings=timings)
+                session_store.save_json(dataset_key, "profile", profile)
+            profile_cache[dataset_key] = profile
+        return profile_cache[dataset_key]
+
+def get_dataset_profile(data_id: str) -> dict:
+    """
+    Retrieves the profile of a session's dataset, computing it once per dataset.
+    """
+    df = get_dataframe(data_id)
+    return _profile_dataset(_dataset_key(data_id), df)
+
+def get_dataset_version(data_id: str) -> str:
+    """
+    Returns the version of a session's data. It changes whenever the session's data changes.
+    """
+    return _dataset_key(data_id)
+
+def get_prompt_context(data_id: str) -> Dict[str, Any]:
+    """
+    Retrieves the dataset facts pasted into LLM prompts (column names and a token-budgeted
+    schema summary), the numeric columns and the schema fingerprint used in LLM cache keys,
+    computed once per dataset version.
+    """
+    dataset_key = _dataset_key(data_id)
+    context = prompt_context_cache.get(dataset_key)
+    if context is None:
+        df = get_dataframe(data_id)
+        if dataset_key not in example_cache:
+            example_cache[dataset_key] = session_store.load_json(dataset_key, "examples") or {}
+        schema = build_schema_summary(df, examples=example_cache[dataset_key])
+        context = {
+            "columns": df.columns.tolist(),
+            "numeric_columns": [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])],
+            "schema": schema,
+            "fingerprint": schema_fingerprint(df, schema),
+        }
+        prompt_context_cache[dataset_key] = context
+    return context
 
 def update_dataframe(data_id: str, df: pd.DataFrame):
     """
     Updates a DataFrame in the cache.
+    The session is re-pointed at a new dataset so sessions sharing the old one are unaffected.
     """
-    if data_id not in data_cache:
-        raise ValueError("Invalid data_id")
-    data_cache[data_id] = df
+    _dataset_key(data_id)
+    dataset_key = str(uuid.uuid4())
+    if session_store.save_dataframe(dataset_key, df):
+        df = session_store.load_dataframe(dataset_key)
+    session_cache.put_dataframe(dataset_key, df)
+    previous = backend.bind_session(data_id, dataset_key)
+    if previous is not None:
+        _release_dataset(previous)
+
+def _release_dataset(dataset_key: str):
+    """
+    Deletes a dataset no session is bound to any more: its stored frame and documents and the per-process memos.
+    """
+    with _ingest_lock:
+        # An upload of the same bytes may have bound a new session to it meanwhile
+        if backend.has_sessions(dataset_key):
+            return
+        session_cache.discard(dataset_key)
+        session_store.delete_dataframe(dataset_key)
+        for name in ("ingest", "profile", "examples"):
+            session_store.delete_json(dataset_key, name)
+        for memo in (dataset_stats_cache, profile_cache, prompt_context_cache, example_cache):
+            memo.pop(dataset_key, None)
+    logger.info(f"Deleted dataset {dataset_key}, no session is bound to it")
 
-def add_to_history(data_id: str, event: Dict[str, Any]):
+def add_to_history(data_id: str, event: Dict[str, Any]) -> int:
     """
-    Adds a new event to the session's history.
+    Adds a new event to the session's history and returns its position (the event id).
     """
-    if data_id not in history_cache:
-        history_cache[data_id] = []
-    history_cache[data_id].append(event)
+    return backend.append_history(data_id, event)
+
+def update_history_response(data_id: str, event_id: int, updates: Dict[str, Any]):
+    """
+    Merges updates (e.g. an insight computed in the background) into a logged event's response.
+    """
+    if not backend.update_history_response(data_id, event_id, updates):
+        raise ValueError(f"No history event {event_id} for data_id: {data_id}")
+
+def get_history_event(data_id: str, event_id: int) -> Dict[str, Any]:
+    event = backend.get_history_event(data_id, event_id)
+    if event is None:
+        raise ValueError(f"No history event {event_id} for data_id: {data_id}")
+    return event
 
 def get_history(data_id: str) -> List[Dict[str, Any]]:
     """
     Retrieves the history for a given session.
     """
-    return history_cache.get(data_id, [])
+    history = backend.get_history(data_id)
+    return history if history is not None else []
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Reports cache hit/miss/eviction counters, resident bytes per cache entry and
+    the dataset each session points at.
+    """
+    return {**session_cache.get_stats(), "session_datasets": backend.list_sessions()}
+
+def dataframe_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Converts a DataFrame to JSON-safe records (datetimes as ISO strings, NaN as null).
+    """
+    return json.loads(df.to_json(orient="records", date_format="iso"))
@@ -0,0 +1,178 @@
+import io
+import os
+import re
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+logger = logging.getLogger(__name__)
+
+# Number of CSV rows parsed per chunk during compact ingestion
+CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "200000"))
+# A string column is stored as 'category' when its distinct values are at most
+# this fraction of the rows in the sampled chunk
+CATEGORY_MAX_RATIO = float(os.getenv("CATEGORY_MAX_RATIO", "0.5"))
+# Narrowest integer type used when downcasting. Generated code does elementwise arithmetic
+# on these columns and numpy overflows silently, so int8/int16 are opt-in.
+INT_DOWNCAST_MIN = np.dtype(os.getenv("INT_DOWNCAST_MIN", "int32"))
+
+# Matched against the snake_cased column name, so only whole words count ('order_date', 'OrderDate',
+# 'created_at'), not substrings ('candidate', 'update_reason', 'runtime')
+DATE_NAME_PATTERN = re.compile(r"(^|_)(date|time|timestamp|datetime)s?(_|$)|._(at|on)$")
+ISO_DATE_PATTERN = re.compile(r"^\d{4}[-/]\d{1,2}[-/]\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def _is_text(series: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+
+def _snake_case(name: str) -> str:
+    return re.sub(r"[^0-9a-z]+", "_", re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", name).lower())
+
+
+def _looks_like_date(name: str, sample: pd.Series) -> bool:
+    """
+    A text column is a date candidate when its name says so or every sampled value is an ISO-like date.
+    """
+    values = sample.dropna().astype(str).head(100)
+    if values.empty:
+        return False
+    if DATE_NAME_PATTERN.search(_snake_case(str(name))):
+        return True
+    return bool(values.str.match(ISO_DATE_PATTERN).all())
+
+
+def infer_schema(sample: pd.DataFrame) -> Dict[str, str]:
+    """
+    Infers a compact storage kind for every text column of a sample chunk.
+    Returns a mapping of column -> 'datetime', 'category' or 'text'.
+    """
+    schema = {}
+    num_rows = len(sample)
+    for col in sample.columns:
+        series = sample[col]
+        if not _is_text(series):
+            continue
+        if _looks_like_date(col, series):
+            schema[col] = "datetime"
+        elif num_rows > 0 and series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * num_rows:
+            schema[col] = "category"
+        else:
+            schema[col] = "text"
+    return schema
+
+
+def _downcast_numeric(series: pd.Series) -> pd.Series:
+    """
+    Downcasts a numeric column to the smallest type that holds every value exactly.
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        downcast = pd.to_numeric(series, downcast="integer")
+        if downcast.dtype.itemsize < INT_DOWNCAST_MIN.itemsize and series.dtype.itemsize >= INT_DOWNCAST_MIN.itemsize:
+            return series.astype(INT_DOWNCAST_MIN)
+        return downcast
+    if pd.api.types.is_float_dtype(series):
+        # float32 only keeps ~7 significant digits, so only downcast when nothing is lost
+        as_float32 = series.astype(np.float32)
+        if np.array_equal(as_float32.to_numpy(dtype=np.float64), series.to_numpy(dtype=np.float64), equal_nan=True):
+            return as_float32
+    return series
+
+
+def _compact_chunk(chunk: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    for col in chunk.columns:
+        kind = schema.get(col)
+        if kind in ("category", "datetime"):
+            # Date candidates are kept as categories until the end so only their distinct values get parsed
+            chunk[col] = chunk[col].astype(object).astype("category")
+        elif kind is None:
+            chunk[col] = _downcast_numeric(chunk[col])
+    return chunk
+
+
+def _parse_dates(series: pd.Series) -> pd.Series:
+    """
+    Parses a categorical column of date strings by parsing its categories only.
+    Falls back to the original column when the values are not dates.
+    """
+    try:
+        categories = pd.to_datetime(series.cat.categories.astype(str))
+    except (ValueError, TypeError, OverflowError):
+        return series
+    codes = series.cat.codes.to_numpy()
+    parsed = pd.Series(categories.take(np.clip(codes, 0, None)), index=series.index, name=series.name)
+    return parsed.where(codes >= 0)
+
+
+def _concat_chunks(chunks: List[pd.DataFrame], schema: Dict[str, str]) -> pd.DataFrame:
+    columns = {}
+    for col in list(chunks[0].columns):
+        # Pop the column out of every chunk so the chunk copies are released as we go
+        parts = [chunk.pop(col) for chunk in chunks]
+        if schema.get(col) in ("category", "datetime"):
+            # Sorted and ordered like the categories of a single-chunk parse would be, so sorting,
+            # groupby order and min()/max() behave as they do on the string column
+            series = pd.Series(union_categoricals(parts, sort_categories=True), name=col).cat.as_ordered()
+            if schema[col] == "datetime":
+                series = _parse_dates(series)
+        else:
+            series = pd.concat(parts, ignore_index=True)
+            if schema.get(col) is None:
+                # Chunks may have been downcast to different widths; settle on the narrowest common type
+                series = _downcast_numeric(series)
+        columns[col] = series
+    return pd.DataFrame(columns)
+
+
+def read_csv_compact(file, chunk_rows: int = CHUNK_ROWS, progress: Optional[Callable[[int], None]] = None,
+                     on_chunk: Optional[Callable[[pd.DataFrame], None]] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Reads a CSV in chunks into a memory-lean DataFrame.
+    Low-cardinality strings become 'category', numbers are downcast to the smallest exact type
+    and date-like columns are parsed to datetime. Returns the frame and ingestion stats.
+    progress, if given, is called with the number of rows parsed so far after every chunk.
+    on_chunk, if given, is called with every compacted chunk (e.g. to feed streaming sketches).
+    """
+    if not (hasattr(file, "seekable") and file.seekable()):
+        file = io.BytesIO(file.read())
+    start = file.tell()
+
+    # Sniff the schema from the first chunk, then read the whole file with string columns pinned
+    # so that every chunk agrees on which columns are text.
+    sample = pd.read_csv(file, nrows=chunk_rows)
+    schema = infer_schema(sample)
+    file.seek(start)
+    if sample.empty:
+        return sample, {"rows": 0, "columns": len(sample.columns), "original_bytes": 0, "optimized_bytes": 0, "bytes_saved": 0, "schema": {}}
+    del sample
+
+    original_bytes = 0
+    rows_parsed = 0
+    chunks = []
+    reader = pd.read_csv(file, chunksize=chunk_rows, dtype={col: object for col in schema})
+    for chunk in reader:
+        original_bytes += int(chunk.memory_usage(deep=True).sum())
+        rows_parsed += len(chunk)
+        chunks.append(_compact_chunk(chunk, schema))
+        if on_chunk:
+            on_chunk(chunks[-1])
+        if progress:
+            progress(rows_parsed)
+
+    df = _concat_chunks(chunks, schema)
+    optimized_bytes = int(df.memory_usage(deep=True).sum())
+    stats = {
+        "rows": len(df),
+        "columns": len(df.columns),
+        "original_bytes": original_bytes,
+        "optimized_bytes": optimized_bytes,
+        "bytes_saved": original_bytes - optimized_bytes,
+        "schema": {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }
+    logger.info(f"Compact ingestion: {stats['rows']} rows, {original_bytes / 1024**2:.2f} MB -> {optimized_bytes / 1024**2:.2f} MB")
+    return df, stats
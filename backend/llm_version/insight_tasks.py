@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .data_tools import update_history_response, get_history_event
+
+logger = logging.getLogger(__name__)
+
+# Proactive insights are generated after the query response has been returned and are
+# attached to the history event when ready. An event's 'insight_status' is 'pending'
+# until then, and 'ready' or 'failed' afterwards.
+INSIGHT_PENDING, INSIGHT_READY, INSIGHT_FAILED = "pending", "ready", "failed"
+# Give up on an insight the model has not produced within this many seconds
+INSIGHT_TIMEOUT_SECONDS = float(os.getenv("INSIGHT_TIMEOUT_SECONDS", "60"))
+# Polling interval when the insight is being generated by another worker
+INSIGHT_POLL_SECONDS = 0.2
+
+# Insight tasks running in this process, by (data_id, event_id)
+_tasks: Dict[Tuple[str, int], "asyncio.Task[Dict[str, Any]]"] = {}
+
+
+async def _generate_and_attach(data_id: str, event_id: int, generate: Callable[[], Awaitable[Optional[dict]]]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        insight = await asyncio.wait_for(generate(), INSIGHT_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.error(f"Insight generation failed for {data_id}/{event_id}: {e!r}")
+        insight = None
+    update = {"insight": insight, "insight_status": INSIGHT_READY if insight else INSIGHT_FAILED}
+    await asyncio.to_thread(update_history_response, data_id, event_id, update)
+    logger.info(f"Insight for {data_id}/{event_id} {update['insight_status']} after {time.perf_counter() - started:.2f}s")
+    return update
+
+
+def schedule_insight(data_id: str, event_id: int, generate: Callable[[], Awaitable[Optional[dict]]]) -> "asyncio.Task[Dict[str, Any]]":
+    """
+    Runs generate() in the background and stores its insight in the history event.
+    The event should have been logged with insight_status 'pending'.
+    """
+    key = (data_id, event_id)
+    task = asyncio.create_task(_generate_and_attach(data_id, event_id, generate))
+    _tasks[key] = task
+    task.add_done_callback(lambda _: _tasks.pop(key, None))
+    return task
+
+
+async def wait_for_insight(data_id: str, event_id: int, timeout: float = 0) -> Dict[str, Any]:
+    """
+    Returns the insight state of a history event ({'insight_status', 'insight'}), waiting up to
+    timeout seconds for a pending insight. Insights generated by another worker are polled from
+    the session backend. Raises ValueError for an unknown event.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        task = _tasks.get((data_id, event_id))
+        if task is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                return {"insight_status": INSIGHT_PENDING, "insight": None}
+        response = (await asyncio.to_thread(get_history_event, data_id, event_id))["response"]
+        status = response.get("insight_status")
+        # Events without a status never had an insight scheduled (e.g. suggestions)
+        if status != INSIGHT_PENDING or time.monotonic() >= deadline:
+            return {"insight_status": status, "insight": response.get("insight")}
+        await asyncio.sleep(INSIGHT_POLL_SECONDS)
@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from . import session_store
+
+logger = logging.getLogger(__name__)
+
+# Responses of the LLM are cached on disk so repeated questions against the same schema
+# skip the model. The database sits next to the session store and is shared by all workers.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(session_store.STORE_DIR, "llm_cache.db"))
+# Budget for the stored response text, in bytes; least recently used entries go first
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024**2)))
+# Responses older than this are not served (0 disables the TTL)
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical form of a user query for cache keys: case, spacing and trailing punctuation are ignored.
+    """
+    return _WHITESPACE.sub(" ", query).strip().rstrip("?.!").strip().lower()
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class LLMResponseCache:
+    """
+    SQLite cache of LLM response texts keyed by node name, normalized query, the fingerprint
+    of the schema the prompt describes and the history window the prompt includes.
+    Entries expire after ttl_seconds and the least recently used are evicted beyond max_bytes.
+    Hit/miss/bypass counters are kept per node for this process.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, node TEXT NOT NULL, response TEXT NOT NULL,
+                                          bytes INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 ttl_seconds: float = LLM_CACHE_TTL_SECONDS, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.node_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "bypasses": 0})
+        self.counters = {"evictions": 0, "expirations": 0, "invalidations": 0}
+        if enabled:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with self._conn() as conn:
+                conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, node: str, counter: str):
+        with self._lock:
+            self.node_counters[node][counter] += 1
+
+    @staticmethod
+    def make_key(node: str, query: str, schema_fingerprint: str = "", history: Any = "") -> str:
+        parts = [node, normalize_query(query), schema_fingerprint, history]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.counters["expirations"] += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, node: str, response: str):
+        now = time.time()
+        size = len(response.encode())
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, node, response, size, now, now))
+            self._enforce_budget(conn)
+
+    def _enforce_budget(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, bytes FROM responses ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.counters["evictions"] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def invalidate(self, key: Optional[str]):
+        """
+        Drops a cached response, e.g. one whose output could not be parsed or executed,
+        so that a retry asks the model again.
+        """
+        if not self.enabled or key is None:
+            return
+        with self._conn() as conn:
+            if conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount:
+                self.counters["invalidations"] += 1
+
+    async def acached(self, node: str, key: str, call: Callable[[], Awaitable[str]], bypass: bool = False) -> str:
+        """
+        Returns the cached response for key, or the response of awaiting call() after storing it.
+        With bypass, the cache is not read but the fresh response still replaces the stored one.
+        The SQLite lookups run in a thread.
+        """
+        if not self.enabled:
+            return await call()
+        if bypass:
+            self._count(node, "bypasses")
+        else:
+            response = await asyncio.to_thread(self.get, key)
+            if response is not None:
+                self._count(node, "hits")
+                return response
+            self._count(node, "misses")
+        response = await call()
+        await asyncio.to_thread(self.put, key, node, response)
+        return response
+
+    async def ainvalidate(self, key: Optional[str]):
+        await asyncio.to_thread(self.invalidate, key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Reports per-node hit rates of this process and the size of the shared cache.
+        """
+        stats: Dict[str, Any] = {"enabled": self.enabled, **self.counters, "nodes": {}}
+        with self._lock:
+            for node, counts in self.node_counters.items():
+                lookups = counts["hits"] + counts["misses"]
+                stats["nodes"][node] = {**counts, "hit_rate": round(counts["hits"] / lookups, 4) if lookups else None}
+        if self.enabled:
+            entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+            stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes, ttl_seconds=self.ttl_seconds)
+        return stats
+
+
+response_cache = LLMResponseCache()
@@ -1,33 +1,37 @@
-import os
+import asyncio
 import pandas as pd
-import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import re
 import logging
+from .data_tools import get_prompt_context, get_dataset_version
+from .prompt_context import build_schema_summary, schema_fingerprint
+from .llm_cache import response_cache, fingerprint
+from .code_runner import run_code
+from .sql_engine import get_engine, precheck_sql
+from .code_checks import MAX_CODE_RETRIES, precheck_code, describe_failure, failure_kind, repair_instructions, retry_stats
+from .plan_cache import plan_cache
+from .conversation_memory import ConversationMemory, get_memory, format_memory
+from .llm_provider import create_provider, GenAIGeminiProvider
 
 # Setup logging
 logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configure the generative AI model
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-pro')
+# Gemini by default; LLM_PROVIDER selects a recorded, replayed or scripted model instead (see llm_provider.py)
+llm = create_provider(lambda: GenAIGeminiProvider('gemini-2.5-pro'))
 
-def generate_chat_summary(history: list) -> str:
+async def _generate(prompt: str) -> str:
+    return await llm.agenerate(prompt)
+
+async def generate_chat_summary(memory: ConversationMemory) -> str:
     """
-    Generates a summary of the chat history.
+    Generates a summary of the chat history from the session's memory (the running summary
+    and the recent turns), so the prompt does not grow with the length of the session.
     """
     logger.info("Generating chat summary...")
-    
-    # Create a simplified history for the prompt
-    simplified_history = []
-    for event in history:
-        simplified_history.append(f"User: {event['query']}")
-        simplified_history.append(f"Assistant: {event['response'].get('explanation', '')}")
-    
-    conversation = "\n".join(simplified_history)
+    conversation = format_memory(memory)
 
     prompt = f"""
     You are a helpful assistant. A user has had a conversation with a data analyst bot. 
@@ -39,13 +43,13 @@ def generate_chat_summary(history: list) -> str:
     Please provide a summary of the key findings and the flow of the analysis.
     """
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        cache_key = response_cache.make_key("chat_summary", "", history=conversation)
+        return await response_cache.acached("chat_summary", cache_key, lambda: _generate(prompt))
     except Exception as e:
         logger.error(f"Error generating chat summary: {e}", exc_info=True)
         return "Could not generate summary."
 
-def generate_insights(query: str, result_df: pd.DataFrame) -> dict:
+async def generate_insights(query: str, result_df: pd.DataFrame, bypass_cache: bool = False) -> dict:
     """
     Analyzes the result of a query and generates a proactive insight.
     """
@@ -71,10 +75,11 @@ def generate_insights(query: str, result_df: pd.DataFrame) -> dict:
         "follow_up_query": "Show a breakdown of product categories for the North region"
     }}
     """
+    # The insight depends on the result rows rather than the dataset schema
+    cache_key = response_cache.make_key("generate_insights", query, fingerprint(result_head))
     try:
         logger.info("Sending insight prompt to LLM...")
-        response = model.generate_content(prompt)
-        raw_response_text = response.text
+        raw_response_text = await response_cache.acached("generate_insights", cache_key, lambda: _generate(prompt), bypass=bypass_cache)
         logger.info(f"Raw insight response from LLM:\n{raw_response_text}")
 
         json_match = re.search(r'```json\n(.*?)\n```', raw_response_text, re.DOTALL)
@@ -89,34 +94,72 @@ def generate_insights(query: str, result_df: pd.DataFrame) -> dict:
         if "insight" in insight_dict and "follow_up_query" in insight_dict:
             return insight_dict
         else:
+            await response_cache.ainvalidate(cache_key)
             return None
 
     except Exception as e:
         logger.error(f"Error generating insight: {e}", exc_info=True)
+        await response_cache.ainvalidate(cache_key)
         return None
 
-def process_query_with_llm(query: str, df: pd.DataFrame, history: list = []) -> dict:
+async def process_query_with_llm(query: str, df: pd.DataFrame, history: list = [], data_id: str = None, bypass_cache: bool = False) -> dict:
     """
     Processes the user query by generating and executing pandas code using an LLM.
+    When data_id is given, the dataset context for the prompt comes from its per-version cache.
+    LLM responses are served from the response cache unless bypass_cache is set.
+    The model is called asynchronously and the generated code runs on the execution pool.
+    The proactive insight is not generated here; callers run generate_insights in the background.
+    A cached plan for the query's shape (see plan_cache.py) is bound and run without calling the LLM.
+    Generated code is pre-checked before it runs; code that fails is sent back to the LLM with its
+    error up to MAX_CODE_RETRIES times, and the response reports the number of 'retries'.
+    Sessions using the 'sql' engine get a DuckDB query instead of pandas code (see sql_engine.py),
+    with the same response.
     """
     logger.info(f"Processing query: '{query}' with history of length {len(history)}")
-    df_head = df.head().to_string()
-    column_names = df.columns.tolist()
-
-    # Construct conversation history for the prompt
-    conversation_history = []
-    for event in history:
-        conversation_history.append(f"User: {event['query']}")
-        # Add assistant's response if it exists and has an explanation
-        if 'response' in event and event['response'].get('explanation'):
-            conversation_history.append(f"Assistant: {event['response']['explanation']}")
-    conversation_history_str = "\n".join(conversation_history)
+    # With the session's dataset version, the execution worker maps the stored dataset instead of receiving df
+    dataset_key = None
+    engine = await asyncio.to_thread(get_engine, data_id)
+    if data_id is not None:
+        context = await asyncio.to_thread(get_prompt_context, data_id)
+        schema, column_names, schema_key = context["schema"], context["columns"], context["fingerprint"]
+        dataset_key = await asyncio.to_thread(get_dataset_version, data_id)
+    else:
+        schema = build_schema_summary(df)
+        column_names = df.columns.tolist()
+        schema_key = schema_fingerprint(df, schema)
+
+    if not bypass_cache and engine == "pandas":
+        plan = await asyncio.to_thread(plan_cache.lookup, query, df, schema_key)
+        if plan is not None:
+            try:
+                precheck_code(plan["code"], df.columns)
+                result_df = await run_code(plan["code"], df, dataset_key)
+                logger.info(f"Answered from cached plan:\n{plan['code']}")
+                return {"type": "code", "dataframe": result_df, "explanation": plan["explanation"], "charts": plan["charts"], "insight": None}
+            except Exception as e:
+                logger.info(f"Cached plan failed, asking the LLM: {e}")
+                await asyncio.to_thread(plan_cache.invalidate, plan["key"])
+
+    # The running summary of older turns plus the recent turns, not the whole history (see conversation_memory.py)
+    conversation_history_str = format_memory(await asyncio.to_thread(get_memory, data_id, history))
+
+    if engine == "sql":
+        expert = "a DuckDB SQL expert"
+        dtypes = "Write DuckDB SQL over the table 'df'. Quote column names with double quotes and text values with single quotes. Date columns are timestamps, so use date_trunc, year() and month() on them."
+        task = "Write a single DuckDB SQL SELECT query over the table 'df' that answers the query. The rows it returns become 'result_df'; give computed columns clear aliases."
+        example = "SELECT region, SUM(net_revenue) AS net_revenue FROM df GROUP BY region"
+    else:
+        expert = "a Python pandas expert"
+        dtypes = "Text columns with few distinct values are stored with the 'category' dtype, so always pass observed=True to groupby. Date columns are already parsed as datetime, so use the .dt accessor on them."
+        task = "Generate pandas code to transform the dataframe. The final result MUST be assigned to a variable named 'result_df'."
+        example = "result_df = df.groupby('region')['net_revenue'].sum().reset_index()"
 
     prompt = f"""
-    You are a Python pandas expert and a helpful data analyst. A user has provided a dataframe named 'df' and a query in natural language.
+    You are {expert} and a helpful data analyst. A user has provided a dataframe named 'df' and a query in natural language.
     The dataframe has the following columns: {column_names}
-    The first 5 rows of the dataframe are:
-    {df_head}
+    {dtypes}
+    Here is a summary of the dataframe's columns (dtype, nulls, example values or range):
+    {schema}
 
     Here is the conversation history so far:
     {conversation_history_str}
@@ -126,7 +169,7 @@ def process_query_with_llm(query: str, df: pd.DataFrame, history: list = []) ->
     Your task is to first determine if the query is ambiguous, considering the conversation history.
     
     1.  **If the query is clear and actionable:**
-        - Generate pandas code to transform the dataframe. The final result MUST be assigned to a variable named 'result_df'.
+        - {task}
         - After the main transformation, analyze the 'result_df' and generate a list of all suitable chart specifications in a 'charts' array. 
         - Provide a detailed but easy-to-understand explanation for a non-technical user.
         - Return a single, valid JSON object.
@@ -149,7 +192,7 @@ def process_query_with_llm(query: str, df: pd.DataFrame, history: list = []) ->
     **Example of a response with multiple charts (JSON):**
     {{
         "type": "code",
-        "code": "result_df = df.groupby('region')['net_revenue'].sum().reset_index()",
+        "code": "{example}",
         "explanation": "I have calculated the total net revenue for each region.",
         "charts": [
             {{
@@ -175,55 +218,77 @@ def process_query_with_llm(query: str, df: pd.DataFrame, history: list = []) ->
     }}
     """
 
-    try:
-        logger.info("Sending prompt to LLM...")
-        response = model.generate_content(prompt)
-        raw_response_text = response.text
-        logger.info(f"Raw response from LLM:\n{raw_response_text}")
-        
-        json_match = re.search(r'```json\n(.*?)\n```', raw_response_text, re.DOTALL)
-        if not json_match:
-            json_str = raw_response_text
-        else:
-            json_str = json_match.group(1)
-        
-        logger.info(f"Cleaned JSON string:\n{json_str}")
-        response_dict = json.loads(json_str)
-        logger.info(f"Parsed response dictionary: {response_dict}")
-
-        response_type = response_dict.get("type")
-
-        if response_type == 'code':
-            code_to_execute = response_dict.get("code")
-            explanation = response_dict.get("explanation", "No explanation provided.")
-            charts_spec = response_dict.get("charts")
-            logger.info(f"Code to execute:\n{code_to_execute}")
-
-            if not code_to_execute:
-                raise ValueError("LLM did not return any code to execute.")
-
-            local_scope = {'df': df.copy(), 'pd': pd}
-            exec(code_to_execute, {}, local_scope)
-            
-            result_df = local_scope.get('result_df')
-            if result_df is None:
-                raise ValueError("Code did not produce a 'result_df' dataframe.")
-            
-            logger.info("Code executed successfully. Resulting dataframe preview:\n" + result_df.head().to_string())
-            
-            # Generate proactive insight
-            insight = generate_insights(query, result_df)
-
-            return {"type": "code", "dataframe": result_df, "explanation": explanation, "charts": charts_spec, "insight": insight}
-        
-        elif response_type == 'suggestions':
-            suggestions = response_dict.get("suggestions")
-            logger.info(f"Returning suggestions: {suggestions}")
-            return {"type": "suggestions", "suggestions": suggestions}
-        
-        else:
-            raise ValueError(f"LLM returned an invalid response type: {response_type}")
+    code_to_execute = error = None
+    for attempt in range(MAX_CODE_RETRIES + 1):
+        # A retry shows the model its failed code and the error
+        repair = repair_instructions(code_to_execute, error, "sql" if engine == "sql" else "python") if error else ""
+        # SQL sessions get SQL for the same query, so their responses are cached apart
+        node = "process_query" if engine == "pandas" else "process_query_sql"
+        cache_key = response_cache.make_key(node, query, schema_key, conversation_history_str + repair)
+        stage = "llm"
+        try:
+            logger.info("Sending prompt to LLM..." if not repair else f"Sending repair prompt to LLM (retry {attempt})...")
+            raw_response_text = await response_cache.acached(node, cache_key, lambda: _generate(prompt + repair), bypass=bypass_cache)
+            logger.info(f"Raw response from LLM:\n{raw_response_text}")
+            stage = "response"
 
-    except Exception as e:
-        logger.info(f"Error in llm_handler: {e}", exc_info=True)
-        return {"type": "error", "explanation": f"An error occurred in the LLM handler: {e}"}
\ No newline at end of file
+            json_match = re.search(r'```json\n(.*?)\n```', raw_response_text, re.DOTALL)
+            if not json_match:
+                json_str = raw_response_text
+            else:
+                json_str = json_match.group(1)
+
+            logger.info(f"Cleaned JSON string:\n{json_str}")
+            response_dict = json.loads(json_str)
+            logger.info(f"Parsed response dictionary: {response_dict}")
+
+            response_type = response_dict.get("type")
+
+            if response_type == 'code':
+                code_to_execute = response_dict.get("code")
+                explanation = response_dict.get("explanation", "No explanation provided.")
+                charts_spec = response_dict.get("charts")
+                logger.info(f"Code to execute:\n{code_to_execute}")
+
+                if not code_to_execute:
+                    raise ValueError("LLM did not return any code to execute.")
+
+                stage = "code"
+                if engine == "sql":
+                    precheck_sql(code_to_execute)
+                else:
+                    precheck_code(code_to_execute, df.columns)
+                result_df = await run_code(code_to_execute, df, dataset_key, engine)
+
+                logger.info("Code executed successfully. Resulting dataframe preview:\n" + result_df.head().to_string())
+                if engine == "pandas":
+                    await asyncio.to_thread(plan_cache.store, query, df, schema_key, code_to_execute, explanation, charts_spec)
+                retry_stats.record(attempt, succeeded=True)
+
+                return {"type": "code", "dataframe": result_df, "explanation": explanation, "charts": charts_spec, "insight": None,
+                        "retries": attempt}
+
+            elif response_type == 'suggestions':
+                suggestions = response_dict.get("suggestions")
+                logger.info(f"Returning suggestions: {suggestions}")
+                return {"type": "suggestions", "suggestions": suggestions}
+
+            else:
+                raise ValueError(f"LLM returned an invalid response type: {response_type}")
+
+        except Exception as e:
+            logger.info(f"Error in llm_handler: {e}", exc_info=True)
+            # Don't serve a response that failed to parse or execute again
+            await response_cache.ainvalidate(cache_key)
+            if stage == "llm":
+                # The model could not be reached; there is nothing to repair
+                return {"type": "error", "explanation": f"An error occurred in the LLM handler: {e}"}
+            if stage == "code":
+                retry_stats.failure(failure_kind(e))
+                error = describe_failure(e, code_to_execute)
+            else:
+                retry_stats.failure("invalid_response")
+                code_to_execute, error = None, f"Invalid response from LLM: {e}"
+
+    retry_stats.record(MAX_CODE_RETRIES, succeeded=False)
+    return {"type": "error", "explanation": f"An error occurred in the LLM handler: {error}", "retries": MAX_CODE_RETRIES}
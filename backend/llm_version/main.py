@@ -1,27 +1,50 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from typing import Optional
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from .data_tools import (
-    load_csv_from_upload, 
+    stage_upload,
+    get_upload_job,
     get_dataframe, 
     update_dataframe,
     add_to_history,
-    get_history
+    get_history,
+    get_cache_stats,
+    get_dataset_profile,
+    get_dataset_version,
+    dataframe_to_records
 )
 from . import llm_handler
-from .profiler import get_profile, get_profile_as_dict
+from .llm_cache import response_cache
+from .plan_cache import plan_cache
+from .result_cache import result_cache
+from .code_checks import retry_stats
+from .code_runner import start_exec_workers, get_exec_stats
+from .sql_engine import available_engines, get_engine, set_engine
+from .conversation_memory import update_memory, schedule_memory_update
+from .insight_tasks import schedule_insight, wait_for_insight, INSIGHT_PENDING
 from .markdown_generator import create_chat_summary_markdown
 import logging
 import pandas as pd
 import io
+import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Longest wait allowed for /insight (and the insight event of the stream)
+INSIGHT_WAIT_SECONDS = 60.0
+
 app = FastAPI()
 
+@app.on_event("startup")
+def warm_exec_workers():
+    # Execution workers import pandas on start, so they are started before the first query
+    start_exec_workers()
+
 # CORS middleware to allow frontend to communicate with backend
 app.add_middleware(
     CORSMiddleware,
@@ -34,59 +57,102 @@ app.add_middleware(
 class QueryRequest(BaseModel):
     query: str
     data_id: str
+    # Skip cached LLM responses for this request (fresh responses still refresh the cache)
+    bypass_cache: bool = False
 
 class HistoryRequest(BaseModel):
     data_id: str
 
+class EngineRequest(BaseModel):
+    data_id: str
+    # 'pandas' (the model writes pandas code) or 'sql' (it writes DuckDB SQL)
+    engine: str
+
 @app.get("/")
 def read_root():
     return {"message": "Finkraft Data Explorer Backend is running."}
 
 @app.post("/upload")
-def upload_csv(file: UploadFile = File(...)):
+def upload_csv(file: UploadFile = File(...), approx_profile: Optional[bool] = None, engine: Optional[str] = None):
     logger.info("Upload endpoint called.")
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV.")
+    if engine is not None and engine not in available_engines():
+        raise HTTPException(status_code=400, detail=f"Invalid engine. Available engines: {', '.join(available_engines())}")
     try:
-        data_id = load_csv_from_upload(file.file)
-        df = get_dataframe(data_id)
-        profile = get_profile(df)
-        logger.info(f"File uploaded and profiled successfully. Data ID: {data_id}")
-        return {
-            "data_id": data_id, 
-            "columns": df.columns.tolist(), 
-            "rows": df.head().to_dict(orient='records'),
-            "profile": profile
-        }
+        # Parsing and profiling run in the background; poll /jobs/{job_id} for progress.
+        # approx_profile=true sketches the profile during parsing (for very large uploads).
+        upload = stage_upload(file.file, approx_profile=approx_profile)
+        if engine is not None:
+            set_engine(upload["data_id"], engine)
+        logger.info(f"File stored, parsing in background. Data ID: {upload['data_id']}, Job ID: {upload['job_id']}")
+        return {**upload, "engine": get_engine(upload["data_id"]), "status": get_upload_job(upload["job_id"])["status"]}
     except Exception as e:
         logger.error(f"Error processing file: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing file: {e}")
 
-@app.post("/process_query")
-def process_query(request: QueryRequest):
-    logger.info(f"Query endpoint called with data_id: {request.data_id} and query: '{request.query}'")
+@app.post("/engine")
+def select_engine(request: EngineRequest):
+    """
+    Selects the session's query engine for its next queries: 'pandas' or 'sql' (DuckDB).
+    """
     try:
-        df = get_dataframe(request.data_id)
-        history = get_history(request.data_id)
-        response = llm_handler.process_query_with_llm(request.query, df, history)
-        logger.info(f"Response from LLM handler: {response}")
+        get_dataset_version(request.data_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        set_engine(request.data_id, request.engine)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data_id": request.data_id, "engine": request.engine}
 
-        response_type = response.get("type")
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    try:
+        return get_upload_job(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+async def _record_response(request: QueryRequest, response: dict) -> dict:
+    """
+    Stores a code result as the session's new dataframe, converts it for JSON and logs the response to history.
+    The session's running summary is updated in the background with the new turn.
+    For a code result, the insight is scheduled in the background and the response carries
+    'insight_status' 'pending' and the 'event_id' to poll (/insight/{data_id}/{event_id}).
+    """
+    response_type = response.get("type")
+    result_df = None
+
+    if response_type == "code" and isinstance(response["dataframe"], pd.DataFrame):
+        new_df = result_df = response["dataframe"]
+        response["insight_status"] = INSIGHT_PENDING
+        logger.info("Updating dataframe in cache.")
+        await run_in_threadpool(update_dataframe, request.data_id, new_df)
         
-        # Log the event to history
-        history_event = {"query": request.query, "response": response}
-        add_to_history(request.data_id, history_event)
+        # The dataframe in the response should be converted to JSON for the frontend
+        response["dataframe"] = await run_in_threadpool(dataframe_to_records, new_df)
+        response["columns"] = new_df.columns.tolist()
 
-        if response_type == "code":
-            new_df = response["dataframe"]
-            logger.info("Updating dataframe in cache.")
-            update_dataframe(request.data_id, new_df)
-            
-            # The dataframe in the response should be converted to JSON for the frontend
-            response["dataframe"] = new_df.to_dict(orient='records')
-            response["columns"] = new_df.columns.tolist()
+    # Log the event to history (after conversion, so the cache can size it)
+    history_event = {"query": request.query, "response": dict(response)}
+    response["event_id"] = await run_in_threadpool(add_to_history, request.data_id, history_event)
+    schedule_memory_update(request.data_id, llm_handler.llm.agenerate)
+    if result_df is not None:
+        schedule_insight(request.data_id, response["event_id"],
+                         lambda: llm_handler.generate_insights(request.query, result_df, bypass_cache=request.bypass_cache))
+    return response
 
-        return response
+@app.post("/process_query")
+async def process_query(request: QueryRequest):
+    logger.info(f"Query endpoint called with data_id: {request.data_id} and query: '{request.query}'")
+    try:
+        # Store and cache access may block (e.g. while an upload is parsed), so it runs off the event loop
+        df = await run_in_threadpool(get_dataframe, request.data_id)
+        history = await run_in_threadpool(get_history, request.data_id)
+        response = await llm_handler.process_query_with_llm(request.query, df, history, data_id=request.data_id, bypass_cache=request.bypass_cache)
+        logger.info(f"Response from LLM handler: {response}")
+
+        return await _record_response(request, response)
 
     except ValueError as e:
         logger.error(f"ValueError in process_query: {e}", exc_info=True)
@@ -95,6 +161,58 @@ def process_query(request: QueryRequest):
         logger.error(f"Exception in process_query: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing query: {e}")
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/process_query/stream")
+async def process_query_stream(request: QueryRequest):
+    """
+    Streaming variant of /process_query. Emits a server-sent event as soon as each part is ready:
+    'result' (explanation, charts and the result table), 'suggestions' or 'error' from the LLM,
+    then 'done' with the final response (without the table) once it is in the history, and
+    finally 'insight' when the background insight completes. A failure while streaming is
+    reported as an 'error' event with a 'detail'.
+    """
+    logger.info(f"Streaming query endpoint called with data_id: {request.data_id} and query: '{request.query}'")
+    try:
+        df = await run_in_threadpool(get_dataframe, request.data_id)
+        history = await run_in_threadpool(get_history, request.data_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def events():
+        try:
+            response = await llm_handler.process_query_with_llm(request.query, df, history, data_id=request.data_id,
+                                                               bypass_cache=request.bypass_cache)
+            result_df = response.get("dataframe")
+            if response["type"] == "code":
+                records = await run_in_threadpool(dataframe_to_records, result_df)
+                yield _sse("result", {**response, "dataframe": records, "columns": result_df.columns.tolist()})
+            elif response["type"] == "suggestions":
+                yield _sse("suggestions", response)
+            else:
+                yield _sse("error", response)
+            response = await _record_response(request, response)
+            yield _sse("done", {k: v for k, v in response.items() if k != "dataframe"})
+            if response.get("insight_status") == INSIGHT_PENDING:
+                yield _sse("insight", await wait_for_insight(request.data_id, response["event_id"], timeout=INSIGHT_WAIT_SECONDS))
+        except Exception as e:
+            logger.error(f"Exception in process_query_stream: {e}", exc_info=True)
+            yield _sse("error", {"detail": f"Error processing query: {e}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/insight/{data_id}/{event_id}")
+async def get_insight(data_id: str, event_id: int, wait: float = 0):
+    """
+    Returns the proactive insight of a history event: {'insight_status', 'insight'}.
+    With wait > 0 a pending insight is waited for, up to that many seconds (long polling).
+    """
+    try:
+        return await wait_for_insight(data_id, event_id, timeout=min(wait, INSIGHT_WAIT_SECONDS))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @app.post("/history")
 def get_chat_history(request: HistoryRequest):
     logger.info(f"History endpoint called for data_id: {request.data_id}")
@@ -105,28 +223,45 @@ def get_chat_history(request: HistoryRequest):
             if 'response' in event and 'dataframe' in event['response']:
                 df = event['response']['dataframe']
                 if isinstance(df, pd.DataFrame):
-                    event['response']['dataframe'] = df.to_dict(orient='records')
+                    event['response']['dataframe'] = dataframe_to_records(df)
                     event['response']['columns'] = df.columns.tolist()
         return history
     except Exception as e:
         logger.error(f"Exception in get_history: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error retrieving history: {e}")
 
+@app.get("/cache/stats")
+def cache_stats():
+    return {**get_cache_stats(), "llm_responses": response_cache.get_stats(), "plans": plan_cache.get_stats(),
+            "results": result_cache.get_stats()}
+
+@app.get("/llm/stats")
+def llm_stats():
+    return llm_handler.llm.get_stats()
+
+@app.get("/exec/stats")
+def exec_stats():
+    return get_exec_stats()
+
+@app.get("/retry/stats")
+def code_retry_stats():
+    return retry_stats.get_stats()
+
 @app.get("/export/{data_id}/{format}")
-def export_data(data_id: str, format: str):
+async def export_data(data_id: str, format: str):
     logger.info(f"Export endpoint called for data_id: {data_id} with format: {format}")
     if format == "md":
-        history = get_history(data_id)
-        df = get_dataframe(data_id)
-        profile = get_profile_as_dict(df)
-        summary = llm_handler.generate_chat_summary(history)
+        history = await run_in_threadpool(get_history, data_id)
+        profile = await run_in_threadpool(get_dataset_profile, data_id)
+        # Brings the running summary up to date; the prompt then covers it and the recent turns only
+        summary = await llm_handler.generate_chat_summary(await update_memory(data_id, llm_handler.llm.agenerate, history))
         md_content = create_chat_summary_markdown(profile, summary, history, data_id)
         return StreamingResponse(io.StringIO(md_content), media_type="text/markdown", headers={"Content-Disposition": "attachment; filename=chat_summary.md"})
     
     elif format == "csv":
-        df = get_dataframe(data_id)
+        df = await run_in_threadpool(get_dataframe, data_id)
         csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
+        await run_in_threadpool(df.to_csv, csv_buffer, index=False)
         csv_buffer.seek(0)
         return StreamingResponse(csv_buffer, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=final_data.csv"})
 
@@ -0,0 +1,283 @@
+import os
+import re
+import ast
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from . import session_store
+from .llm_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Generated code that ran successfully is kept as a template with the query's literals (dataset
+# values such as 'North' and numbers such as a top-N or a year) lifted out. A later query that
+# differs only in those literals reuses the template with its own values and skips the LLM.
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE", "1") == "1"
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", os.path.join(session_store.STORE_DIR, "plan_cache.db"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "5000"))
+# Text columns with at most this many distinct values are scanned for literals in queries
+PLAN_MAX_DISTINCT_VALUES = 500
+# Value indexes kept per process (one per dataset schema)
+PLAN_VALUE_INDEXES = 32
+
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+# Queries that refer to an earlier answer depend on the conversation, which templates ignore
+_FOLLOW_UP = re.compile(r"\b(those|these|them|that|it|same|previous|above|again)\b", re.IGNORECASE)
+
+
+def _param_name(i: int) -> str:
+    return f"_param_{i}"
+
+
+def _marker(i: int) -> str:
+    return f"{{{{param_{i}}}}}"
+
+
+class _ValueIndex:
+    """
+    Regex over the distinct values of a dataset's low-cardinality text columns, mapping each
+    match to its column and canonical value. Values shared by several columns are left out.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        values: Dict[str, Tuple[str, str]] = {}
+        ambiguous = set()
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+                continue
+            distinct = series.dropna().unique()
+            if len(distinct) > PLAN_MAX_DISTINCT_VALUES:
+                continue
+            for value in distinct:
+                if not isinstance(value, str) or len(value) < 2:
+                    continue
+                key = value.lower()
+                if key in values and values[key][0] != column:
+                    ambiguous.add(key)
+                values[key] = (str(column), value)
+        self.values = {k: v for k, v in values.items() if k not in ambiguous}
+        # Longest first, so "Gamma Suite Pro" wins over "Gamma Suite"
+        alternatives = sorted(self.values, key=len, reverse=True)
+        self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(map(re.escape, alternatives)) + r")(?!\w)", re.IGNORECASE) if alternatives else None
+
+
+class PlanCache:
+    """
+    SQLite store of parameterized code templates keyed by the dataset's schema fingerprint and
+    the query with its literals replaced by typed slots ("net revenue for the <region> region").
+    Templates that fail on a new binding are dropped; the least recently used go beyond max_entries.
+    Lookup/store counters and per-template hits are reported by get_stats.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, query_template TEXT NOT NULL, plan TEXT NOT NULL,
+                                      hits INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, last_access REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS plans_last_access ON plans (last_access);
+    """
+
+    def __init__(self, path: str = PLAN_CACHE_PATH, max_entries: int = PLAN_CACHE_MAX_ENTRIES, enabled: bool = PLAN_CACHE_ENABLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, _ValueIndex]" = OrderedDict()
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0, "stores": 0,
+                         "unparameterizable": 0, "invalidations": 0, "evictions": 0}
+        if enabled:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with self._conn() as conn:
+                conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _value_index(self, schema_key: str, df: pd.DataFrame) -> _ValueIndex:
+        with self._lock:
+            index = self._indexes.get(schema_key)
+            if index is not None:
+                self._indexes.move_to_end(schema_key)
+                return index
+        index = _ValueIndex(df)
+        with self._lock:
+            self._indexes[schema_key] = index
+            while len(self._indexes) > PLAN_VALUE_INDEXES:
+                self._indexes.popitem(last=False)
+        return index
+
+    def parameterize_query(self, query: str, df: pd.DataFrame, schema_key: str) -> Tuple[str, List[Any]]:
+        """
+        Splits a query into its template ("top <num> products in <region>") and its literal values, in order.
+        """
+        index = self._value_index(schema_key, df)
+        spans = []
+        if index.pattern is not None:
+            for match in index.pattern.finditer(query):
+                column, value = index.values[match.group(0).lower()]
+                spans.append((match.start(), match.end(), f"<{column}>", value))
+        for match in _NUMBER.finditer(query):
+            if any(start <= match.start() < end for start, end, _, _ in spans):
+                continue
+            text = match.group(0)
+            spans.append((match.start(), match.end(), "<num>", float(text) if "." in text else int(text)))
+        spans.sort()
+        template, last = [], 0
+        for start, end, slot, _ in spans:
+            template.append(query[last:start])
+            template.append(slot)
+            last = end
+        template.append(query[last:])
+        return normalize_query("".join(template)), [value for _, _, _, value in spans]
+
+    @staticmethod
+    def make_key(schema_key: str, query_template: str) -> str:
+        return hashlib.sha256(json.dumps([schema_key, query_template]).encode()).hexdigest()
+
+    @staticmethod
+    def _lift(code: str, params: List[Any]) -> Optional[str]:
+        """
+        Replaces the code's constants equal to each parameter by a placeholder name.
+        Returns None when a parameter does not occur in the code, when two parameters are equal,
+        or when a number occurs more than once (a top-N 3 must not rebind an unrelated round(x, 3)).
+        """
+        if len(set(map(repr, params))) != len(params):
+            return None
+        tree = ast.parse(code)
+        # Constants inside f-strings cannot be replaced by names
+        in_fstrings = {id(node) for joined in ast.walk(tree) if isinstance(joined, ast.JoinedStr) for node in ast.walk(joined)}
+        names = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and id(node) not in in_fstrings and not isinstance(node.value, bool):
+                for i, value in enumerate(params):
+                    if type(node.value) is type(value) and node.value == value:
+                        names[id(node)] = _param_name(i)
+        for i, value in enumerate(params):
+            occurrences = list(names.values()).count(_param_name(i))
+            if occurrences == 0 or (occurrences > 1 and not isinstance(value, str)):
+                return None
+
+        class Lift(ast.NodeTransformer):
+            def visit_Constant(self, node):
+                return ast.Name(id=names[id(node)], ctx=ast.Load()) if id(node) in names else node
+
+        return ast.unparse(Lift().visit(tree))
+
+    @staticmethod
+    def _bind(code_template: str, params: List[Any]) -> str:
+        names = {_param_name(i): value for i, value in enumerate(params)}
+
+        class Bind(ast.NodeTransformer):
+            def visit_Name(self, node):
+                return ast.Constant(value=names[node.id]) if node.id in names else node
+
+        return ast.unparse(Bind().visit(ast.parse(code_template)))
+
+    def lookup(self, query: str, df: pd.DataFrame, schema_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns {'key', 'code', 'explanation', 'charts'} bound to the query's literals when a
+        template for the query's shape exists, else None.
+        """
+        if not self.enabled:
+            return None
+        self._count("lookups")
+        if _FOLLOW_UP.search(query):
+            self._count("skipped")
+            return None
+        query_template, params = self.parameterize_query(query, df, schema_key)
+        key = self.make_key(schema_key, query_template)
+        with self._conn() as conn:
+            row = conn.execute("SELECT plan FROM plans WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            conn.execute("UPDATE plans SET hits = hits + 1, last_access = ? WHERE key = ?", (time.time(), key))
+        plan = json.loads(row[0])
+        explanation = plan["explanation"]
+        for i, value in enumerate(params):
+            explanation = explanation.replace(_marker(i), str(value))
+        self._count("hits")
+        return {"key": key, "code": self._bind(plan["code"], params), "explanation": explanation, "charts": plan["charts"]}
+
+    def store(self, query: str, df: pd.DataFrame, schema_key: str, code: str, explanation: str, charts: Any) -> bool:
+        """
+        Stores validated code (it ran without error) as the template for the query's shape.
+        Returns False when the query's literals cannot be located in the code.
+        """
+        if not self.enabled or _FOLLOW_UP.search(query):
+            return False
+        query_template, params = self.parameterize_query(query, df, schema_key)
+        try:
+            code_template = self._lift(code, params)
+        except SyntaxError:
+            code_template = None
+        if code_template is None:
+            self._count("unparameterizable")
+            return False
+        explanation = explanation or ""
+        for i, value in enumerate(params):
+            explanation = re.sub(rf"(?<![\w.]){re.escape(str(value))}(?![\w.])", _marker(i), explanation)
+        plan = json.dumps({"code": code_template, "explanation": explanation, "charts": charts}, default=str)
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO plans VALUES (?, ?, ?, 0, ?, ?)",
+                         (self.make_key(schema_key, query_template), query_template, plan, now, now))
+            self._enforce_budget(conn)
+        self._count("stores")
+        return True
+
+    def _enforce_budget(self, conn: sqlite3.Connection):
+        excess = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute("DELETE FROM plans WHERE key IN (SELECT key FROM plans ORDER BY last_access LIMIT ?)", (excess,))
+            with self._lock:
+                self.counters["evictions"] += excess
+
+    def invalidate(self, key: Optional[str]):
+        """
+        Drops a template whose bound code failed, so the query goes back to the LLM.
+        """
+        if not self.enabled or key is None:
+            return
+        with self._conn() as conn:
+            if conn.execute("DELETE FROM plans WHERE key = ?", (key,)).rowcount:
+                self._count("invalidations")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Reports this process's hit rate and the most used templates of the shared store.
+        """
+        with self._lock:
+            stats: Dict[str, Any] = {"enabled": self.enabled, **self.counters}
+        decided = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / decided, 4) if decided else None
+        if self.enabled:
+            conn = self._conn()
+            stats["entries"] = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+            stats["top_templates"] = [
+                {"query_template": template, "hits": hits}
+                for template, hits in conn.execute("SELECT query_template, hits FROM plans ORDER BY hits DESC LIMIT 10")
+            ]
+        return stats
+
+
+plan_cache = PlanCache()
@@ -1,52 +1,141 @@
+import os
+import time
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional, Tuple
 
-def get_profile(df: pd.DataFrame) -> dict:
+# Columns are profiled in parallel on this many threads (1 profiles them sequentially)
+PROFILE_WORKERS = int(os.getenv("PROFILE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+def _is_numeric(series: pd.Series) -> bool:
+    # Same columns as select_dtypes(include=np.number): booleans are not summarised
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def _profile_column(series: pd.Series) -> dict:
+    """
+    Computes the null count, distinct count and (for numeric columns) summary statistics
+    of one column in a single visit, with the time spent on each.
+    """
+    timings = {}
+    start = time.perf_counter()
+    stats = {"dtype": str(series.dtype), "nulls": int(series.isna().sum())}
+    timings["nulls"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats["distinct"] = int(series.nunique(dropna=True))
+    timings["distinct"] = time.perf_counter() - start
+
+    if _is_numeric(series):
+        start = time.perf_counter()
+        stats["numeric"] = series.describe().round(2).to_dict()
+        timings["numeric_stats"] = time.perf_counter() - start
+    stats["timings"] = timings
+    return stats
+
+def _column_codes(series: pd.Series) -> Tuple[np.ndarray, int]:
+    # Dense codes in [0, size) that are equal exactly when the values are, with nulls as 0:
+    # category codes as-is, anything else factorized (C hashtable; -0.0 equals 0.0 as in duplicated())
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, size = series.cat.codes.to_numpy(dtype=np.int64), len(series.cat.categories)
+    else:
+        codes, uniques = pd.factorize(series)
+        size = len(uniques)
+    return codes.astype(np.int64, copy=False) + 1, size + 1
+
+def _count_duplicate_rows(df: pd.DataFrame) -> int:
+    """
+    Counts duplicate rows exactly, as df.duplicated().sum() does, by combining per-column codes
+    into one int64 key per row (mixed-radix), re-factorizing the keys whenever the next column
+    would overflow them.
+    """
+    if df.empty or len(df.columns) == 0:
+        return 0
+    keys, distinct = np.zeros(len(df), dtype=np.int64), 1
+    for i in range(len(df.columns)):
+        codes, size = _column_codes(df.iloc[:, i])
+        if distinct * size >= 2**63:
+            keys, uniques = pd.factorize(keys)
+            distinct = len(uniques)
+        keys = keys * size + codes
+        distinct *= size
+    return len(keys) - len(pd.unique(keys))
+
+def get_profile(df: pd.DataFrame, progress: Optional[Callable[[int], None]] = None, timings: Optional[Dict[str, float]] = None) -> dict:
     """
     Generates a comprehensive profile of a pandas DataFrame.
+    Every column is visited once (in parallel on PROFILE_WORKERS threads) to get its nulls,
+    distinct count and numeric statistics.
+    progress, if given, is called with the number of columns profiled so far.
+    timings, if given, is filled with the seconds spent in each stage.
     """
-    
+    timings = {} if timings is None else timings
+    total_start = time.perf_counter()
+
     # Basic info
     num_rows, num_cols = df.shape
-    total_missing = int(df.isnull().sum().sum())
-    
+
     # Column Details
+    start = time.perf_counter()
+    columns = list(df.columns)
+    column_stats = [None] * num_cols
+    if PROFILE_WORKERS > 1 and num_cols > 1:
+        with ThreadPoolExecutor(max_workers=PROFILE_WORKERS) as pool:
+            futures = {pool.submit(_profile_column, df.iloc[:, i]): i for i in range(num_cols)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                column_stats[futures[future]] = future.result()
+                if progress:
+                    progress(done)
+    else:
+        for i in range(num_cols):
+            column_stats[i] = _profile_column(df.iloc[:, i])
+            if progress:
+                progress(i + 1)
+    timings["columns"] = time.perf_counter() - start
+    # Per-stage times are summed over columns, so with several threads they can exceed "columns"
+    for stats in column_stats:
+        for stage, seconds in stats.pop("timings").items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
     column_details = []
-    for col in df.columns:
-        dtype = str(df[col].dtype)
-        missing_count = int(df[col].isnull().sum())
-        missing_percentage = round((missing_count / num_rows) * 100, 2) if num_rows > 0 else 0
-        unique_count = df[col].nunique()
-        
-        col_info = {
-            "Column": col,
-            "Non-Null Count": num_rows - missing_count,
-            "Null Count": missing_count,
-            "Data Type": dtype,
-        }
-        column_details.append(col_info)
-
-    # Numeric columns summary
-    numeric_df = df.select_dtypes(include=np.number)
     numeric_summary = {}
-    if not numeric_df.empty:
-        numeric_summary = numeric_df.describe().round(2).to_dict()
+    for col, stats in zip(columns, column_stats):
+        column_details.append({
+            "Column": col,
+            "Non-Null Count": num_rows - stats["nulls"],
+            "Null Count": stats["nulls"],
+            "Data Type": stats["dtype"],
+            "Distinct Count": stats["distinct"],
+        })
+        if "numeric" in stats:
+            numeric_summary[col] = stats["numeric"]
+
+    start = time.perf_counter()
+    duplicate_rows = _count_duplicate_rows(df)
+    timings["duplicates"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    memory_usage = df.memory_usage(deep=True).sum()
+    timings["memory"] = time.perf_counter() - start
 
     profile = {
         "dataset_summary": {
             "Number of Rows": num_rows,
             "Number of Columns": num_cols,
-            "Duplicate Rows": int(df.duplicated().sum()),
-            "Memory Usage": f"{df.memory_usage(deep=True).sum() / 1024**2:.2f} MB",
+            "Duplicate Rows": duplicate_rows,
+            "Memory Usage": f"{memory_usage / 1024**2:.2f} MB",
         },
         "column_details": column_details,
         "numeric_summary": numeric_summary,
     }
-    
+
+    timings["total"] = time.perf_counter() - total_start
+    for stage in timings:
+        timings[stage] = round(timings[stage], 4)
     return profile
 
 def get_profile_as_dict(df: pd.DataFrame) -> dict:
     """
     Generates a comprehensive profile of a pandas DataFrame and returns it as a dictionary.
     """
-    return get_profile(df)
\ No newline at end of file
+    return get_profile(df)
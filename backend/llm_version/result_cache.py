@@ -0,0 +1,189 @@
+import os
+import ast
+import io
+import re
+import json
+import pickle
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # results are pickled without it
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Results of generated code are kept per process, keyed by the dataset they ran on and the code,
+# so re-asked questions and repeated follow-ups skip the execution. Dataset keys are content
+# addressed and never change content, so entries never need invalidating.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1") == "1"
+# Budget for the stored (compressed) results, in bytes
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024**2)))
+# Results larger in memory than this fraction of the budget are not stored
+RESULT_CACHE_MAX_ENTRY_FRACTION = 0.25
+
+# Code calling any of these can give a different result each run
+_NONDETERMINISTIC = {"sample", "now", "today", "utcnow", "random", "rand", "randn", "randint", "shuffle", "permutation"}
+_NONDETERMINISTIC_SQL = re.compile(r"\b(random|uuid|gen_random_uuid|now|current_date|current_timestamp|today|using sample|tablesample)\b", re.IGNORECASE)
+
+
+def normalize_code(code: str, engine: str = "pandas") -> Optional[str]:
+    """
+    Canonical form of generated code for cache keys: its syntax tree, so comments, spacing and
+    quoting are ignored (SQL is kept as written, as spacing can matter inside its literals).
+    None when the code does not parse or is not deterministic.
+    """
+    if engine == "sql":
+        normalized = code.strip().rstrip(";").strip()
+        return None if _NONDETERMINISTIC_SQL.search(normalized) else normalized
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        name = node.attr if isinstance(node, ast.Attribute) else node.id if isinstance(node, ast.Name) else None
+        if name in _NONDETERMINISTIC:
+            return None
+    return ast.dump(tree, annotate_fields=False)
+
+
+def _serialize(df: pd.DataFrame) -> bytes:
+    # Compressed Arrow IPC; frames Arrow cannot represent (e.g. mixed object columns) are pickled.
+    # Arrow reads text back as the string dtype, so the object columns are listed in the schema
+    # metadata and converted back.
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df)
+            objects = [i for i, dtype in enumerate(df.dtypes) if dtype == object]
+            index_object = df.index.nlevels == 1 and df.index.dtype == object
+            metadata = {**table.schema.metadata, b"object_columns": json.dumps([objects, index_object]).encode()}
+            table = table.replace_schema_metadata(metadata)
+            sink = pa.BufferOutputStream()
+            options = ipc.IpcWriteOptions(compression="zstd" if pa.Codec.is_available("zstd") else None)
+            with ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            return b"A" + sink.getvalue().to_pybytes()
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+    return b"P" + pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _deserialize(data: bytes) -> pd.DataFrame:
+    if data[:1] == b"P":
+        return pickle.load(io.BytesIO(data[1:]))
+    table = ipc.open_stream(pa.py_buffer(data[1:])).read_all()
+    objects, index_object = json.loads(table.schema.metadata[b"object_columns"])
+    df = table.to_pandas()
+    for i in objects:
+        df.isetitem(i, df.iloc[:, i].astype(object))
+    if index_object:
+        df.index = df.index.astype(object)
+    return df
+
+
+class ResultCache:
+    """
+    Bounded in-memory cache of result_df frames, stored serialized so every hit returns a fresh
+    frame. Eviction is cost-aware (GreedyDual-Size-Frequency): an entry's priority is the clock
+    plus its uses times its execution seconds per stored byte, refreshed on each hit, and the
+    lowest priority goes first; evicting raises the clock to that priority, so entries that stop
+    being used age out however expensive they were.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, enabled: bool = RESULT_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._bytes = 0
+        self._clock = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "too_large": 0, "uncacheable": 0}
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(dataset_key: str, code: str, engine: str = "pandas") -> Optional[str]:
+        """
+        Key of the result of code on a dataset, or None when the result cannot be cached.
+        """
+        normalized = normalize_code(code, engine)
+        if normalized is None:
+            return None
+        return hashlib.sha256(f"{dataset_key}\0{engine}\0{normalized}".encode()).hexdigest()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _priority(self, entry: Dict[str, Any]) -> float:
+        return self._clock + entry["uses"] * entry["seconds"] / max(entry["bytes"], 1)
+
+    def get(self, key: Optional[str]) -> Optional[pd.DataFrame]:
+        if not self.enabled or key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.saved_seconds += entry["seconds"]
+            entry["uses"] += 1
+            entry["priority"] = self._priority(entry)
+            data = entry["data"]
+        return _deserialize(data)
+
+    def put(self, key: Optional[str], df: Any, seconds: float):
+        """
+        Stores the result of an execution that took `seconds`.
+        """
+        if not self.enabled or key is None:
+            return
+        if not isinstance(df, pd.DataFrame):
+            self._count("uncacheable")
+            return
+        if df.memory_usage(deep=True).sum() > self.max_bytes * RESULT_CACHE_MAX_ENTRY_FRACTION:
+            self._count("too_large")
+            return
+        try:
+            data = _serialize(df)
+        except Exception as e:
+            logger.debug(f"Result not cached: {e!r}")
+            self._count("uncacheable")
+            return
+        entry = {"data": data, "bytes": len(data), "seconds": seconds, "uses": 1}
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous["bytes"]
+            entry["priority"] = self._priority(entry)
+            self._entries[key] = entry
+            self._bytes += entry["bytes"]
+            self.counters["stores"] += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victim = min((k for k in self._entries if k != key), key=lambda k: self._entries[k]["priority"])
+                evicted = self._entries.pop(victim)
+                self._clock = evicted["priority"]
+                self._bytes -= evicted["bytes"]
+                self.counters["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "enabled": self.enabled,
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,40 @@
+"""
+Production launcher for the Data Explorer backend.
+
+    python -m backend.serve --version langgraph --workers 4
+
+With more than one worker the sessions, histories and upload jobs are kept in the
+shared SQLite session backend, and every worker memory-maps the uploaded datasets
+from the shared session store, so any worker can serve any data_id.
+"""
+import os
+import argparse
+import uvicorn
+
+APPS = {
+    "llm": "backend.llm_version.main:app",
+    "langgraph": "backend.LangGraph_version.main:app",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Data Explorer backend.")
+    parser.add_argument("--version", choices=sorted(APPS), default="langgraph")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Workers inherit the environment, so they all pick the shared backend
+        os.environ.setdefault("SESSION_BACKEND", "sqlite")
+        if os.environ["SESSION_BACKEND"] == "memory":
+            parser.error("SESSION_BACKEND=memory cannot be shared by several workers")
+        # Each worker has its own pool of execution processes: share the cores between them
+        os.environ.setdefault("EXEC_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    uvicorn.run(APPS[args.version], host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
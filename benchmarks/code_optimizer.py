@@ -0,0 +1,167 @@
+"""
+Code optimizer corpus: the generated-code patterns code_optimizer.py rewrites, checked to give
+the same result as the code as written, with the latency of each; and the patterns its cost
+guard rejects, with its estimates.
+
+    python -m benchmarks.code_optimizer [--csv PATH] [--scale N] [--cost-scale N] [--repeat N]
+
+Each rewrite case runs as written and rewritten on Project5.csv and on the CSV repeated --scale
+times (timed there: median of --repeat runs). Results must be identical: same values, dtypes,
+index and names (int32 columns whose products pass 2**31 check for overflow). Cases that must be
+left as written are checked not to be rewritten. sort_values(...).head(n) is the exception where the sort key has ties at the
+cut: the default sort orders tied rows arbitrarily and nlargest keeps the first, so there the
+sort key values must match ('ties'). Cost cases are only checked, on the CSV repeated
+--cost-scale times. Exits with status 1 if a case does not hold.
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+import pandas as pd
+
+from backend.LangGraph_version.code_checks import PrecheckError
+from backend.LangGraph_version.code_optimizer import optimize_code
+from backend.LangGraph_version.code_runner import EXEC_MAX_RSS_MB, EXEC_TIMEOUT_SECONDS, execute_code
+from backend.LangGraph_version.ingest import read_csv_compact
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+# name: (code, sort key compared when tied rows may differ, or None)
+REWRITES = {
+    "top 10 by revenue": ("result_df = df.sort_values('net_revenue', ascending=False).head(10)", ["net_revenue"]),
+    "bottom 5 by revenue": ("result_df = df.sort_values(by='net_revenue').head()", ["net_revenue"]),
+    "top 10 by units": ("result_df = df.sort_values('units_sold', ascending=False).head(10)", ["units_sold"]),
+    "top 5 north (iloc)": ("result_df = df[df['region'] == 'North'].sort_values(['net_revenue', 'units_sold'], "
+                           "ascending=[False, False]).iloc[:5]", ["net_revenue", "units_sold"]),
+    "top revenue values": ("result_df = df['net_revenue'].sort_values(ascending=False).head(10).reset_index()", ["net_revenue"]),
+    "row margin": ("df['margin'] = df.apply(lambda row: row['net_revenue'] - row['cogs'], axis=1)\n"
+                   "result_df = df[['sku', 'margin']]", None),
+    "row value": ("result_df = pd.DataFrame({'value': df.apply(lambda r: r['units_sold'] * r['unit_price'], axis=1)})", None),
+    "row net units": ("result_df = df.apply(lambda row: row['units_sold'] - row['returned_units'], axis=1).to_frame('net_units')", None),
+    "row flag": ("mask = df.apply(lambda row: row['region'] == 'North' and row['units_sold'] > 20, axis=1)\n"
+                 "result_df = df[mask]", None),
+    "row ratio (attributes)": ("result_df = df.apply(lambda row: row.net_revenue / row.units_sold, axis=1).to_frame('per_unit')", None),
+    "row overflow": ("result_df = df.apply(lambda row: row['year'] * row['year'] * 1000, axis=1).to_frame('big')", None),
+    "value apply": ("result_df = df['net_revenue'].apply(lambda x: x * 1.1).to_frame()", None),
+    "value map": ("result_df = df['units_sold'].map(lambda x: x * 2 + 1).to_frame()", None),
+    "value overflow": ("result_df = df['year'].map(lambda y: y * 2000000).to_frame()", None),
+    "value compare": ("result_df = df[df['units_sold'].apply(lambda x: x > 10)]", None),
+    "group key (loc)": ("result_df = pd.DataFrame({'avg_units': [df.groupby('region')['units_sold'].mean().loc['North']]})", None),
+    "group key (sum)": ("result_df = df.groupby('month')['net_revenue'].sum().loc[3]", None),
+    "group key (describe)": ("result_df = df.groupby('region')['net_revenue'].describe().loc['North'].to_frame()", None),
+    "group key (size)": ("result_df = pd.DataFrame({'orders': [df.groupby('segment').size().loc['SMB']]})", None),
+    "get_group": ("result_df = df.groupby('product_category').get_group('Hardware')", None),
+    "get_group (int key)": ("result_df = df.groupby('month').get_group(3)", None),
+}
+# Not rewritten: the per-row result differs from the vectorized one (division by a column with zeros
+# raises per row and gives inf over columns), .loc on a datetime group key matches partial dates
+# ('2024' is a whole year), and get_group of a missing group raises where a filter is empty
+UNCHANGED = {
+    "row ratio with zeros": "result_df = df.apply(lambda row: row['units_sold'] / row['returned_units'], axis=1).to_frame('ratio')",
+    "value power": "result_df = df['units_sold'].apply(lambda x: x ** 2).to_frame()",
+    "group key (datetime)": "result_df = df.groupby('date')['net_revenue'].sum().loc['2024'].to_frame()",
+    "get_group (missing)": "result_df = df.groupby('region').get_group('Nowhere')",
+}
+# Rejected at --cost-scale: (code, True) or run as written: (code, False)
+COSTS = {
+    "self-merge on region": ("result_df = df.merge(df, on='region')", True),
+    "cross merge": ("result_df = pd.merge(df, df[['region', 'net_revenue']], how='cross')", True),
+    "iterrows loop": ("values = []\nfor _, row in df.iterrows():\n    values.append(row['net_revenue'] - row['cogs'])\n"
+                      "result_df = pd.DataFrame({'margin': values})", True),
+    "merge of aggregates": ("totals = df.groupby('region', observed=True)['net_revenue'].sum().reset_index()\n"
+                            "result_df = df.merge(totals, on='region')", False),
+    "top 3 per region": ("totals = df.groupby(['region', 'product_name'], observed=True)['net_revenue'].sum().reset_index()\n"
+                         "result_df = totals.sort_values('net_revenue', ascending=False).groupby('region', observed=True).head(3)", False),
+}
+
+
+def identical(a, b) -> bool:
+    """Same values, dtypes, index and names (frames, series) or the same scalar."""
+    if isinstance(a, pd.DataFrame) or isinstance(a, pd.Series):
+        if type(a) is not type(b) or not a.index.equals(b.index) or not a.equals(b):
+            return False
+        if isinstance(a, pd.Series):
+            return a.name == b.name and a.dtype == b.dtype
+        return list(a.columns) == list(b.columns) and (a.dtypes == b.dtypes).all()
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+
+def same_up_to_ties(a, b, keys) -> bool:
+    """Whether two top-n results differ only in which rows tied on the sort key were kept."""
+    return (type(a) is type(b) and a.shape == b.shape and list(a.columns) == list(b.columns)
+            and a[keys].reset_index(drop=True).equals(b[keys].reset_index(drop=True)))
+
+
+def _timed(code: str, df: pd.DataFrame, repeat: int) -> float:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        execute_code(code, df)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scale", type=int, default=100, help="times the CSV is repeated for the timings")
+    parser.add_argument("--cost-scale", type=int, default=200, help="times the CSV is repeated for the cost guard")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.csv, "rb") as f:
+        base, _ = read_csv_compact(f)
+    scaled = pd.concat([base] * args.scale, ignore_index=True)
+    failed = []
+
+    print(f"Rewrites ({len(base):,} and {len(scaled):,} rows; timed on the latter)")
+    print(f"{'case':<24}{'written s':>11}{'rewritten s':>13}{'speedup':>9}  {'result':<11}rewrites")
+    for name, (code, keys) in REWRITES.items():
+        verdicts = []
+        for df in (base, scaled):
+            optimized, rewrites = optimize_code(code, df)
+            written, rewritten = execute_code(code, df), execute_code(optimized, df)
+            if not rewrites:
+                verdicts.append("NOT REWRITTEN")
+            elif identical(written, rewritten):
+                verdicts.append("identical")
+            elif keys is not None and same_up_to_ties(written, rewritten, keys):
+                verdicts.append("ties")
+            else:
+                verdicts.append("DIFFERENT")
+        verdict = "DIFFERENT" if "DIFFERENT" in verdicts else "NOT REWRITTEN" if "NOT REWRITTEN" in verdicts else \
+            "ties" if "ties" in verdicts else "identical"
+        if verdict in ("DIFFERENT", "NOT REWRITTEN"):
+            failed.append(name)
+        written_s, rewritten_s = _timed(code, scaled, args.repeat), _timed(optimized, scaled, args.repeat)
+        print(f"{name:<24}{written_s:>11.4f}{rewritten_s:>13.4f}{written_s / rewritten_s:>8.1f}x  {verdict:<11}"
+              f"{'; '.join(rewrites)}")
+
+    print("\nLeft as written")
+    for name, code in UNCHANGED.items():
+        rewrites = optimize_code(code, base)[1]
+        if rewrites:
+            failed.append(name)
+        print(f"{name:<24}{'REWRITTEN: ' + '; '.join(rewrites) if rewrites else 'unchanged'}")
+
+    df = pd.concat([base] * args.cost_scale, ignore_index=True)
+    print(f"\nCost guard ({len(df):,} rows; limits {EXEC_TIMEOUT_SECONDS:g}s, {EXEC_MAX_RSS_MB} MB)")
+    for name, (code, rejected) in COSTS.items():
+        try:
+            optimize_code(code, df, EXEC_TIMEOUT_SECONDS, EXEC_MAX_RSS_MB * 2**20)
+            outcome = "runs"
+        except PrecheckError as e:
+            outcome = f"rejected: {e}"
+        if outcome.startswith("rejected") != rejected:
+            failed.append(name)
+        print(f"{name:<24}{outcome}")
+
+    if failed:
+        print(f"\nFAILED: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Conversation memory benchmark: size of the query prompt as a session grows, with the whole
+history in the prompt versus the running summary plus a token-budgeted window of recent turns.
+
+    python -m benchmarks.conversation_memory [--backend llm_version|LangGraph_version] [--csv PATH]
+                                             [--turns N] [--every N]
+
+A session of --turns queries is run against the backend with the scripted fake LLM (offline).
+"full history" makes the recent window unbounded, which is what the LLM version's prompts
+carried before (the LangGraph nodes kept the last two turns); "memory" uses MEMORY_RECENT_TOKENS.
+Reported per checkpoint: estimated tokens of the query prompt, and of the summary updates
+(folds) sent to the model since the previous checkpoint.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import tempfile
+
+import httpx
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+# Answers about as long as the model's usual explanations (~60 words)
+EXPLANATION = ("I grouped the orders by region and added up the net revenue of each group. The North region "
+               "has the highest net revenue, followed by South, West and East. The differences between the "
+               "regions are small, within about twenty percent of each other, so no single region dominates. "
+               "The chart shows the totals side by side.")
+SCRIPT = {
+    "rules": [
+        {"match": r"running summary", "response": "The user has been comparing net revenue across regions; North leads."},
+        {"match": r"classify the user's query", "response": "code_generation"},
+        {"match": r"generate pandas code|User query:",
+         "response": json.dumps({"type": "code", "code": "result_df = df.head(10)", "explanation": EXPLANATION, "charts": []})},
+    ],
+    "default": "The user explored the dataset.",
+}
+
+
+def configure():
+    # The backends read their configuration when imported
+    directory = tempfile.mkdtemp(prefix="conversation_memory_")
+    script = os.path.join(directory, "script.json")
+    with open(script, "w") as f:
+        json.dump(SCRIPT, f)
+    os.environ.update({"LLM_PROVIDER": "fake", "LLM_FAKE_SCRIPT": script, "LLM_CACHE": "0", "PLAN_CACHE": "0",
+                       "FAST_CLASSIFY": "0", "SESSION_STORE_DIR": directory})
+    logging.disable(logging.WARNING)
+
+
+async def run_session(app, csv: str, turns: int, every: int, prompts: list, memory_module) -> list:
+    """
+    Runs the session and returns (turn, query prompt tokens, fold tokens since the last checkpoint) rows.
+    """
+    from backend.LangGraph_version.prompt_context import estimate_tokens
+
+    rows, since = [], len(prompts)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=600) as client:
+        with open(csv, "rb") as f:
+            data_id = (await client.post("/upload", files={"file": ("data.csv", f, "text/csv")})).json()["data_id"]
+        for turn in range(1, turns + 1):
+            response = await client.post("/process_query", json={"query": f"Show the total net revenue by region, take {turn}", "data_id": data_id})
+            response.raise_for_status()
+            # Summary updates run in the background after each turn; count them with the turn
+            await asyncio.gather(*list(memory_module._background_tasks))
+            if turn % every == 0 or turn == 1:
+                query_prompt = next(p for p in reversed(prompts) if "User query:" in p or "generate pandas code" in p)
+                folds = sum(estimate_tokens(p) for p in prompts[since:] if "running summary" in p)
+                rows.append((turn, estimate_tokens(query_prompt), folds))
+                since = len(prompts)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="llm_version", choices=["llm_version", "LangGraph_version"])
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--every", type=int, default=10, help="report every N turns")
+    args = parser.parse_args()
+
+    configure()
+    main_module = importlib.import_module(f"backend.{args.backend}.main")
+    memory_module = importlib.import_module(f"backend.{args.backend}.conversation_memory")
+    provider = importlib.import_module(f"backend.{args.backend}." + ("nodes" if args.backend == "LangGraph_version" else "llm_handler")).llm
+
+    # Every prompt sent to the model, in order
+    prompts = []
+    respond = provider.inner.respond
+
+    def recording_respond(prompt: str) -> str:
+        prompts.append(prompt)
+        return respond(prompt)
+
+    provider.inner.respond = recording_respond
+
+    results, window = {}, memory_module.MEMORY_RECENT_TOKENS
+    for name, budget in (("full history", 10**9), ("memory", window)):
+        memory_module.MEMORY_RECENT_TOKENS = budget
+        results[name] = asyncio.run(run_session(main_module.app, args.csv, args.turns, args.every, prompts, memory_module))
+
+    print(f"{args.backend}: {args.turns} turns, recent window {window} tokens (estimated tokens)")
+    print(f"{'turn':>6}{'full history prompt':>22}{'memory prompt':>16}{'summary updates':>18}")
+    for (turn, full, _), (_, memory, folds) in zip(results["full history"], results["memory"]):
+        print(f"{turn:>6}{full:>22}{memory:>16}{folds:>18}")
+
+
+if __name__ == "__main__":
+    main()
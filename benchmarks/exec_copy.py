@@ -0,0 +1,76 @@
+"""
+Execution copy benchmark: peak memory and latency of generated code when it gets a full
+copy of the dataset (EXEC_DATA=copy) versus a copy-on-write view of it (EXEC_DATA=view).
+
+    python -m benchmarks.exec_copy [--csv PATH] [--scales 10,100,500] [--repeat N]
+
+The CSV is repeated N times for each scale. Each query of the workload (from
+docs_for_my_reference/queries_to_test.md, as the model writes them) runs through
+code_runner.execute_code; reported per scale and mode: median latency over --repeat runs,
+and peak memory allocated by the execution (tracemalloc, measured in a separate run).
+"""
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+
+import pandas as pd
+
+from backend.LangGraph_version import code_runner
+from backend.LangGraph_version.ingest import read_csv_compact
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+QUERIES = {
+    "first rows": "result_df = df.head(5)",
+    "total net revenue": "result_df = pd.DataFrame({'total_net_revenue': [df['net_revenue'].sum()]})",
+    "avg units by region": "result_df = df.groupby('region', observed=True)['units_sold'].mean().reset_index()",
+    "north sales": "result_df = df[df['region'] == 'North']",
+    "margin column": ("df['margin'] = df['net_revenue'] - df['cogs']\n"
+                      "result_df = df.groupby('product_category', observed=True)['margin'].sum().reset_index()"),
+    "sort by revenue": "result_df = df.sort_values('net_revenue', ascending=False).head(10)",
+}
+
+
+def run(code: str, df: pd.DataFrame, repeat: int) -> tuple:
+    """(median seconds, peak MB) of executing code on df."""
+    seconds = statistics.median(_timed(code, df) for _ in range(repeat))
+    tracemalloc.start()
+    code_runner.execute_code(code, df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def _timed(code: str, df: pd.DataFrame) -> float:
+    start = time.perf_counter()
+    code_runner.execute_code(code, df)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scales", default="10,100,500", help="comma-separated times the CSV is repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.csv, "rb") as f:
+        base, _ = read_csv_compact(f)
+    for scale in (int(s) for s in args.scales.split(",")):
+        df = pd.concat([base] * scale, ignore_index=True)
+        size = df.memory_usage(deep=True).sum() / 2**20
+        print(f"\n{scale}x: {len(df):,} rows, {size:,.0f} MB in memory")
+        print(f"{'query':<22}{'copy s':>9}{'view s':>9}{'copy peak MB':>14}{'view peak MB':>14}")
+        for name, code in QUERIES.items():
+            results = {}
+            for mode in ("copy", "view"):
+                code_runner.EXEC_DATA = mode
+                results[mode] = run(code, df, args.repeat)
+            print(f"{name:<22}{results['copy'][0]:>9.3f}{results['view'][0]:>9.3f}"
+                  f"{results['copy'][1]:>14.1f}{results['view'][1]:>14.1f}")
+        del df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Execution sandbox benchmark: running generated pandas code on threads of the API process
+versus the pool of warm worker processes (EXEC_MODE).
+
+    python -m benchmarks.exec_sandbox [--csv PATH] [--scale N] [--repeat N] [--workers N]
+
+The CSV is repeated --scale times and written to the session store, which the workers
+memory-map. Reported per mode:
+  - latency of a group-by query (median of --repeat), and the first, cold execution;
+  - latency of that query while a CPU-bound pure-Python query runs next to it, which on
+    threads competes for the GIL;
+  - wall time of --workers CPU-bound queries run concurrently;
+  - for the process pool, how long a never-ending query takes to be stopped and the next
+    query to run.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+QUERY = "result_df = df.groupby(['region', 'product_category'], observed=True)['net_revenue'].sum().reset_index()"
+CPU_BOUND = "total = 0\nfor i in range(20_000_000):\n    total += i\nresult_df = df.head(1)"
+RUNAWAY = "while True:\n    pass\nresult_df = df"
+
+
+def timed(run, *args) -> float:
+    start = time.perf_counter()
+    run(*args)
+    return time.perf_counter() - start
+
+
+def wait_idle(sandbox):
+    # Workers start (and are replaced) in the background
+    while sandbox.get_stats()["idle"] < sandbox.workers:
+        time.sleep(0.05)
+
+
+def measure(name: str, run, repeat: int, workers: int) -> list:
+    rows = [(name, "cold query", timed(run, QUERY))]
+    rows.append((name, "query (median)", statistics.median(timed(run, QUERY) for _ in range(repeat))))
+    with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+        busy = pool.submit(run, CPU_BOUND)
+        time.sleep(0.2)
+        rows.append((name, "query next to a CPU-bound one", timed(run, QUERY)))
+        busy.result()
+        start = time.perf_counter()
+        list(pool.map(run, [CPU_BOUND] * workers))
+        rows.append((name, f"{workers} CPU-bound queries at once", time.perf_counter() - start))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scale", type=int, default=20, help="times the CSV is repeated")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # The backend reads its configuration when imported
+    os.environ["SESSION_STORE_DIR"] = tempfile.mkdtemp(prefix="exec_sandbox_")
+    from backend.LangGraph_version import session_store
+    from backend.LangGraph_version.code_runner import ExecutionLimitError, ProcessSandbox, execute_code
+    from backend.LangGraph_version.ingest import read_csv_compact
+
+    with open(args.csv, "rb") as f:
+        df, _ = read_csv_compact(f)
+    df = pd.concat([df] * args.scale, ignore_index=True)
+    key = str(uuid.uuid4())
+    session_store.save_dataframe(key, df)
+
+    rows = measure("thread", lambda code: execute_code(code, df), args.repeat, args.workers)
+    sandbox = ProcessSandbox(workers=args.workers + 1)
+    sandbox.start()
+    wait_idle(sandbox)
+    rows += measure("process", lambda code: sandbox.execute(code, df, key), args.repeat, args.workers)
+
+    sandbox.timeout = 1.0
+    start = time.perf_counter()
+    try:
+        sandbox.execute(RUNAWAY, df, key)
+    except ExecutionLimitError:
+        pass
+    rows.append(("process", "never-ending query stopped (timeout 1s)", time.perf_counter() - start))
+    rows.append(("process", "next query", timed(sandbox.execute, QUERY, df, key)))
+    wait_idle(sandbox)
+
+    print(f"{len(df):,} rows, {args.workers} concurrent queries")
+    print(f"{'mode':<9}{'measure':<42}{'seconds':>9}")
+    for mode, measure_name, seconds in rows:
+        print(f"{mode:<9}{measure_name:<42}{seconds:>9.3f}")
+    print(sandbox.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+LLM throughput benchmark: concurrent /process_query requests against a backend whose model is
+the scripted fake provider, so runs are offline and reproducible.
+
+    python -m benchmarks.llm_throughput [--backend LangGraph_version|llm_version] [--csv PATH]
+                                        [--requests N] [--latency S] [--concurrency N]
+                                        [--window MS ...] [--distinct N]
+
+The fake answers every prompt after --latency seconds and serves at most --concurrency calls
+at a time (a provider rate limit); a batch counts as one call. Each --window is a batch window
+in milliseconds (0 sends every prompt on its own). Requests cycle through --distinct different
+queries, so concurrent duplicates show the effect of coalescing. The LLM and plan caches are
+disabled and sessions are stored in a temporary directory.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+
+
+def configure(args):
+    # The backends read their configuration when imported
+    os.environ.update({
+        "LLM_PROVIDER": "fake", "LLM_FAKE_LATENCY": str(args.latency), "LLM_FAKE_CONCURRENCY": str(args.concurrency),
+        "LLM_CACHE": "0", "PLAN_CACHE": "0", "SESSION_STORE_DIR": tempfile.mkdtemp(prefix="llm_throughput_"),
+    })
+    logging.disable(logging.WARNING)
+
+
+async def run(app, csv: str, queries: list, requests: int) -> tuple:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=600) as client:
+        with open(csv, "rb") as f:
+            data_id = (await client.post("/upload", files={"file": ("data.csv", f, "text/csv")})).json()["data_id"]
+        latencies = []
+
+        async def one(i: int):
+            start = time.perf_counter()
+            response = await client.post("/process_query", json={"query": queries[i % len(queries)], "data_id": data_id})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return time.perf_counter() - start, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="LangGraph_version", choices=["LangGraph_version", "llm_version"])
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per fake LLM call")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent fake LLM calls (0 for unlimited)")
+    parser.add_argument("--window", type=float, nargs="+", default=[0, 20], help="batch windows to compare, in ms")
+    parser.add_argument("--distinct", type=int, default=50, help="different queries among the requests")
+    args = parser.parse_args()
+
+    configure(args)
+    main_module = importlib.import_module(f"backend.{args.backend}.main")
+    llm_module = importlib.import_module(f"backend.{args.backend}." + ("nodes" if args.backend == "LangGraph_version" else "llm_handler"))
+    from backend.LangGraph_version.llm_provider import BatchingProvider, FakeProvider
+
+    queries = [f"show the total net revenue for order batch {i}" for i in range(args.distinct)]
+    print(f"{args.backend}: {args.requests} requests, {args.distinct} distinct queries, "
+          f"fake latency {args.latency}s, provider concurrency {args.concurrency or 'unlimited'}")
+    print(f"{'configuration':<24}{'wall s':>8}{'req/s':>8}{'p50 s':>8}{'p95 s':>8}{'LLM calls':>11}{'coalesced':>11}{'max batch':>11}")
+    configurations = [("no coalescing", False, 0.0)] + [
+        (f"coalesce, window {window:g}ms" if window else "coalesce", True, window) for window in args.window
+    ]
+    for name, coalesce, window in configurations:
+        # A fresh fake per run: its concurrency limit belongs to the run's event loop
+        provider = BatchingProvider(FakeProvider(), coalesce=coalesce, window_seconds=window / 1000)
+        llm_module.llm = provider
+        if hasattr(main_module, "llm"):
+            # The LangGraph app imports the provider by name (memory summaries, /llm/stats)
+            main_module.llm = provider
+        wall, latencies = asyncio.run(run(main_module.app, args.csv, queries, args.requests))
+        stats = provider.get_stats()
+        print(f"{name:<24}{wall:>8.2f}{args.requests / wall:>8.1f}{statistics.median(latencies):>8.2f}"
+              f"{latencies[int(0.95 * (len(latencies) - 1))]:>8.2f}{stats['calls']:>11}{stats['coalesced']:>11}{stats['max_batch_size']:>11}")
+
+
+if __name__ == "__main__":
+    main()
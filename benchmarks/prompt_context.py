@@ -0,0 +1,81 @@
+"""
+Prompt-size benchmark: the dataset context pasted into LLM prompts before and after the
+compact schema summary.
+
+    python -m benchmarks.prompt_context [--csv PATH] [--wide COLUMNS] [--llm N]
+
+"before" is what the prompts used to carry: the full profile dict (LangGraph version) and
+the column list plus df.head() text (LLM version). "after" is build_schema_summary.
+A wide table is made by repeating the CSV's columns until it has --wide columns.
+With --llm N (needs GOOGLE_API_KEY), each context is also sent to Gemini N times and the
+median response latency is reported.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import pandas as pd
+
+from backend.LangGraph_version.ingest import read_csv_compact
+from backend.LangGraph_version.profiler import get_profile
+from backend.LangGraph_version.prompt_context import build_schema_summary, estimate_tokens
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+LLM_INSTRUCTION = "Reply with the single word OK. Dataset context follows:\n"
+
+
+def widen(df: pd.DataFrame, columns: int) -> pd.DataFrame:
+    parts = [df.add_suffix(f"_{i}") if i else df for i in range(-(-columns // len(df.columns)))]
+    return pd.concat(parts, axis=1).iloc[:, :columns]
+
+
+def contexts(df: pd.DataFrame) -> dict:
+    """
+    Builds each prompt context, returning {name: (text, build seconds)}.
+    """
+    built = {}
+    for name, build in (
+        ("before: profile dict", lambda: str(get_profile(df))),
+        ("before: columns + head()", lambda: f"{df.columns.tolist()}\n{df.head().to_string()}"),
+        ("after: schema summary", lambda: build_schema_summary(df)),
+    ):
+        start = time.perf_counter()
+        text = build()
+        built[name] = (text, time.perf_counter() - start)
+    return built
+
+
+def llm_latency(text: str, runs: int) -> float:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro")
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        llm.invoke(LLM_INSTRUCTION + text)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--wide", type=int, default=200, help="Column count of the widened table")
+    parser.add_argument("--llm", type=int, default=0, help="Gemini calls per context for latency (0 skips)")
+    args = parser.parse_args()
+
+    with open(args.csv, "rb") as f:
+        df, _ = read_csv_compact(f)
+    for label, frame in (("original", df), (f"wide ({args.wide} columns)", widen(df, args.wide))):
+        print(f"\n{label}: {len(frame)} rows x {len(frame.columns)} columns")
+        print(f"{'context':<28}{'chars':>10}{'~tokens':>10}{'build ms':>10}" + (f"{'LLM s':>10}" if args.llm else ""))
+        for name, (text, seconds) in contexts(frame).items():
+            row = f"{name:<28}{len(text):>10}{estimate_tokens(text):>10}{seconds * 1000:>10.1f}"
+            if args.llm:
+                row += f"{llm_latency(text, args.llm):>10.2f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
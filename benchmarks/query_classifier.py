@@ -0,0 +1,118 @@
+"""
+Query classifier benchmark: accuracy and latency of the local rule-based classifier on the
+test queries in docs_for_my_reference/queries_to_test.md, plus a few greetings and ranking
+words used for rows rather than a metric.
+
+    python -m benchmarks.query_classifier [--csv PATH] [--queries PATH] [--llm N]
+
+Expected labels come from the section a query is listed under (basic, complex and follow-up
+queries are code_generation, vague ones suggestion); a complex query whose note says it may
+be vague accepts either label. Follow-ups are classified with a conversation history.
+"local" decisions are those at or above the confidence threshold; the rest fall back to
+the LLM. With --llm N (needs GOOGLE_API_KEY), the LLM classifier is run N times on every
+query for comparison.
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import time
+
+import pandas as pd
+
+from backend.LangGraph_version.query_classifier import classify_locally, FAST_CLASSIFY_MIN_CONFIDENCE
+
+DOCS = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference")
+DEFAULT_CSV = os.path.join(DOCS, "problem_statement", "Project5.csv")
+DEFAULT_QUERIES = os.path.join(DOCS, "queries_to_test.md")
+GREETINGS = ["hi", "Hello!", "hey there, how are you?", "thanks a lot", "good morning"]
+# Ranking words naming rows or a count: requests for data, not for suggestions
+ROW_RANKINGS = ["show the top 10 rows", "show me the top 5 records", "list the first 20 rows", "top 3 entries"]
+SECTION_LABELS = {"basic": "code_generation", "vague": "suggestion", "more complex": "code_generation", "follow-up": "code_generation"}
+TIMING_RUNS = 200
+
+
+def load_cases(path: str) -> list:
+    """
+    Parses the test queries into (query, accepted labels, has_history) cases.
+    """
+    items, label = [], None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            heading = next((key for key in SECTION_LABELS if line.lower().startswith(key)), None)
+            if heading is not None:
+                label = SECTION_LABELS[heading]
+            elif re.match(r"(\*|\d+\.)\s", line) and label is not None:
+                items.append([line, label])
+            elif line and items:
+                # Wrapped continuation of the previous item
+                items[-1][0] += " " + line
+    cases = []
+    for item, label in items:
+        # "* query (note)" or "1. First query: query" / "2. Follow-up: query"
+        match = re.match(r"(?:\*|(\d+)\.)\s+(?:(?:First query|Follow-up):\s*)?(.*?)\s*(\((.*)\))?\.?$", item)
+        accepted = {label}
+        if match.group(4) and re.search(r"vague|suggestion", match.group(4), re.I):
+            accepted.add("suggestion")
+        cases.append((match.group(2), accepted, match.group(1) == "2"))
+    return ([(q, {"greeting"}, False) for q in GREETINGS] + [(q, {"code_generation"}, False) for q in ROW_RANKINGS]
+            + cases)
+
+
+def llm_classify(query: str, has_history: bool, runs: int):
+    from backend.LangGraph_version.nodes import _llm_classify
+    from backend.LangGraph_version.conversation_memory import get_memory, format_memory
+
+    history = [{"query": "Show the total net revenue by region.", "response": {}}] if has_history else []
+    conversation = format_memory(get_memory(None, history))
+    latencies, label = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        state = {"query": query, "chat_history": history, "conversation": conversation, "bypass_cache": True}
+        label = asyncio.run(_llm_classify(state))["classification"]
+        latencies.append(time.perf_counter() - start)
+    return label, statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--queries", default=DEFAULT_QUERIES)
+    parser.add_argument("--llm", type=int, default=0, help="LLM classifications per query for comparison (0 skips)")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, nrows=1000)
+    columns = df.columns.tolist()
+    numeric_columns = [c for c in columns if pd.api.types.is_numeric_dtype(df[c])]
+    cases = load_cases(args.queries)
+
+    results = []
+    print(f"{'query':<60}{'expected':>26}{'local':>17}{'conf':>6}{'us':>8}" + (f"{'LLM':>17}{'LLM s':>7}" if args.llm else ""))
+    for query, accepted, has_history in cases:
+        result = classify_locally(query, columns, numeric_columns, has_history)
+        start = time.perf_counter()
+        for _ in range(TIMING_RUNS):
+            classify_locally(query, columns, numeric_columns, has_history)
+        micros = (time.perf_counter() - start) / TIMING_RUNS * 1e6
+        results.append((result, accepted, micros))
+        row = f"{query[:58]:<60}{'/'.join(sorted(accepted)):>26}{str(result.label):>17}{result.confidence:>6.2f}{micros:>8.1f}"
+        if args.llm:
+            label, seconds = llm_classify(query, has_history, args.llm)
+            row += f"{label:>17}{seconds:>7.2f}"
+        print(row)
+
+    latencies = sorted(micros for _, _, micros in results)
+    print(f"\n{len(cases)} queries, local latency mean {statistics.mean(latencies):.1f} us, "
+          f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f} us")
+    print(f"{'threshold':>10}{'local':>8}{'coverage':>10}{'accuracy':>10}")
+    for threshold in sorted({0.6, 0.7, 0.8, 0.9, FAST_CLASSIFY_MIN_CONFIDENCE}):
+        local = [(r, accepted) for r, accepted, _ in results if r.label is not None and r.confidence >= threshold]
+        correct = sum(r.label in accepted for r, accepted in local)
+        accuracy = f"{correct / len(local):.0%}" if local else "-"
+        print(f"{threshold:>10.2f}{len(local):>8}{len(local) / len(cases):>10.0%}{accuracy:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Result cache benchmark: latency of re-running generated code versus serving its cached
+result_df, and the cache's footprint.
+
+    python -m benchmarks.result_cache [--csv PATH] [--scale N] [--repeat N]
+
+Each query of the workload (docs_for_my_reference/queries_to_test.md, as the model writes
+them) runs on the CSV repeated --scale times: once to fill the cache, then --repeat times
+from it. Reported per query: execution seconds, median hit seconds, and the stored bytes
+next to the result's size in memory.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+QUERIES = {
+    "first rows": "result_df = df.head(5)",
+    "avg units by region": "result_df = df.groupby('region', observed=True)['units_sold'].mean().reset_index()",
+    "correlation": "result_df = df[['units_sold', 'net_revenue']].corr()",
+    "monthly revenue": "result_df = df.groupby(df['date'].dt.to_period('M'))['net_revenue'].sum().reset_index()",
+    "top 3 per region": ("totals = df.groupby(['region', 'product_name'], observed=True)['net_revenue'].sum().reset_index()\n"
+                         "result_df = totals.sort_values('net_revenue', ascending=False).groupby('region', observed=True).head(3)"),
+    "north sales": "result_df = df[df['region'] == 'North']",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scale", type=int, default=100, help="times the CSV is repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # The backend reads its configuration when imported; the thread path times the execution itself
+    os.environ.update({"SESSION_STORE_DIR": tempfile.mkdtemp(prefix="result_cache_"), "EXEC_MODE": "thread"})
+    from backend.LangGraph_version.code_runner import run_code
+    from backend.LangGraph_version.ingest import read_csv_compact
+    from backend.LangGraph_version.result_cache import result_cache
+
+    with open(args.csv, "rb") as f:
+        base, _ = read_csv_compact(f)
+    df = pd.concat([base] * args.scale, ignore_index=True)
+    dataset_key = str(uuid.uuid4())
+
+    async def timed(code: str) -> float:
+        start = time.perf_counter()
+        await run_code(code, df, dataset_key)
+        return time.perf_counter() - start
+
+    async def run():
+        rows = []
+        for name, code in QUERIES.items():
+            executed = await timed(code)
+            hit = statistics.median([await timed(code) for _ in range(args.repeat)])
+            result = await run_code(code, df, dataset_key)
+            rows.append((name, executed, hit, result.memory_usage(deep=True).sum()))
+        return rows
+
+    rows = asyncio.run(run())
+    stats = result_cache.get_stats()
+    print(f"{len(df):,} rows; cache holds {stats['entries']} results in {stats['bytes'] / 2**20:.2f} MB")
+    print(f"{'query':<22}{'execute s':>11}{'hit s':>9}{'result MB':>11}")
+    for name, executed, hit, size in rows:
+        print(f"{name:<22}{executed:>11.4f}{hit:>9.4f}{size / 2**20:>11.2f}")
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
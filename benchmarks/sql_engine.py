@@ -0,0 +1,116 @@
+"""
+Query engine benchmark: the queries of docs_for_my_reference/queries_to_test.md as the model
+writes them for the 'pandas' engine (generated pandas code) and the 'sql' engine (generated
+DuckDB SQL), on Project5.csv repeated 1, 10 and 100 times.
+
+    python -m benchmarks.sql_engine [--csv PATH] [--scales 1,10,100] [--repeat N]
+
+Both run through code_runner.run_code as the backends do, with the result cache off: pandas
+on the execution threads over a copy-on-write view of the frame in memory (EXEC_MODE=thread,
+so no worker round trip is counted), DuckDB over the memory-mapped Arrow file of the session
+store. Larger scales need memory for the frame and both results of the row-returning queries
+(1000x, about 6M rows, takes over 6 GB). Reported per query: median seconds of each engine, and whether the results agree
+(same rows and values, up to float rounding and row order where the query has none).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "docs_for_my_reference", "problem_statement", "Project5.csv")
+# name: (pandas code, SQL)
+QUERIES = {
+    "first 5 rows": ("result_df = df.head(5)", "SELECT * FROM df LIMIT 5"),
+    "distinct regions": ("result_df = pd.DataFrame({'region': df['region'].unique()})",
+                         "SELECT DISTINCT region FROM df"),
+    "total net revenue": ("result_df = pd.DataFrame({'total_net_revenue': [df['net_revenue'].sum()]})",
+                          "SELECT SUM(net_revenue) AS total_net_revenue FROM df"),
+    "avg units by region": ("result_df = df.groupby('region', observed=True)['units_sold'].mean().reset_index()",
+                            "SELECT region, AVG(units_sold) AS units_sold FROM df GROUP BY region"),
+    "sort by net revenue": ("result_df = df.sort_values('net_revenue', ascending=False)",
+                            "SELECT * FROM df ORDER BY net_revenue DESC"),
+    "units/revenue corr": ("result_df = pd.DataFrame({'correlation': [df['units_sold'].corr(df['net_revenue'])]})",
+                           "SELECT corr(units_sold, net_revenue) AS correlation FROM df"),
+    "monthly seasonality": ("result_df = df.groupby(df['date'].dt.to_period('M').dt.to_timestamp())['net_revenue'].sum().rename_axis('month').reset_index()",
+                            "SELECT date_trunc('month', date) AS month, SUM(net_revenue) AS net_revenue FROM df GROUP BY 1"),
+    "top 3 per region": ("totals = df.groupby(['region', 'product_name'], observed=True)['net_revenue'].sum().reset_index()\n"
+                         "result_df = totals.sort_values('net_revenue', ascending=False).groupby('region', observed=True).head(3)",
+                         "SELECT region, product_name, SUM(net_revenue) AS net_revenue FROM df GROUP BY region, product_name "
+                         "QUALIFY row_number() OVER (PARTITION BY region ORDER BY SUM(net_revenue) DESC) <= 3"),
+    "north sales": ("result_df = df[df['region'] == 'North']", "SELECT * FROM df WHERE region = 'North'"),
+    "north hardware": ("result_df = df[(df['region'] == 'North') & (df['product_category'] == 'Hardware')]",
+                       "SELECT * FROM df WHERE region = 'North' AND product_category = 'Hardware'"),
+}
+
+
+def same_result(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """Whether two results have the same rows, ignoring row order, index and dtypes."""
+    if a.shape != b.shape:
+        return False
+    a, b = a.reset_index(drop=True), b.reset_index(drop=True)
+    b.columns = a.columns
+    # Compare as text, rounding floats (the engines add in different orders)
+    def canonical(df):
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_float_dtype(df[column]):
+                df[column] = df[column].map(lambda v: f"{v:.6g}")
+            else:
+                df[column] = df[column].astype(str)
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+    return canonical(a).equals(canonical(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--scales", default="1,10,100", help="comma-separated times the CSV is repeated")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # The backend reads its configuration when imported
+    os.environ.update({"SESSION_STORE_DIR": tempfile.mkdtemp(prefix="sql_engine_"), "EXEC_MODE": "thread",
+                       "RESULT_CACHE": "0"})
+    from backend.LangGraph_version import session_store
+    from backend.LangGraph_version.code_runner import run_code
+    from backend.LangGraph_version.ingest import read_csv_compact
+    from backend.LangGraph_version.sql_engine import DUCKDB_THREADS
+
+    with open(args.csv, "rb") as f:
+        base, _ = read_csv_compact(f)
+
+    async def timed(code: str, df: pd.DataFrame, dataset_key: str, engine: str):
+        seconds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = await run_code(code, df, dataset_key, engine)
+            seconds.append(time.perf_counter() - start)
+        return statistics.median(seconds), result
+
+    for scale in (int(s) for s in args.scales.split(",")):
+        df = pd.concat([base] * scale, ignore_index=True) if scale > 1 else base
+        dataset_key = str(uuid.uuid4())
+        session_store.save_dataframe(dataset_key, df)
+        print(f"\n{scale}x: {len(df):,} rows ({DUCKDB_THREADS} DuckDB threads)")
+        print(f"{'query':<22}{'pandas s':>10}{'sql s':>10}{'speedup':>9}  same")
+        totals = np.zeros(2)
+        for name, (code, sql) in QUERIES.items():
+            pandas_seconds, pandas_result = asyncio.run(timed(code, df, dataset_key, "pandas"))
+            sql_seconds, sql_result = asyncio.run(timed(sql, df, dataset_key, "sql"))
+            totals += (pandas_seconds, sql_seconds)
+            print(f"{name:<22}{pandas_seconds:>10.4f}{sql_seconds:>10.4f}{pandas_seconds / sql_seconds:>8.1f}x  "
+                  f"{'yes' if same_result(pandas_result, sql_result) else 'NO'}")
+            del pandas_result, sql_result
+        print(f"{'total':<22}{totals[0]:>10.4f}{totals[1]:>10.4f}{totals[0] / totals[1]:>8.1f}x")
+        session_store.delete_dataframe(dataset_key)
+        del df
+
+
+if __name__ == "__main__":
+    main()
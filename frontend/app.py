@@ -5,6 +5,8 @@ import plotly.express as px
 import json
 import subprocess
 import os
+import sys
+import time
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -24,10 +26,14 @@ def init_session_state():
         st.session_state.chat_history = []
     if 'profile' not in st.session_state:
         st.session_state.profile = None
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
     if 'markdown_preview' not in st.session_state:
         st.session_state.markdown_preview = None
     if 'server_process' not in st.session_state:
         st.session_state.server_process = None
+    if 'pending_query' not in st.session_state:
+        st.session_state.pending_query = None
 
 init_session_state()
 
@@ -42,22 +48,178 @@ def get_history(data_id):
     except Exception as e:
         st.error(f"Error getting history: {e}")
 
+def refresh_pending_insights(data_id):
+    """
+    Fetches insights that were still being generated when the history was loaded.
+    """
+    for event_id, event in enumerate(st.session_state.chat_history):
+        if event.get('response', {}).get('insight_status') != 'pending':
+            continue
+        try:
+            response = requests.get(f"{BACKEND_URL}/insight/{data_id}/{event_id}")
+            if response.status_code == 200:
+                event['response'].update(response.json())
+        except Exception as e:
+            st.error(f"Error getting insight: {e}")
+            return
+
+def stream_events(response):
+    """
+    Parses a server-sent event stream into (event, data) pairs.
+    """
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data))
+            event, data = None, []
+
+# What the backend is working on after each streamed event
+STREAM_STATUS = {
+    "classification": "Generating code...",
+    "plan": "Running the code...",
+    "retry": "The code failed, generating it again...",
+}
+
 def process_query(query_text):
+    # The answer is streamed and rendered as each step completes
     payload = {"query": query_text, "data_id": st.session_state.data_id}
     try:
-        response = requests.post(f"{BACKEND_URL}/process_query", json=payload)
-        if response.status_code == 200:
-            # After processing, just update the history, which will trigger a rerun
-            get_history(st.session_state.data_id)
-        else:
-            st.error(f"Error from backend: {response.text}")
+        with requests.post(f"{BACKEND_URL}/process_query/stream", json=payload, stream=True) as response:
+            if response.status_code != 200:
+                st.error(f"Error from backend: {response.text}")
+                return
+            with st.chat_message("user"):
+                st.markdown(query_text)
+            with st.chat_message("assistant"):
+                placeholder = st.empty()
+                partial = {}
+                for event, data in stream_events(response):
+                    if event == "error" and "detail" in data:
+                        st.error(f"Error from backend: {data['detail']}")
+                        return
+                    partial.update(data)
+                    status = STREAM_STATUS.get(event)
+                    if event == "classification" and data["classification"] != "code_generation":
+                        status = None
+                    with placeholder.container():
+                        render_response(partial, key_prefix="live", interactive=False)
+                        if status:
+                            st.caption(status)
+        # After processing, just update the history, which will trigger a rerun
+        get_history(st.session_state.data_id)
     except requests.exceptions.ConnectionError:
         st.error("Connection Error: Could not connect to the backend.")
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
 
+def get_upload_job(job_id):
+    try:
+        response = requests.get(f"{BACKEND_URL}/jobs/{job_id}")
+        if response.status_code == 200:
+            return response.json()
+        st.error(f"Could not retrieve upload status: {response.text}")
+    except Exception as e:
+        st.error(f"Error getting upload status: {e}")
+    return None
+
+def wait_for_parse(job_id):
+    """
+    Polls the upload job until the CSV is parsed. Profiling may still be running afterwards.
+    """
+    status = st.empty()
+    while True:
+        job = get_upload_job(job_id)
+        if job is None:
+            return None
+        if job['status'] == 'failed':
+            status.empty()
+            st.error(f"Upload failed: {job['error']}")
+            return None
+        if job['status'] in ('profiling', 'done'):
+            status.empty()
+            return job
+        status.info(f"Parsing file... {job['rows_parsed']:,} rows parsed")
+        time.sleep(0.5)
+
+def refresh_profile():
+    job = get_upload_job(st.session_state.job_id)
+    if job and job['status'] == 'done':
+        st.session_state.profile = job.get('profile')
+    return job
+
 # --- UI Rendering ---
 
+def render_response(response, key_prefix, interactive=True):
+    """
+    Renders an assistant response. Partial responses (while streaming) are rendered with
+    interactive=False, which shows follow-up queries as text instead of buttons.
+    """
+    response_type = response.get("classification") or response.get("type")
+
+    if response_type == "code_generation" or response_type == "code":
+        if response.get("explanation"):
+            st.info(response["explanation"])
+        if 'dataframe' not in response:
+            return
+        
+        # Display charts in tabs
+        if response.get("charts"):
+            st.subheader("Charts")
+            chart_tabs = st.tabs([spec['type'].capitalize() for spec in response["charts"]])
+            for i, spec in enumerate(response["charts"]):
+                with chart_tabs[i]:
+                    chart_df = pd.DataFrame(response['dataframe'], columns=response['columns'])
+                    try:
+                        if spec['type'] == 'bar':
+                            fig = px.bar(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
+                        elif spec['type'] == 'pie':
+                            fig = px.pie(chart_df, names=spec['names_column'], values=spec['values_column'], color_discrete_sequence=px.colors.sequential.RdBu)
+                        elif spec['type'] == 'line':
+                            fig = px.line(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
+                        elif spec['type'] == 'scatter':
+                            fig = px.scatter(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
+                        st.plotly_chart(fig, use_container_width=True)
+                    except Exception as e:
+                        st.error(f"Could not create {spec['type']} chart: {e}")
+            st.divider()
+
+        # Display dataframe
+        st.subheader("Data View")
+        display_df = pd.DataFrame(response['dataframe'], columns=response['columns'])
+        st.dataframe(display_df)
+
+        # Display insight (generated in the background after the result)
+        if response.get("insight_status") == "pending" and not response.get("insight"):
+            st.caption("💡 Looking for insights...")
+        if response.get("insight"):
+            st.markdown("--- ")
+            insight = response["insight"]
+            st.info(f"💡 **Proactive Insight:** {insight['insight']}")
+            if not interactive:
+                st.markdown(f"> {insight['follow_up_query']}")
+            elif st.button(insight['follow_up_query'], key=f"insight_{key_prefix}"):
+                st.session_state.pending_query = insight['follow_up_query']
+                st.rerun()
+
+    elif response_type == "suggestion" or response_type == "suggestions":
+        if not response.get('suggestions'):
+            return
+        st.warning("💡 Your query is a bit vague. Please choose a more specific option below:")
+        for i, suggestion in enumerate(response['suggestions']):
+            if not interactive:
+                st.markdown(f"**{suggestion['query']}**")
+            elif st.button(suggestion['query'], key=f"suggestion_{key_prefix}_{i}"):
+                st.session_state.pending_query = suggestion['query']
+                st.rerun()
+            st.markdown(f"> {suggestion['explanation']}")
+    
+    elif response_type == "error":
+        st.error(response.get("explanation", "An unknown error occurred."))
+
 def render_chat():
     for event in st.session_state.chat_history:
         with st.chat_message("user"):
@@ -69,59 +231,7 @@ def render_chat():
                 if not isinstance(response, dict):
                     st.error("Invalid response from backend.")
                     continue
-
-                response_type = response.get("classification") or response.get("type")
-
-                if response_type == "code_generation" or response_type == "code":
-                    st.info(response.get("explanation", ""))
-                    
-                    # Display charts in tabs
-                    if response.get("charts"):
-                        st.subheader("Charts")
-                        chart_tabs = st.tabs([spec['type'].capitalize() for spec in response["charts"]])
-                        for i, spec in enumerate(response["charts"]):
-                            with chart_tabs[i]:
-                                chart_df = pd.DataFrame(response['dataframe'], columns=response['columns'])
-                                try:
-                                    if spec['type'] == 'bar':
-                                        fig = px.bar(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
-                                    elif spec['type'] == 'pie':
-                                        fig = px.pie(chart_df, names=spec['names_column'], values=spec['values_column'], color_discrete_sequence=px.colors.sequential.RdBu)
-                                    elif spec['type'] == 'line':
-                                        fig = px.line(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
-                                    elif spec['type'] == 'scatter':
-                                        fig = px.scatter(chart_df, x=spec['x_column'], y=spec['y_column'], color=spec.get('color_column'))
-                                    st.plotly_chart(fig, use_container_width=True)
-                                except Exception as e:
-                                    st.error(f"Could not create {spec['type']} chart: {e}")
-                        st.divider()
-
-                    # Display dataframe
-                    st.subheader("Data View")
-                    display_df = pd.DataFrame(response['dataframe'], columns=response['columns'])
-                    st.dataframe(display_df)
-
-                    # Display insight
-                    if response.get("insight"):
-                        st.markdown("--- ")
-                        insight = response["insight"]
-                        st.info(f"💡 **Proactive Insight:** {insight['insight']}")
-                        if st.button(insight['follow_up_query'], key=f"insight_{event['query']}"):
-                            with st.spinner('Discovering more insights...'):
-                                process_query(insight['follow_up_query'])
-                            st.rerun()
-
-                elif response_type == "suggestion" or response_type == "suggestions":
-                    st.warning("💡 Your query is a bit vague. Please choose a more specific option below:")
-                    for i, suggestion in enumerate(response['suggestions']):
-                        if st.button(suggestion['query'], key=f"suggestion_{event['query']}_{i}"):
-                            with st.spinner('Thinking...'):
-                                process_query(suggestion['query'])
-                            st.rerun()
-                        st.markdown(f"> {suggestion['explanation']}")
-                
-                elif response_type == "error":
-                    st.error(response.get("explanation", "An unknown error occurred."))
+                render_response(response, key_prefix=event['query'])
             except Exception as e:
                 st.error(f"An error occurred while rendering the response: {e}")
 
@@ -133,10 +243,9 @@ def start_server(version):
     if st.session_state.server_process:
         st.session_state.server_process.kill()
     
-    if version == "LLM Version":
-        command = ["uvicorn", "backend.llm_version.main:app", "--host", "127.0.0.1", "--port", "8000", "--reload"]
-    else:
-        command = ["uvicorn", "backend.LangGraph_version.main:app", "--host", "127.0.0.1", "--port", "8000", "--reload"]
+    # The launcher runs one worker per core on a shared session backend
+    backend_version = "llm" if version == "LLM Version" else "langgraph"
+    command = [sys.executable, "-m", "backend.serve", "--version", backend_version, "--host", "127.0.0.1", "--port", "8000"]
     
     st.session_state.server_process = subprocess.Popen(command)
     st.success(f"Started {version} server.")
@@ -172,11 +281,14 @@ with st.sidebar:
                 response = requests.post(f"{BACKEND_URL}/upload", files=files)
                 if response.status_code == 200:
                     response_data = response.json()
-                    st.session_state.data_id = response_data['data_id']
-                    st.session_state.profile = response_data['profile']
-                    st.session_state.chat_history = [] # Reset history on new upload
-                    st.success('File Uploaded!')
-                    st.rerun()
+                    job = wait_for_parse(response_data['job_id'])
+                    if job is not None:
+                        st.session_state.data_id = response_data['data_id']
+                        st.session_state.job_id = response_data['job_id']
+                        st.session_state.profile = job.get('profile')
+                        st.session_state.chat_history = [] # Reset history on new upload
+                        st.success('File Uploaded!')
+                        st.rerun()
                 else:
                     st.error(f"Error: {response.text}")
             except Exception as e:
@@ -207,9 +319,19 @@ with st.sidebar:
 if st.session_state.data_id is None:
     st.info("Please upload a CSV file to begin.")
 else:
+    # The profile is computed in the background after parsing; pick it up once it is ready
+    if st.session_state.profile is None and st.session_state.job_id:
+        job = refresh_profile()
+        if job and job['status'] == 'profiling':
+            st.info(f"Profiling data... {job['columns_profiled']}/{job['total_columns']} columns. You can start asking questions already.")
+            if st.button("Refresh Profile"):
+                st.rerun()
+
     # Display Data Profile
     if st.session_state.profile:
         with st.expander("📊 Data Profile & Quality Check"):
+            if 'approximate' in st.session_state.profile:
+                st.caption("Approximate profile: distinct counts, duplicate rows and percentiles are estimates (see error bounds below).")
             st.subheader("Dataset Summary")
             summary = st.session_state.profile['dataset_summary']
             cols = st.columns(4)
@@ -231,11 +353,19 @@ else:
             else:
                 st.write("No numeric columns found in the dataset.")
 
+            if 'approximate' in st.session_state.profile:
+                st.subheader("Error Bounds")
+                st.json(st.session_state.profile['approximate'], expanded=False)
+
     # Render the chat history
+    refresh_pending_insights(st.session_state.data_id)
     render_chat()
 
-    # Chat input
-    if prompt := st.chat_input("What would you like to ask?"):
+    # Chat input (follow-up buttons queue their query for this run)
+    prompt = st.chat_input("What would you like to ask?")
+    if st.session_state.pending_query:
+        prompt, st.session_state.pending_query = st.session_state.pending_query, None
+    if prompt:
         process_query(prompt)
         st.rerun()
 